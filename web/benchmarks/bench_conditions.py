@@ -0,0 +1,93 @@
+"""Time needed to find the conditions satisfied by a record, on a channel
+with many threshold and range conditions, or string conditions, on the same
+field.
+
+Not collected by `./manage.py test', run it with:
+
+    ./manage.py test benchmarks.bench_conditions
+"""
+
+from django.test import TestCase
+
+from sest.models import *
+from sest.conditions import CompiledConditions
+
+import random
+import string
+import time
+from types import SimpleNamespace
+
+N_CONDITIONS = (100, 1000, 5000)
+N_VALUES = 200
+
+
+def linear_matches(conditions, fields):
+    """Check the conditions one by one, as check_and_react did before the
+    conditions were compiled.
+    """
+
+    return [c for c in conditions for f in fields if c.check_condition(f)]
+
+
+class ConditionsBenchmark(TestCase):
+
+    def make_conditions(self, n, rnd):
+        conditions = []
+        for _ in range(n):
+            op = rnd.choice(("lt", "le", "gt", "ge", "bt", "ot"))
+            low = rnd.uniform(-100, 100)
+            cond = ConditionAndReaction(field_no=1, action="email",
+                                        condition_op=op, val=low)
+            if op in ("bt", "ot"):
+                cond.val_opt = low + rnd.uniform(0, 20)
+            conditions.append(cond)
+        return conditions
+
+    def measure(self, check, values):
+        start = time.perf_counter()
+        for v in values:
+            check([SimpleNamespace(field_no=1, val=v)])
+        return (time.perf_counter() - start) / len(values) * 1e6
+
+    def test_conditions_per_field(self):
+        rnd = random.Random(0)
+        values = [rnd.uniform(-150, 150) for _ in range(N_VALUES)]
+
+        print()
+        for n in N_CONDITIONS:
+            conditions = self.make_conditions(n, rnd)
+            compiled = CompiledConditions(conditions)
+
+            for name, check in (
+                    ("linear", lambda f: linear_matches(conditions, f)),
+                    ("indexed, all", compiled.all_matches),
+                    ("indexed, first", compiled.first_match)):
+                print("{} conditions, {}: {:.0f} us/record".format(
+                    n, name, self.measure(check, values)))
+
+    def test_string_conditions_per_field(self):
+        rnd = random.Random(0)
+
+        def word(length):
+            return "".join(rnd.choice(string.ascii_lowercase[:8])
+                           for _ in range(length))
+
+        values = [word(40) for _ in range(N_VALUES)]
+
+        print()
+        for n in N_CONDITIONS:
+            conditions = [
+                ConditionAndReaction(field_no=1, action="email",
+                                     condition_op=rnd.choice(("cn", "nc",
+                                                              "sw", "ew")),
+                                     val=word(rnd.randint(3, 8)))
+                for _ in range(n)
+            ]
+            compiled = CompiledConditions(conditions)
+
+            for name, check in (
+                    ("linear", lambda f: linear_matches(conditions, f)),
+                    ("indexed, all", compiled.all_matches),
+                    ("indexed, first", compiled.first_match)):
+                print("{} string conditions, {}: {:.0f} us/record".format(
+                    n, name, self.measure(check, values)))
@@ -0,0 +1,68 @@
+"""Number of queries and time needed to save the records uploaded to a channel.
+
+Not collected by `./manage.py test', run it with:
+
+    ./manage.py test benchmarks.bench_ingest
+"""
+
+from django.test import TestCase, Client
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from sest.models import *
+from sest.ingest import ingest_record
+
+import time
+
+N_UPLOADS = 200
+
+
+def legacy_upload(channel, fields):
+    """The steps the upload view performed before the ingest module: create
+    the record, then each field, then save the record again to trigger the
+    reactions.
+    """
+
+    r = Record.objects.create(channel=channel)
+    for field_name, val in fields.items():
+        r.field_set.create(field_no=int(field_name[len("field"):]), val=val)
+    r.save()
+
+
+class IngestBenchmark(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.u = User.objects.create(username="bench")
+        self.ch = Channel.objects.create(
+            user=self.u, number_fields=settings.MAX_NUMBER_FIELDS)
+        self.channel_uuid = str(self.ch.write_key)
+        for i in range(1, settings.MAX_NUMBER_FIELDS + 1):
+            self.ch.fieldmetadata_set.create(field_no=i, encoding="float")
+        self.ch.conditionandreaction_set.create(condition_op="lt", field_no=1,
+                                                val=-1000, action="email")
+
+    def measure(self, upload, fields):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            for _ in range(N_UPLOADS):
+                upload(self.ch, fields)
+            elapsed = time.perf_counter() - start
+
+        queries = [q for q in ctx.captured_queries
+                   if "SAVEPOINT" not in q["sql"]]
+        return len(queries) / N_UPLOADS, elapsed / N_UPLOADS * 1e6
+
+    def test_queries_per_upload(self):
+        print()
+        for n_fields in range(1, settings.MAX_NUMBER_FIELDS + 1):
+            fields = {"field{}".format(i): str(i)
+                      for i in range(1, n_fields + 1)}
+
+            for name, upload in (("legacy", legacy_upload),
+                                 ("ingest", ingest_record)):
+                n_queries, usec = self.measure(upload, fields)
+                print("{} field(s), {}: {:.1f} queries/upload, "
+                      "{:.0f} us/upload".format(
+                          n_fields, name, n_queries, usec))
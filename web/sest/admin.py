@@ -17,3 +17,5 @@ class UserAdmin(admin.ModelAdmin):
 # admin.site.register(User, UserAdmin)
 
 admin.site.register(Channel)
+admin.site.register(OutboxMessage)
+admin.site.register(Rollup)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class SestConfig(AppConfig):
     name = 'sest'
+
+    def ready(self):
+        # Connect the receivers that invalidate the caches.
+        from . import signals  # noqa: F401
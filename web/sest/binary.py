@@ -0,0 +1,151 @@
+"""Compact binary format for the uploads of constrained devices.
+
+A frame, sent as the body of a POST with CONTENT_TYPE to the URL of the
+channel, is made of (all the numbers are little endian, as on the ESP8266):
+
+    header  "SE" magic bytes, version (uint8, = 1), number of records (uint16)
+    record  flags (uint8), [timestamp (uint32)], number of fields (uint8),
+            then the fields
+    field   field number (uint8), type (uint8), value
+
+The timestamp (seconds since the unix epoch) is present only when bit 0 of the
+flags is set. Types of the values:
+
+    1  float32         3  int32
+    2  float64         4  int64
+    5  string: length (uint8) followed by as many bytes, utf-8 encoded
+
+A frame with a record of two float32 fields takes 19 bytes, against the 29 of
+the form-encoded body "field1=21.5000&field2=43.0000".
+"""
+
+from django.utils import timezone
+
+from .ingest import IngestError, messages
+
+import struct
+from datetime import datetime
+
+CONTENT_TYPE = "application/x-sest-binary"
+
+MAGIC = b"SE"
+VERSION = 1
+FLAG_TIMESTAMP = 0x01
+
+HEADER = struct.Struct("<2sBH")
+RECORD = struct.Struct("<B")
+TIMESTAMP = struct.Struct("<I")
+N_FIELDS = struct.Struct("<B")
+FIELD = struct.Struct("<BB")
+
+TYPE_FLOAT32 = 1
+TYPE_FLOAT64 = 2
+TYPE_INT32 = 3
+TYPE_INT64 = 4
+TYPE_STRING = 5
+
+NUMBERS = {
+    TYPE_FLOAT32: struct.Struct("<f"),
+    TYPE_FLOAT64: struct.Struct("<d"),
+    TYPE_INT32: struct.Struct("<i"),
+    TYPE_INT64: struct.Struct("<q"),
+}
+STRING_LENGTH = struct.Struct("<B")
+
+
+def parse_frame(body):
+    """Decode a frame into a list of (timestamp, {field_no: value}) tuples,
+    ready for `ingest.validate_numbered_batch'.
+    """
+
+    buf = memoryview(body)
+
+    try:
+        magic, version, n_records = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION or not n_records:
+            raise IngestError(messages["WRONG_BINARY_FORMAT"])
+        offset = HEADER.size
+
+        records = []
+        for _ in range(n_records):
+            flags, = RECORD.unpack_from(buf, offset)
+            offset += RECORD.size
+
+            timestamp = None
+            if flags & FLAG_TIMESTAMP:
+                epoch, = TIMESTAMP.unpack_from(buf, offset)
+                offset += TIMESTAMP.size
+                timestamp = datetime.fromtimestamp(epoch, tz=timezone.utc)
+
+            n_fields, = N_FIELDS.unpack_from(buf, offset)
+            offset += N_FIELDS.size
+
+            values = {}
+            for _ in range(n_fields):
+                field_no, value_type = FIELD.unpack_from(buf, offset)
+                offset += FIELD.size
+
+                if value_type in NUMBERS:
+                    number = NUMBERS[value_type]
+                    values[field_no], = number.unpack_from(buf, offset)
+                    offset += number.size
+
+                elif value_type == TYPE_STRING:
+                    length, = STRING_LENGTH.unpack_from(buf, offset)
+                    offset += STRING_LENGTH.size
+                    if offset + length > len(buf):
+                        raise IngestError(messages["WRONG_BINARY_FORMAT"])
+                    values[field_no] = str(buf[offset:offset + length],
+                                           "utf-8")
+                    offset += length
+
+                else:
+                    raise IngestError(messages["WRONG_BINARY_FORMAT"])
+
+            records.append((timestamp, values))
+
+    except (struct.error, UnicodeDecodeError):
+        # Frames truncated, or with strings not utf-8 encoded.
+        raise IngestError(messages["WRONG_BINARY_FORMAT"])
+
+    if offset != len(buf):
+        raise IngestError(messages["WRONG_BINARY_FORMAT"])
+
+    return records
+
+
+def encode_frame(records):
+    """Build a frame from a list of (timestamp, {field_no: value}) tuples,
+    where the timestamp is a unix epoch or None.
+
+    Floats are encoded as float64, ints as int32 (or int64 when they don't
+    fit) and strings as they are: devices short of bandwidth can pack their
+    floats as float32 instead.
+    """
+
+    chunks = [HEADER.pack(MAGIC, VERSION, len(records))]
+
+    for timestamp, values in records:
+        if timestamp is None:
+            chunks.append(RECORD.pack(0))
+        else:
+            chunks.append(RECORD.pack(FLAG_TIMESTAMP))
+            chunks.append(TIMESTAMP.pack(int(timestamp)))
+        chunks.append(N_FIELDS.pack(len(values)))
+
+        for field_no, value in sorted(values.items()):
+            if isinstance(value, str):
+                encoded = value.encode("utf-8")
+                chunks.append(FIELD.pack(field_no, TYPE_STRING))
+                chunks.append(STRING_LENGTH.pack(len(encoded)) + encoded)
+            elif isinstance(value, float):
+                chunks.append(FIELD.pack(field_no, TYPE_FLOAT64))
+                chunks.append(NUMBERS[TYPE_FLOAT64].pack(value))
+            elif -2 ** 31 <= value < 2 ** 31:
+                chunks.append(FIELD.pack(field_no, TYPE_INT32))
+                chunks.append(NUMBERS[TYPE_INT32].pack(value))
+            else:
+                chunks.append(FIELD.pack(field_no, TYPE_INT64))
+                chunks.append(NUMBERS[TYPE_INT64].pack(value))
+
+    return b"".join(chunks)
@@ -0,0 +1,87 @@
+"""Process-wide caches of data attached to the channels.
+
+Every entry is loaded with a single call to the loader function the first time
+it's requested, and is dropped when the cache is full (least recently used
+entries go first), when it's older than the time to live or when it's
+explicitly invalidated (see signals.py).
+The time to live bounds how long the other processes serving the project keep
+using stale entries, since invalidation only happens in the process that
+changed the DB.
+"""
+
+from django.conf import settings
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class ChannelCache:
+
+    def __init__(self, loader, max_size=None, ttl=None):
+        self._loader = loader
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Incremented on every invalidation, to avoid storing entries loaded
+        # while the data they come from was changing.
+        self._generation = 0
+
+    @property
+    def max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return settings.CHANNEL_CACHE_SIZE
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return settings.CHANNEL_CACHE_TTL
+
+    def get(self, channel_id):
+        """Return the entry of the channel, loading it in case it's missing
+        or expired.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generation
+            try:
+                loaded_at, value = self._entries[channel_id]
+            except KeyError:
+                pass
+            else:
+                if now - loaded_at < self.ttl:
+                    self._entries.move_to_end(channel_id)
+                    return value
+
+        # Load outside the lock, so that a slow query doesn't block the other
+        # threads; at worst the same entry is loaded twice.
+        value = self._loader(channel_id)
+
+        with self._lock:
+            if generation != self._generation:
+                return value
+            self._entries[channel_id] = (now, value)
+            self._entries.move_to_end(channel_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return value
+
+    def invalidate(self, channel_id=None):
+        """Drop the entry of a channel, or all of them if no channel is
+        given.
+        """
+
+        with self._lock:
+            self._generation += 1
+            if channel_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(channel_id, None)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,355 @@
+"""Conditions of the channels, compiled to be checked against the records
+uploaded without querying the DB.
+
+The ConditionAndReaction objects of a channel are grouped by the field number
+they check, and each one is turned into a predicate on the value of the field,
+with the thresholds already parsed and the operator already chosen. Checking
+a record then costs a lookup for each of its fields, plus the predicates of
+the conditions on that field only.
+
+The numeric thresholds and ranges on a field are moreover indexed (see
+thresholds.py), so that busy channels, with hundreds of conditions on the
+same field, find the ones satisfied by a value with a few bisections; so are
+the string conditions (see patterns.py), matched in a single pass over the
+value.
+
+The conditions that remember their past (see debounce.py), and the ones on
+the aggregates of the last values of a field (see windows.py), are kept
+apart, in `CompiledConditions.stateful' and `windowed', and checked one by
+one.
+"""
+
+from .cache import ChannelCache
+from .thresholds import ThresholdIndex, IntervalTree
+from .patterns import PatternIndex
+
+import math
+import operator as op
+from operator import itemgetter
+
+COMPARISONS = {
+    "lt": op.lt,
+    "le": op.le,
+    "eq": op.eq,
+    "ne": op.ne,
+    "gt": op.gt,
+    "ge": op.ge,
+}
+
+STRING_OPERATIONS = ("cn", "nc", "sw", "ew")
+
+
+def compile_condition(cond, margin=0):
+    """Return a function that tells whether a value of the field satisfies
+    the condition (see ConditionAndReaction for the operators).
+
+    The thresholds of lt, le, gt, ge, bt and ot are moved by `margin' in
+    favour of the condition, e.g. `gt 10' with margin 2 is satisfied by the
+    values greater than 8.
+
+    Raise a ValueError in case the operator is not defined, or the values of
+    the condition don't suit it.
+    """
+
+    operation = cond.condition_op
+
+    if operation in COMPARISONS:
+        compare, threshold = COMPARISONS[operation], cond.val
+        if margin and operation in ("lt", "le"):
+            threshold += margin
+        elif margin and operation in ("gt", "ge"):
+            threshold -= margin
+        return lambda v: compare(v, threshold)
+
+    elif operation in ("bt", "ot"):
+        low, high = cond.val, cond.val_opt
+        if operation == "bt":
+            low, high = low - margin, high + margin
+            return lambda v: low < v < high
+        low, high = low + margin, high - margin
+        return lambda v: not (low < v < high)
+
+    elif operation in STRING_OPERATIONS:
+        s = cond.val
+        if operation == "cn":
+            return lambda v: s in v
+        elif operation == "nc":
+            return lambda v: s not in v
+        elif operation == "sw":
+            return lambda v: v.startswith(s)
+        return lambda v: v.endswith(s)
+
+    raise ValueError("No conditional operation is defined for operation "
+                     "'{}'.".format(operation))
+
+
+def is_stateful(cond):
+    """Tell whether the condition needs to remember the previous records
+    (see debounce.py).
+    """
+
+    return bool(cond.cooldown or cond.on_transition or cond.hysteresis)
+
+
+def _failing(error):
+    def predicate(v):
+        raise error
+    return predicate
+
+
+def _bounds(cond):
+    """Return the thresholds of a numeric condition that can be indexed, or
+    None.
+    """
+
+    try:
+        if cond.condition_op in COMPARISONS:
+            bounds = (cond.val,)
+        elif cond.condition_op in ("bt", "ot"):
+            bounds = (cond.val, cond.val_opt)
+        else:
+            return None
+    except (TypeError, ValueError):
+        return None
+
+    if not all(math.isfinite(b) for b in bounds):
+        return None
+    if len(bounds) == 2 and not bounds[0] < bounds[1]:
+        # Empty ranges: bt is never satisfied, ot always.
+        return None
+    return bounds
+
+
+def _indexable(v):
+    return (isinstance(v, (int, float)) and not isinstance(v, bool) and
+            not math.isnan(v))
+
+
+class FieldConditions:
+    """The conditions on a field of a channel, as (position, condition,
+    predicate) tuples sorted by position.
+
+    Numbers are looked up in the indexes of the thresholds and of the
+    ranges, strings in the index of the string conditions; the conditions
+    that don't suit the type of the value, and all of them when the value
+    is neither, are checked one by one.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        # The conditions checked one by one, for numbers and for strings.
+        self.numeric_others = []
+        self.string_others = []
+
+        thresholds = {}
+        between, outside, patterns = [], [], []
+        for position, cond, predicate in entries:
+            bounds = _bounds(cond)
+            if bounds is None:
+                self.numeric_others.append((position, cond, predicate))
+            elif cond.condition_op == "bt":
+                between.append(bounds + (position, cond))
+            elif cond.condition_op == "ot":
+                outside.append(bounds + (position, cond))
+            else:
+                thresholds.setdefault(cond.condition_op, []).append(
+                    (bounds[0], position, cond))
+
+            if (cond.condition_op in STRING_OPERATIONS and
+                    isinstance(cond.val, str)):
+                patterns.append((cond.condition_op, cond.val, position,
+                                 cond))
+            else:
+                self.string_others.append((position, cond, predicate))
+
+        self.thresholds = [ThresholdIndex(operation, t)
+                           for operation, t in thresholds.items()]
+        self.between = IntervalTree(between)
+        # The values out of a range are the ones not inside it.
+        self.outside = IntervalTree(outside)
+        self.outside_entries = sorted((position, cond)
+                                      for _, _, position, cond in outside)
+        self.patterns = PatternIndex(patterns)
+
+    def _outside(self, v):
+        inside = {position for position, _ in self.outside.stab(v)}
+        return (e for e in self.outside_entries if e[0] not in inside)
+
+    def _indexed(self, v):
+        """Return the indexed entries satisfied by `v', and the ones to
+        check one by one; or None if `v' can't be looked up.
+        """
+
+        if isinstance(v, str):
+            return self.patterns.matches(v), self.string_others
+
+        if not _indexable(v):
+            return None
+
+        found = []
+        for index in self.thresholds:
+            found.extend(index.matches(v))
+        found.extend(self.between.stab(v))
+        if self.outside_entries:
+            found.extend(self._outside(v))
+        return found, self.numeric_others
+
+    def matches(self, v):
+        """Return the (position, condition) tuples satisfied by the value
+        `v', sorted by position.
+        """
+
+        indexed = self._indexed(v)
+        if indexed is None:
+            return [(position, cond)
+                    for position, cond, predicate in self.entries
+                    if predicate(v)]
+
+        found, others = indexed
+        found.extend((position, cond)
+                     for position, cond, predicate in others
+                     if predicate(v))
+
+        found.sort(key=itemgetter(0))
+        return found
+
+    def first(self, v, before=None):
+        """Return the (position, condition) tuple with the lowest position
+        satisfied by the value `v', or None.
+
+        As the conditions checked one by one stopped at the first one
+        satisfied, the ones not indexed are checked only up to the first
+        match, and before the position `before' if not None.
+        """
+
+        if isinstance(v, str):
+            candidates = [self.patterns.first(v)]
+            others = self.string_others
+        elif _indexable(v):
+            candidates = [index.first(v) for index in self.thresholds]
+            between = self.between.stab(v)
+            if between:
+                candidates.append(min(between))
+            if self.outside_entries:
+                candidates.append(next(self._outside(v), None))
+            others = self.numeric_others
+        else:
+            candidates = []
+            others = self.entries
+
+        candidates = [c for c in candidates if c is not None]
+        best = min(candidates) if candidates else None
+        if best is not None:
+            before = best[0] if before is None else min(before, best[0])
+
+        # The entries are in order of position.
+        for position, cond, predicate in others:
+            if before is not None and position >= before:
+                break
+            if predicate(v):
+                return (position, cond)
+        return best
+
+
+class CompiledConditions:
+    """The conditions of a channel, keyed by field number (see
+    FieldConditions).
+
+    Conditions keep the order they're given in, which decides the one that
+    reacts when a record satisfies many of them.
+
+    The stateful conditions are in `stateful', as {field number: [(position,
+    condition, predicate, hold)]}, where `hold' is the predicate that keeps
+    the condition satisfied once it is, widened by its hysteresis; the ones
+    on an aggregate are in `windowed', in the same way.
+    """
+
+    def __init__(self, conditions):
+        by_field = {}
+        self.stateful = {}
+        self.windowed = {}
+        self.count = 0
+
+        for position, cond in enumerate(conditions):
+            try:
+                predicate = compile_condition(cond)
+                hold = compile_condition(cond, cond.hysteresis)
+            except (ValueError, TypeError) as e:
+                # Raise only when a field checked by the condition arrives,
+                # as the conditions checked one by one did.
+                predicate = hold = _failing(e)
+
+            if cond.aggregate:
+                self.windowed.setdefault(cond.field_no, []).append(
+                    (position, cond, predicate, hold))
+            elif is_stateful(cond):
+                self.stateful.setdefault(cond.field_no, []).append(
+                    (position, cond, predicate, hold))
+            else:
+                by_field.setdefault(cond.field_no, []).append(
+                    (position, cond, predicate))
+            self.count += 1
+
+        self.by_field = {field_no: FieldConditions(entries)
+                         for field_no, entries in by_field.items()}
+
+    def __len__(self):
+        return self.count
+
+    def first_match(self, fields, extra=()):
+        """Return the first condition satisfied by one of the fields, or
+        None.
+
+        `extra' are more (position, condition) tuples to choose from, such
+        as the stateful and windowed conditions that can react.
+        """
+
+        best = min(extra) if extra else None
+        for f in fields:
+            conditions = self.by_field.get(f.field_no)
+            if conditions is None:
+                continue
+
+            found = conditions.first(f.val,
+                                     None if best is None else best[0])
+            if found is not None and (best is None or found < best):
+                best = found
+
+        return best[1] if best is not None else None
+
+    def all_matches(self, fields, extra=()):
+        """Return all the conditions satisfied by the fields, in order, along
+        with the ones of the (position, condition) tuples in `extra'.
+        """
+
+        found = list(extra)
+        for f in fields:
+            conditions = self.by_field.get(f.field_no)
+            if conditions is not None:
+                found.extend(conditions.matches(f.val))
+
+        found.sort(key=itemgetter(0))
+        return [cond for _, cond in found]
+
+
+def load_conditions(channel_id):
+    # Imported here since the models use the cache too.
+    from .models import ConditionAndReaction
+
+    return CompiledConditions(ConditionAndReaction.objects
+                              .filter(channel=channel_id)
+                              .select_related("channel__notification_email")
+                              .order_by("pk"))
+
+
+conditions = ChannelCache(load_conditions)
+
+
+def get_conditions(channel_id):
+    """Return the CompiledConditions of the channel.
+
+    The conditions are shared with the other requests served by the process:
+    don't modify them.
+    """
+
+    return conditions.get(channel_id)
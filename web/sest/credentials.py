@@ -0,0 +1,36 @@
+"""Cache of the channels, used to authenticate the uploads.
+
+Keeping the channels (hence their write keys and their limits) in memory lets
+the upload view refuse requests with a wrong write key without querying the
+DB. Channels that don't exist are cached too, as None.
+"""
+
+from .cache import ChannelCache
+
+# The largest value of an AutoField, on every DB backend.
+MAX_CHANNEL_ID = 2 ** 31 - 1
+
+
+def load_channel(channel_id):
+    # Imported here since the models use the caches too.
+    from .models import Channel
+
+    return Channel.objects.filter(pk=channel_id).first()
+
+
+channels = ChannelCache(load_channel)
+
+
+def get_channel(channel_id):
+    """Return the channel with the given id, or None if it doesn't exist.
+
+    The object is shared with the other requests served by the process:
+    don't modify it.
+    """
+
+    channel_id = int(channel_id)
+    # Ids out of the range of the primary keys would make the DB raise an
+    # error (e.g. an OverflowError on SQLite) instead of finding nothing.
+    if not 0 < channel_id <= MAX_CHANNEL_ID:
+        return None
+    return channels.get(channel_id)
@@ -0,0 +1,210 @@
+"""State of the conditions that remember the records already checked, to
+avoid a reaction (e.g. an email) for every record of a value that keeps on
+satisfying a condition, or that hovers around its threshold.
+
+A ConditionAndReaction with a `cooldown' doesn't react again for that many
+seconds after a reaction, measured on the time of the records; one with
+`on_transition' reacts only to the first record of a series satisfying it;
+one with a `hysteresis' stays satisfied until the value goes past its
+thresholds by that amount, e.g. `gt 30' with hysteresis 2 is satisfied by
+31, and then by 29 too, but no longer by 28:
+
+    30.5 29.5 30.5 29.5 28 31    gt 30, on_transition
+    ^                      ^     without hysteresis, all but 28 react
+                                 with hysteresis 2, only these two
+
+The state of these conditions, i.e. whether the last record satisfied them
+and the time of their last reaction, is kept in a process-wide cache (see
+cache.py) and written to the DB as ConditionState rows every time it
+changes, so that it survives restarts. Each record is checked against a
+copy of the states, which replaces the cached one only once the transaction
+writing it is committed (at once, outside of transactions): when it's
+rolled back, e.g. in outbox mode (see dispatch.py), both the DB and the
+cache are left as they were.
+
+Records of the same channel checked at the same time, by other threads or
+processes, see the same state: each state is written only if the row in the
+DB still holds the state read (or doesn't exist yet, for a new one), and a
+condition whose state has been changed in the meanwhile doesn't react, so
+that only one of the records reacts to a transition or after a cooldown.
+The states of the channel are then read again from the DB. Otherwise, like
+the other caches, the ones of other processes serving the same channel
+catch up with the DB only after CHANNEL_CACHE_TTL.
+
+The conditions on the aggregates of the last values of a field (see
+windows.py) are checked here too, with their windows updated under the same
+lock, and can be stateful as well.
+"""
+
+from django.db import transaction, IntegrityError
+
+from .cache import ChannelCache
+from .conditions import is_stateful
+from .windows import windows
+
+import copy
+import threading
+from datetime import timedelta
+
+
+def load_states(channel_id):
+    # Imported here since the models use this module.
+    from .models import ConditionState
+
+    return {s.condition_id: s for s in
+            ConditionState.objects.filter(condition__channel=channel_id)}
+
+
+states = ChannelCache(load_states)
+
+# The states and the windows are read and updated by all the threads of the
+# process; the lock is never held while querying the DB.
+_lock = threading.Lock()
+
+
+class StateTracker:
+    """Update the state of the stateful conditions of a channel, and the
+    windows of the ones on an aggregate (see windows.py), with a record.
+    """
+
+    def __init__(self, channel_id, record):
+        self.channel_id = channel_id
+        self.record = record
+        self.now = record.insertion_time
+        # {condition pk: copy of its state}, for the conditions checked, and
+        # {condition pk: (active, last_fired)} of the states as they were
+        # read, or None for the new ones.
+        self.working = {}
+        self.read = {}
+        self.changed = set()
+        self._states = None
+
+    @property
+    def states(self):
+        # Loaded only for the channels with stateful conditions.
+        if self._states is None:
+            self._states = states.get(self.channel_id)
+        return self._states
+
+    def _state(self, cond):
+        from .models import ConditionState
+
+        state = self.working.get(cond.pk)
+        if state is None:
+            cached = self.states.get(cond.pk)
+            if cached is None:
+                state = ConditionState(condition_id=cond.pk)
+                self.read[cond.pk] = None
+            else:
+                state = copy.copy(cached)
+                self.read[cond.pk] = (cached.active, cached.last_fired)
+            self.working[cond.pk] = state
+        return state
+
+    def _may_react(self, cond, state, was_active):
+        if cond.on_transition and was_active:
+            return False
+        if cond.cooldown and state.last_fired is not None:
+            return self.now - state.last_fired >= timedelta(
+                seconds=cond.cooldown)
+        return True
+
+    def _check(self, cond, predicate, hold, v):
+        """Tell whether the condition can react to the value `v', remembering
+        whether it satisfies it.
+        """
+
+        if not is_stateful(cond):
+            return predicate(v)
+
+        state = self._state(cond)
+        was_active = state.active
+        state.active = (hold if was_active else predicate)(v)
+        if state.active != was_active:
+            self.changed.add(cond.pk)
+        return state.active and self._may_react(cond, state, was_active)
+
+    def check(self, compiled, fields):
+        """Return the (position, condition) tuples of the stateful and of the
+        windowed conditions of `compiled' (see CompiledConditions) that can
+        react to the fields.
+        """
+
+        # Read from the DB, if needed, before taking the lock.
+        if compiled.stateful or compiled.windowed:
+            self.states
+        channel_windows = (windows.get(self.channel_id) if compiled.windowed
+                           else None)
+
+        found = []
+        with _lock:
+            for f in fields:
+                for position, cond, predicate, hold in compiled.stateful.get(
+                        f.field_no, ()):
+                    if self._check(cond, predicate, hold, f.val):
+                        found.append((position, cond))
+
+            if channel_windows is not None:
+                channel_windows.update(self.record, fields)
+                for f in fields:
+                    for position, cond, predicate, hold in (
+                            compiled.windowed.get(f.field_no, ())):
+                        v = channel_windows.aggregate(cond)
+                        if v is not None and self._check(cond, predicate,
+                                                         hold, v):
+                            found.append((position, cond))
+        return found
+
+    def _write(self, state):
+        """Write the state to the DB, unless it has been changed since it
+        was read; return whether it has been written.
+        """
+
+        from .models import ConditionState
+
+        read = self.read[state.pk]
+        if read is None:
+            try:
+                with transaction.atomic():
+                    state.save(force_insert=True)
+            except IntegrityError:
+                return False
+            return True
+
+        active, last_fired = read
+        return ConditionState.objects.filter(
+            pk=state.pk, active=active, last_fired=last_fired).update(
+            active=state.active, last_fired=state.last_fired) == 1
+
+    def save(self, reacting):
+        """Remember the reaction of the conditions `reacting' to the record,
+        write the states changed to the DB, and to the cache once the
+        transaction is committed, and return the conditions that can still
+        react, i.e. the ones whose state hasn't been changed in the
+        meanwhile.
+        """
+
+        for cond in reacting:
+            if cond.pk in self.working:
+                self.working[cond.pk].last_fired = self.now
+                self.changed.add(cond.pk)
+
+        written, lost = [], set()
+        for pk in self.changed:
+            if self._write(self.working[pk]):
+                written.append(self.working[pk])
+            else:
+                lost.add(pk)
+        self.changed = set()
+
+        if lost:
+            states.invalidate(self.channel_id)
+        if written:
+            transaction.on_commit(lambda: self._publish(written))
+        return [cond for cond in reacting if cond.pk not in lost]
+
+    def _publish(self, changed):
+        cached = states.get(self.channel_id)
+        with _lock:
+            for state in changed:
+                cached[state.condition_id] = state
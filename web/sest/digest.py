@@ -0,0 +1,172 @@
+"""Digests of the reactions, used when REACTIONS_MODE = "digest".
+
+Instead of an email for every reaction, the reactions are collected in
+memory for each recipient (a NotificationEmail can be linked to many
+channels), and sent DIGEST_WINDOW seconds after the first one in a single
+email, listing the records that satisfied the conditions. Every recipient
+then gets at most an email per window, however many channels and conditions
+react; the records listed are at most DIGEST_MAX_RECORDS, the others are
+only counted.
+
+The digests are collected by each process on its own: with many web workers,
+a recipient may get an email per window from each of them.
+
+As with the "pool" mode, the reactions still collected are lost if the
+process is killed; those collected when it exits normally are sent then.
+"""
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .email_collection import build_email, send_emails
+
+import atexit
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Digest:
+    """The reactions collected for a recipient, as (condition, record)
+    tuples.
+    """
+
+    def __init__(self, address, started):
+        self.address = address
+        self.started = started
+        self.reactions = []
+        self.count = 0
+
+    def email(self):
+        lines = ["{}: {}".format(cond.channel, record)
+                 for cond, record in self.reactions]
+        if self.count > len(self.reactions):
+            lines.append("... and {} more.".format(
+                self.count - len(self.reactions)))
+
+        body = ("The following records verified some of the conditions you "
+                "set on your channels:\n\n" + "\n".join(lines))
+        return build_email(
+            recipients_list=[self.address],
+            subject="Alert. {} conditions validated on your channels".format(
+                self.count),
+            text_body=body,
+        )
+
+
+class DigestCollector:
+
+    def __init__(self, window, max_records):
+        self.window = window
+        self.max_records = max_records
+        # {address: Digest}, in the order the digests have been started,
+        # which is also the order they're due.
+        self._digests = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self.collected = 0
+        self.sent = 0
+
+    def add(self, cond, record):
+        """Collect the reaction of the condition satisfied by the record."""
+
+        notification_email = cond.channel.notification_email
+        if not notification_email:
+            raise ValueError("No email connected to the "
+                             "channel {}.".format(cond.channel))
+        address = notification_email.email
+
+        with self._condition:
+            digest = self._digests.get(address)
+            if digest is None:
+                digest = Digest(address, time.monotonic())
+                self._digests[address] = digest
+                self._condition.notify()
+            digest.count += 1
+            if len(digest.reactions) < self.max_records:
+                digest.reactions.append((cond, record))
+            self.collected += 1
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work,
+                                                daemon=True,
+                                                name="sest-digests")
+                self._thread.start()
+
+    def _pop_due(self, now, everything=False):
+        with self._condition:
+            due = [d for d in self._digests.values()
+                   if everything or d.started + self.window <= now]
+            for d in due:
+                del self._digests[d.address]
+            return due
+
+    def flush(self, everything=False):
+        """Send the digests whose window is over, or all of them, and return
+        the number of them sent.
+        """
+
+        emails = []
+        for d in self._pop_due(time.monotonic(), everything):
+            # A digest that can't be built is given up, not the others.
+            try:
+                emails.append(d.email())
+            except Exception:
+                logger.exception("Building the digest of %s failed.",
+                                 d.address)
+        if emails:
+            send_emails(emails)
+            with self._condition:
+                self.sent += len(emails)
+        return len(emails)
+
+    def _next_due(self):
+        # Wait until the oldest digest is due.
+        with self._condition:
+            while True:
+                if not self._digests:
+                    self._condition.wait()
+                    continue
+                oldest = next(iter(self._digests.values()))
+                delay = oldest.started + self.window - time.monotonic()
+                if delay <= 0:
+                    return
+                self._condition.wait(delay)
+
+    def _work(self):
+        while True:
+            self._next_due()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Sending the digests failed.")
+            finally:
+                # The records are read from the DB in this thread.
+                close_old_connections()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "recipients": len(self._digests),
+                "waiting": sum(d.count for d in self._digests.values()),
+                "collected": self.collected,
+                "sent": self.sent,
+            }
+
+
+_collector = None
+_collector_lock = threading.Lock()
+
+
+def get_digests():
+    """Return the collector of the digests shared by the whole process."""
+
+    global _collector
+    with _collector_lock:
+        if _collector is None:
+            _collector = DigestCollector(settings.DIGEST_WINDOW,
+                                         settings.DIGEST_MAX_RECORDS)
+            atexit.register(_collector.flush, True)
+        return _collector
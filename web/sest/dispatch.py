@@ -0,0 +1,169 @@
+"""Dispatch of the reactions triggered by the records uploaded.
+
+With REACTIONS_MODE = "sync" the reactions (e.g. the emails) run within the
+upload request. With "pool" they're put on an in-process queue, and run by
+REACTIONS_WORKERS threads: the latency of the uploads then doesn't depend on
+the one of the notification backends. With "outbox" they're written to the
+DB, and delivered by another process (see outbox.py). With "digest" they're
+collected for each recipient, and sent together (see digest.py).
+
+The queue holds at most REACTIONS_QUEUE_SIZE reactions: when it's full, the
+reactions run within the request again, which slows the uploads down instead
+of losing notifications. Its depth and lag (the time the reactions wait
+before running) are reported by `ReactionDispatcher.stats', and a warning is
+logged when the lag exceeds REACTIONS_MAX_LAG seconds.
+"""
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .digest import get_digests
+
+import atexit
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ReactionDispatcher:
+
+    def __init__(self, workers, max_size, max_lag=None):
+        self.workers = workers
+        self.max_lag = max_lag
+        self._queue = queue.Queue(max_size)
+        self._threads = []
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.run_inline = 0
+        self.in_flight = 0
+        self.last_lag = 0.0
+        self.max_lag_seen = 0.0
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self._work, daemon=True,
+                                     name="sest-reactions-{}".format(
+                                         len(self._threads)))
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, func, *args):
+        """Queue the call func(*args), or make it now if the queue is
+        full.
+        """
+
+        if len(self._threads) < self.workers:
+            self._start()
+
+        with self._lock:
+            self.submitted += 1
+        try:
+            self._queue.put_nowait((time.monotonic(), func, args))
+        except queue.Full:
+            with self._lock:
+                self.run_inline += 1
+            self._run(func, args)
+
+    def _run(self, func, args):
+        try:
+            func(*args)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            logger.exception("Reaction %r failed.", func)
+        else:
+            with self._lock:
+                self.completed += 1
+
+    def _work(self):
+        while True:
+            queued_at, func, args = self._queue.get()
+            lag = time.monotonic() - queued_at
+            with self._lock:
+                self.in_flight += 1
+                self.last_lag = lag
+                self.max_lag_seen = max(self.max_lag_seen, lag)
+            if self.max_lag is not None and lag > self.max_lag:
+                logger.warning("Reaction started %.1f s after being "
+                               "queued; %d more waiting.", lag,
+                               self._queue.qsize())
+
+            try:
+                self._run(func, args)
+            finally:
+                # The reactions read the DB from this thread: drop its
+                # connection if it's broken or too old, as after a request.
+                close_old_connections()
+                with self._lock:
+                    self.in_flight -= 1
+                self._queue.task_done()
+
+    def join(self):
+        """Wait until all the reactions queued have run."""
+
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": len(self._threads),
+                "depth": self._queue.qsize(),
+                "in_flight": self.in_flight,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "run_inline": self.run_inline,
+                "last_lag": self.last_lag,
+                "max_lag": self.max_lag_seen,
+            }
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Return the dispatcher shared by the whole process."""
+
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = ReactionDispatcher(settings.REACTIONS_WORKERS,
+                                             settings.REACTIONS_QUEUE_SIZE,
+                                             settings.REACTIONS_MAX_LAG)
+            # Don't lose the reactions still queued when the process exits.
+            atexit.register(_dispatcher.join)
+        return _dispatcher
+
+
+def dispatch_reaction(cond, record):
+    """Run the reaction of the condition satisfied by the record, according
+    to REACTIONS_MODE.
+    """
+
+    if settings.REACTIONS_MODE == "pool":
+        get_dispatcher().submit(cond.react, record)
+    elif settings.REACTIONS_MODE == "outbox":
+        # Imported here since the models use this module.
+        from .outbox import enqueue
+        enqueue(cond, record)
+    elif settings.REACTIONS_MODE == "digest":
+        get_digests().add(cond, record)
+    else:
+        cond.react(record)
+
+
+def react_within_transaction():
+    """Tell whether the reactions to the records must be checked within the
+    transaction that stores them, as for the outbox, or after it has been
+    committed.
+    """
+
+    return settings.REACTIONS_MODE == "outbox"
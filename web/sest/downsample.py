@@ -0,0 +1,163 @@
+"""Reduction of a series of (time, value) points to a bounded number of
+them, for charts that can't tell apart more points than their pixels.
+
+* `lttb' keeps a subset of the points that preserves the shape of the
+  series, with the Largest-Triangle-Three-Buckets algorithm (S. Steinarsson,
+  "Downsampling Time Series for Visual Representation", 2013): of every
+  bucket of consecutive points it keeps the one forming the largest triangle
+  with the point kept before and the average of the next bucket;
+  `lttb_stream' does the same reading the points only once, knowing their
+  number in advance, and keeps only two buckets of them in memory;
+* `buckets' splits the time range in intervals of the same length, and
+  returns the minimum, maximum, average and number of the values in each;
+  it reads the points only once, without keeping them in memory.
+"""
+
+from itertools import chain, islice
+
+
+def _bucket_starts(n, threshold):
+    """Return the function giving the index of the first of the `n' points
+    in each bucket of `lttb'.
+    """
+
+    # Integers, so that the last bucket ends exactly before the last point.
+    return lambda i: i * (n - 2) // (threshold - 2) + 1
+
+
+def lttb(points, threshold):
+    """Return `threshold' of the (time, value) points, sorted by time,
+    including the first and the last one.
+    """
+
+    n = len(points)
+    if threshold >= n:
+        return list(points)
+    if threshold < 3:
+        return [points[0], points[-1]][:max(threshold, 1)]
+
+    sampled = [points[0]]
+    # All the points but the first and the last one, split in threshold - 2
+    # buckets.
+    start = _bucket_starts(n, threshold)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Average point of the next bucket (the last point, for the last one).
+        next_start = start(i + 1)
+        next_end = min(start(i + 2), n)
+        next_points = points[next_start:next_end]
+        avg_t = sum(t for t, _ in next_points) / len(next_points)
+        avg_v = sum(v for _, v in next_points) / len(next_points)
+
+        a_t, a_v = points[a]
+        max_area = -1
+        for j in range(start(i), next_start):
+            t, v = points[j]
+            # Twice the area of the triangle, which has the same maximum.
+            area = abs((a_t - avg_t) * (v - a_v) - (a_t - t) * (avg_v - a_v))
+            if area > max_area:
+                max_area = area
+                chosen = j
+
+        sampled.append(points[chosen])
+        a = chosen
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def _middle_buckets(points, start, n_buckets, last):
+    """Yield the buckets of `lttb' of the points but the last one, which is
+    appended to `last'.
+    """
+
+    prev = next(points, None)
+    if prev is None:
+        return
+    bucket, i, j = [], 0, 1
+    end = start(1)
+    for p in points:
+        # `prev', the j-th point, isn't the last one.
+        while j >= end and i < n_buckets - 1:
+            if bucket:
+                yield bucket
+                bucket = []
+            i += 1
+            end = start(i + 1)
+        bucket.append(prev)
+        prev, j = p, j + 1
+    if bucket:
+        yield bucket
+    last.append(prev)
+
+
+def lttb_stream(points, n, threshold):
+    """Return the same points as `lttb', reading them only once from the
+    iterable of the `n' points.
+
+    If the iterable yields more points (e.g. saved after counting them),
+    the ones in excess go to the last bucket; if it yields fewer, fewer
+    points are returned.
+    """
+
+    if threshold >= n or threshold < 3:
+        return lttb(list(points), threshold)
+
+    points = iter(points)
+    sampled = list(islice(points, 1))
+    if not sampled:
+        return sampled
+
+    last = []
+    middle = _middle_buckets(points, _bucket_starts(n, threshold),
+                             threshold - 2, last)
+    current = next(middle, None)
+    a_t, a_v = sampled[0]
+    # The last bucket is followed by the last point; `last' is filled once
+    # `middle' is over.
+    for following in chain(middle, [None]):
+        if current is None:
+            break
+        next_points = following or last
+        avg_t = sum(t for t, _ in next_points) / len(next_points)
+        avg_v = sum(v for _, v in next_points) / len(next_points)
+
+        max_area = -1
+        for t, v in current:
+            area = abs((a_t - avg_t) * (v - a_v) - (a_t - t) * (avg_v - a_v))
+            if area > max_area:
+                max_area = area
+                chosen = (t, v)
+
+        sampled.append(chosen)
+        a_t, a_v = chosen
+        current = following
+
+    return sampled + last
+
+
+def buckets(points, start, end, n):
+    """Split [start, end] in `n' intervals of the same length, and return a
+    (start of the interval, min, max, avg, count) tuple for each one holding
+    some of the (time, value) points, in order of time.
+    """
+
+    width = (end - start) / n or 1
+    # {interval: [min, max, sum, count]}
+    found = {}
+    for t, v in points:
+        i = min(max(int((t - start) / width), 0), n - 1)
+        bucket = found.get(i)
+        if bucket is None:
+            found[i] = [v, v, v, 1]
+        else:
+            if v < bucket[0]:
+                bucket[0] = v
+            elif v > bucket[1]:
+                bucket[1] = v
+            bucket[2] += v
+            bucket[3] += 1
+
+    return [(start + i * width, low, high, total / count, count)
+            for i, (low, high, total, count) in sorted(found.items())]
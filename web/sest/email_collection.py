@@ -1,51 +1,275 @@
+"""Delivery of the emails, through one or more providers.
+
+Every provider in EMAIL_PROVIDERS is a Django email backend with its options,
+and optionally a quota of emails it may send every `period' seconds (as the
+free plans of the third-party services allow):
+
+    EMAIL_PROVIDERS = [
+        {"name": "postmark", "backend": "postmarker.django.EmailBackend",
+         "quota": 100, "period": 86400},
+        {"name": "smtp", "backend": "django.core.mail.backends.smtp"
+                                    ".EmailBackend",
+         "options": {"host": "smtp.example.com", "port": 587,
+                     "username": "...", "password": "...", "use_tls": True}},
+    ]
+
+Without providers, the emails are sent with EMAIL_BACKEND.
+
+Each provider keeps its connection open between the emails, and the emails
+sent together are split in batches of EMAIL_BATCH_SIZE, each sent over that
+connection, one email at a time. Batches go to the available provider with
+the largest share of its quota left; a provider that fails is skipped for
+EMAIL_PROVIDER_COOLDOWN seconds, and the emails of its batch that it didn't
+send go to the next one.
+A provider that fails isn't tried again while sending the same emails, so
+the ones that no provider can send are given up.
+
+The quotas, like the connections, are counted by each process on its own:
+with many processes sending emails (e.g. the web workers and
+`deliver_outbox'), split the quota of the service among them.
+"""
+
 from django.conf import settings
-from django.core.mail import send_mail
-# pip install postmarker
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
+import logging
+import smtplib
+import threading
+import time
 
-def send_email_wrapper(recipients_list, subject,
-                       from_field=settings.DEFAULT_FROM_EMAIL,
-                       text_body=None, html_body=None):
-    """Just a wrapper around different third-party services that send email.
-
-    So far, I only pass the arguments from this function to another one, but
-    I plan to introduce a smart system that takes into account the number of
-    emails sent with each third-party service, in order to use free credits
-    from many different services.
+logger = logging.getLogger(__name__)
+
+
+class NoProviderAvailable(Exception):
+    """Raised for the emails that no provider could send."""
+    pass
+
+
+class Provider:
+
+    def __init__(self, name, backend=None, options=None, quota=None,
+                 period=86400):
+        self.name = name
+        self.backend = backend
+        self.options = options or {}
+        self.quota = quota
+        self.period = period
+
+        self._connection = None
+        self._period_start = time.monotonic()
+        self.sent = 0
+        self.failures = 0
+        self.down_until = None
+
+    def __str__(self):
+        return self.name
+
+    def remaining(self, now):
+        """Return the number of emails that can still be sent in the current
+        period, or None if there's no quota.
+        """
+
+        if self.quota is None:
+            return None
+        if now - self._period_start >= self.period:
+            self._period_start = now
+            self.sent = 0
+        return max(self.quota - self.sent, 0)
+
+    def available(self, now):
+        if self.down_until is not None and now < self.down_until:
+            return False
+        return self.remaining(now) != 0
+
+    def share_left(self, now):
+        remaining = self.remaining(now)
+        return 1.0 if remaining is None else remaining / self.quota
+
+    def _open(self):
+        self._connection = get_connection(self.backend, fail_silently=False,
+                                          **self.options)
+        self._connection.open()
+
+    def _send_one(self, message, may_reopen):
+        try:
+            self._connection.send_messages([message])
+        except smtplib.SMTPServerDisconnected:
+            # Only a connection kept open may have been closed by the server
+            # in the meanwhile; after an email, or with a new connection,
+            # the server is failing.
+            if not may_reopen:
+                raise
+            self.close()
+            self._open()
+            self._connection.send_messages([message])
+
+    def send(self, messages):
+        """Send the messages in order over the connection kept open, and
+        return the number sent, along with the exception that prevented the
+        others from being sent, or None.
+
+        The connection is opened again once if the server closed it before
+        the first message.
+        """
+
+        sent, error = 0, None
+        try:
+            reused = self._connection is not None
+            if not reused:
+                self._open()
+            for message in messages:
+                self._send_one(message, reused and not sent)
+                sent += 1
+        except Exception as e:
+            self.close()
+            error = e
+        self.sent += sent
+        return sent, error
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+
+class EmailTransport:
+
+    def __init__(self, providers, batch_size, cooldown):
+        self.providers = providers
+        self.batch_size = batch_size
+        self.cooldown = cooldown
+        # The connections can't be used by many threads at once.
+        self._lock = threading.Lock()
+
+    def _choose(self, now, failed):
+        available = [p for p in self.providers
+                     if p.available(now) and p not in failed]
+        if not available:
+            return None
+        # max() keeps the first of the providers with the same share.
+        return max(available, key=lambda p: p.share_left(now))
+
+    def send(self, messages):
+        """Send the messages, and return a list with None for each one sent,
+        or the exception that prevented it from being sent.
+        """
+
+        errors = [None] * len(messages)
+        pending = list(range(len(messages)))
+        last_error = NoProviderAvailable("No email provider available.")
+        # Providers aren't tried again after failing during the same call,
+        # even if their cooldown is already over (e.g. without any).
+        failed = set()
+
+        with self._lock:
+            while pending:
+                now = time.monotonic()
+                provider = self._choose(now, failed)
+                if provider is None:
+                    break
+
+                remaining = provider.remaining(now)
+                n = (self.batch_size if remaining is None else
+                     min(self.batch_size, remaining))
+                sent, error = provider.send(
+                    [messages[i] for i in pending[:n]])
+                # Only the emails not sent yet go to the next provider.
+                pending = pending[sent:]
+                if error is not None:
+                    logger.warning("Email provider %s failed: %s", provider,
+                                   error)
+                    provider.failures += 1
+                    provider.down_until = now + self.cooldown
+                    failed.add(provider)
+                    last_error = error
+                    continue
+
+                provider.failures = 0
+                provider.down_until = None
+
+        for i in pending:
+            errors[i] = last_error
+        return errors
+
+    def close(self):
+        with self._lock:
+            for p in self.providers:
+                p.close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """Return the transport shared by the whole process, configured with
+    EMAIL_PROVIDERS.
     """
 
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            providers = ([Provider(**p) for p in settings.EMAIL_PROVIDERS] or
+                         [Provider("default")])
+            _transport = EmailTransport(providers,
+                                        settings.EMAIL_BATCH_SIZE,
+                                        settings.EMAIL_PROVIDER_COOLDOWN)
+        return _transport
+
+
+@receiver(setting_changed)
+def reset_transport(setting, **kwargs):
+    global _transport
+    if setting.startswith("EMAIL_"):
+        with _transport_lock:
+            if _transport is not None:
+                _transport.close()
+            _transport = None
+
+
+def build_email(recipients_list, subject,
+                from_field=None, text_body=None, html_body=None):
     if not html_body and not text_body:
         raise TypeError("A html or a text body has to be provided.")
 
     if isinstance(recipients_list, str):
         recipients_list = [recipients_list]
 
-    send_email_postmark(from_field, recipients_list, subject,
-                        text_body, html_body)
+    # Text and Html bodies can be sent together into a multipart email.
+    msg = EmailMultiAlternatives(subject, text_body or "",
+                                 from_field or settings.DEFAULT_FROM_EMAIL,
+                                 recipients_list)
+    if html_body:
+        msg.attach_alternative(html_body, "text/html")
+    return msg
+
+
+def send_emails(messages, fail_silently=True):
+    """Send the messages built by `build_email' in batches, and return the
+    list of the errors (see EmailTransport.send).
 
+    Unless `fail_silently', raise the first error.
+    """
+
+    errors = get_transport().send(messages)
+    if not fail_silently:
+        for e in errors:
+            if e is not None:
+                raise e
+    return errors
 
-def send_email_postmark(from_field, to_list, subject,
-                        text_body=None, html_body=None):
-    """Postmark[app.com] API client.
 
-    In order to use the postmark service, visit their website, register a
-    (free) user, create a sending server, get its token (Credentials >
-    Server API) and save it into settings.py. Then instantiate a PM Client
-    object to be called from this function.
+def send_email_wrapper(recipients_list, subject,
+                       from_field=None, text_body=None, html_body=None,
+                       fail_silently=True):
+    """Just a wrapper around different third-party services that send email
+    (see EMAIL_PROVIDERS above).
     """
 
-    # TODO: set fail_silently=False, and capture the exceptions that could
-    # raise.
-
-    # no_email_sent = send_mail(
-    send_mail(
-        subject,
-        # Text and Html bodies can be sent together into a multipart email.
-        text_body,
-        from_field,
-        to_list,
-        html_message=html_body,
-        fail_silently=True,
-    )
-
-    # return no_email_sent == len(to_list)
+    send_emails([build_email(recipients_list, subject, from_field,
+                             text_body, html_body)], fail_silently)
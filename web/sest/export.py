@@ -0,0 +1,186 @@
+"""Export of the whole history of a channel, or of a range of time, one record
+per line:
+
+    GET /12345678/export/?start=2017-03-01&format=csv
+
+* start, end: unix epochs or ISO 8601 dates (by default, all the records);
+* format: "csv" (the default), with the layout of sample_without_header.csv,
+  i.e. the time in UTC, the id of the record and the values of the fields
+  in the order of their numbers, empty for the ones a record lacks:
+
+      2016-12-20 10:34:43 UTC,1338,22.0,43.0
+
+  or "ndjson", a JSON object per line with the keys of the uploads:
+
+      {"id": 1338, "timestamp": 1482230083.0, "field1": 22.0, "field2": 43.0}
+
+* header: "1" to start the CSV with the names of the columns ("time", "id"
+  and "field1", "field2"...).
+
+The fields of all the records are read with a single query, EXPORT_CHUNK_SIZE
+rows at a time (through a server-side cursor on PostgreSQL), and are pivoted
+into a line for each record as they come: neither the response nor the
+`export_channel' management command keep more than a chunk of rows in
+memory, whatever the length of the history. The exception is MySQL, whose
+drivers buffer the whole result of a query.
+"""
+
+from django.conf import settings
+
+from .models import Field, RecordRow, stored_value, decode_value
+from .schema import get_schema
+from .ingest import parse_timestamp, IngestError, TIMESTAMP_KEY
+from .series import QueryError
+from . import series
+
+import csv
+import json
+import math
+from datetime import timezone
+from itertools import groupby
+from operator import itemgetter
+
+messages = {
+    "WRONG_EXPORT_FORMAT": "The format must be 'csv' or 'ndjson'.",
+}
+
+FORMATS = ("csv", "ndjson")
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S UTC"
+
+# Lines joined in each chunk of the output, so that the response isn't
+# written a few bytes at a time.
+LINES_PER_CHUNK = 500
+
+
+class ExportQuery:
+
+    def __init__(self, channel_id, start=None, end=None, format="csv",
+                 header=False):
+        self.channel_id = channel_id
+        self.start = start
+        self.end = end
+        self.format = format
+        self.header = header
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    try:
+        return parse_timestamp(value)
+    except IngestError:
+        raise QueryError(series.messages["WRONG_RANGE"])
+
+
+def parse_export(channel_id, params):
+    """Return the ExportQuery of the parameters of the request."""
+
+    start = _parse_time(params.get("start"))
+    end = _parse_time(params.get("end"))
+    if start is not None and end is not None and start >= end:
+        raise QueryError(series.messages["WRONG_RANGE"])
+
+    format = params.get("format", "csv")
+    if format not in FORMATS:
+        raise QueryError(messages["WRONG_EXPORT_FORMAT"])
+
+    return ExportQuery(channel_id, start, end, format,
+                       params.get("header") == "1")
+
+
+def export_rows(query):
+    """Yield a RecordRow for each record of the query with some fields, in
+    order of time, with the values decoded and in the order of the field
+    numbers, or None for the fields it lacks.
+    """
+
+    schema = get_schema(query.channel_id)
+    columns = {field_no: i for i, field_no in enumerate(schema.field_numbers)}
+
+    fields = Field.objects.filter(record__channel=query.channel_id)
+    if query.start is not None:
+        fields = fields.filter(record__insertion_time__gte=query.start)
+    if query.end is not None:
+        fields = fields.filter(record__insertion_time__lt=query.end)
+    rows = (fields
+            .order_by("record__insertion_time", "record_id", "field_no")
+            .values_list("record_id", "record__insertion_time", "field_no",
+                         "_value", "_value_real", "_value_int")
+            .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE))
+
+    # The fields of a record are consecutive.
+    for (pk, t), record_fields in groupby(rows, key=itemgetter(0, 1)):
+        values = [None] * len(columns)
+        for _, _, field_no, *columns_values in record_fields:
+            if field_no not in columns:
+                continue
+            v = stored_value(*columns_values)
+            try:
+                v = decode_value(schema.encodings[field_no], v)
+            except ValueError:
+                # Export the values saved with a wrong encoding as they are.
+                pass
+            values[columns[field_no]] = v
+        yield RecordRow(pk, t, values)
+
+
+class _Line:
+    """File-like object returning what's written to it, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(query, rows):
+    writer = csv.writer(_Line(), lineterminator="\n")
+    if query.header:
+        # The keys of the uploads, since the names are optional.
+        yield writer.writerow(
+            ["time", "id"] +
+            ["field{}".format(n)
+             for n in get_schema(query.channel_id).field_numbers])
+
+    for pk, t, values in rows:
+        yield writer.writerow(
+            [t.astimezone(timezone.utc).strftime(TIME_FORMAT), pk] +
+            ["" if v is None else v for v in values])
+
+
+def _json_value(v):
+    # JSON can't represent the non-finite numbers.
+    if isinstance(v, float) and not math.isfinite(v):
+        return str(v)
+    return v
+
+
+def ndjson_lines(query, rows):
+    keys = ["field{}".format(n)
+            for n in get_schema(query.channel_id).field_numbers]
+
+    for pk, t, values in rows:
+        record = {"id": pk, TIMESTAMP_KEY: t.timestamp()}
+        for key, v in zip(keys, values):
+            if v is not None:
+                record[key] = _json_value(v)
+        yield json.dumps(record) + "\n"
+
+
+def export_chunks(query):
+    """Yield the export of the query as strings of LINES_PER_CHUNK lines."""
+
+    lines = (csv_lines if query.format == "csv" else ndjson_lines)(
+        query, export_rows(query))
+
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == LINES_PER_CHUNK:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
@@ -0,0 +1,122 @@
+"""Import of the history of a channel from a CSV file, with the layout of
+sample_without_header.csv and of the exports (see export.py): the time of
+each record, its id in the system it comes from (ignored) and the values of
+its fields in the order of their numbers, empty for the ones it lacks:
+
+    2016-12-20 10:34:43 UTC,1338,22.00000,43.00000
+
+The file is read one line at a time, and the records keep their timestamps
+and are stored by `ingest.store_records' in transactions of
+IMPORT_BATCH_SIZE records, so that both the memory used and the number of
+queries per record don't depend on the length of the file. The reactions can
+be skipped, since a year of old records would trigger a year of alerts.
+
+An interrupted import can be resumed by skipping the records of the file not
+newer than the last one saved in the channel (see `resume_point'): each
+transaction saves a batch of consecutive lines, so the lines already saved
+are exactly the first ones, provided the file is in order of time and the
+channel received no newer records meanwhile.
+"""
+
+from django.conf import settings
+
+from .models import Record
+from .schema import get_schema
+from .ingest import (IngestError, messages, parse_timestamp,
+                     validate_values, store_records, react_to_records)
+
+import csv
+
+
+class CSVImportError(Exception):
+    """Raised when a line of the file can't be imported; the message tells
+    the number of the line and one of the strings in `ingest.messages'.
+    """
+    pass
+
+
+def read_csv(lines, channel_id):
+    """Yield a (timestamp, {field_no: value}) tuple for each line of the CSV,
+    validated against the FieldMetadata of the channel.
+
+    A first line starting with "time" is taken as a header, and skipped.
+    """
+
+    schema = get_schema(channel_id)
+    numbers = schema.field_numbers
+
+    for line_no, row in enumerate(csv.reader(lines), 1):
+        if not row or (line_no == 1 and row[0] == "time"):
+            continue
+        try:
+            if len(row) < 2:
+                raise IngestError(messages["WRONG_BATCH_FORMAT"])
+            if len(row) > len(numbers) + 2:
+                raise IngestError(messages["NUMBER_FIELDS_EXCEEDED"])
+            timestamp = parse_timestamp(row[0])
+            values = validate_values({n: v for n, v in zip(numbers, row[2:])
+                                      if v != ""},
+                                     schema.encodings)
+        except IngestError as e:
+            raise CSVImportError("Line {}: {}".format(line_no, e))
+
+        yield timestamp, values
+
+
+def resume_point(channel_id):
+    """Return the time of the newest record of the channel, and the number
+    of its records with that time, or (None, 0) if it has none.
+    """
+
+    last = (Record.objects
+            .filter(channel=channel_id)
+            .order_by("-insertion_time")
+            .values_list("insertion_time", flat=True)
+            .first())
+    if last is None:
+        return None, 0
+    return last, Record.objects.filter(channel=channel_id,
+                                       insertion_time=last).count()
+
+
+def skip_imported(records, last, n_at_last):
+    """Yield the records, read in order of time, but the first ones already
+    saved in the channel, as told by `resume_point'.
+    """
+
+    for timestamp, values in records:
+        if last is not None:
+            if timestamp < last:
+                continue
+            if timestamp == last and n_at_last:
+                n_at_last -= 1
+                continue
+            last = None
+        yield timestamp, values
+
+
+def import_records(channel, records, batch_size=None, react=True):
+    """Store the (timestamp, values) records in transactions of `batch_size'
+    records (by default, IMPORT_BATCH_SIZE), checking their reactions only
+    if `react' is True.
+
+    Yield the number of records stored by each transaction, after its
+    commit.
+    """
+
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield _store(channel, batch, react)
+            batch = []
+    if batch:
+        yield _store(channel, batch, react)
+
+
+def _store(channel, batch, react):
+    stored = store_records(channel, batch, react=react)
+    if react:
+        react_to_records(channel, stored)
+    return len(stored)
@@ -0,0 +1,233 @@
+"""Alerts for the channels that stop receiving records.
+
+A channel with an `update_interval' is expected to receive a record at least
+every that many seconds. The `watch_inactivity' management command keeps the
+deadline of every such channel in a heap, ordered by time: it sleeps until
+the earliest deadline or the next poll, whichever comes first, so it costs
+nothing while nothing happens, however many channels there are.
+
+Every INACTIVITY_POLL seconds it reads the records saved since the previous
+poll, by primary key, and moves the deadlines of their channels forward
+(O(log n) each); it also reads the channels changed since then, to follow
+the changes of their intervals. When a deadline passes, an email is sent to
+the notification address of the channel, and its `inactive_since' is set:
+no other alert is sent until a record arrives again.
+
+Records committed out of the order of their primary keys, by concurrent
+transactions, may be missed by the poll: at worst their channel is reported
+inactive one interval earlier.
+"""
+
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Channel, Record
+from .email_collection import build_email, send_emails
+
+import heapq
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineHeap:
+    """Min-heap of the deadlines of a set of keys, each one with at most a
+    deadline at a time.
+
+    Moving or removing a deadline leaves its old entry in the heap, skipped
+    when it reaches the top; the heap is rebuilt when such entries are the
+    majority.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def set(self, key, deadline):
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(d, k) for k, d in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def discard(self, key):
+        self._deadlines.pop(key, None)
+
+    def _drop_stale(self):
+        while self._heap:
+            deadline, key = self._heap[0]
+            if self._deadlines.get(key) == deadline:
+                return
+            heapq.heappop(self._heap)
+
+    def next_deadline(self):
+        """Return the earliest deadline, or None."""
+
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, now):
+        """Remove the keys whose deadline is not later than `now', and return
+        them.
+        """
+
+        expired = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return expired
+            _, key = heapq.heappop(self._heap)
+            del self._deadlines[key]
+            expired.append(key)
+
+
+def _datetime(ts):
+    return datetime.fromtimestamp(ts, dt_timezone.utc)
+
+
+class InactivityMonitor:
+    """Deadlines of the channels with an update interval, and the state of
+    the polls of the DB.
+
+    Times are POSIX timestamps.
+    """
+
+    def __init__(self):
+        self.deadlines = DeadlineHeap()
+        # {channel id: update interval}, of the channels monitored.
+        self.intervals = {}
+        # The channels already reported, waiting for a record.
+        self.inactive = set()
+        self.last_record = 0
+        self.channels_checked = None
+
+    def load(self, now=None):
+        """Schedule all the channels with an update interval."""
+
+        now = time.time() if now is None else now
+        self.last_record = (Record.objects.aggregate(last=Max("pk"))["last"]
+                            or 0)
+        self.channels_checked = _datetime(now)
+
+        channels = (Channel.objects
+                    .filter(update_interval__isnull=False)
+                    .annotate(last_record=Max("record__insertion_time"))
+                    .values_list("pk", "update_interval", "inactive_since",
+                                 "last_record"))
+        for pk, interval, inactive_since, last_record in channels:
+            self.intervals[pk] = interval
+            if inactive_since is not None:
+                self.inactive.add(pk)
+            else:
+                # Channels without records are given a full interval.
+                since = now if last_record is None else min(
+                    last_record.timestamp(), now)
+                self.deadlines.set(pk, since + interval)
+
+    def _poll_channels(self, now):
+        changed = (Channel.objects
+                   .filter(last_update__gt=self.channels_checked)
+                   .values_list("pk", "update_interval"))
+        self.channels_checked = _datetime(now)
+
+        for pk, interval in changed:
+            if interval is None:
+                self.intervals.pop(pk, None)
+                self.deadlines.discard(pk)
+                self.inactive.discard(pk)
+            elif self.intervals.get(pk) != interval:
+                self.intervals[pk] = interval
+                if pk not in self.inactive:
+                    self.deadlines.set(pk, now + interval)
+
+    def _poll_records(self, now):
+        updated = (Record.objects
+                   .filter(pk__gt=self.last_record)
+                   .order_by()
+                   .values_list("channel_id")
+                   .annotate(last=Max("pk")))
+
+        resumed = []
+        for channel_id, last in updated:
+            self.last_record = max(self.last_record, last)
+            interval = self.intervals.get(channel_id)
+            if interval is None:
+                continue
+            if channel_id in self.inactive:
+                self.inactive.discard(channel_id)
+                resumed.append(channel_id)
+            self.deadlines.set(channel_id, now + interval)
+
+        if resumed:
+            Channel.objects.filter(pk__in=resumed).update(inactive_since=None)
+
+    def poll(self, now=None):
+        """Read the changes of the channels and the records saved since the
+        last poll.
+        """
+
+        now = time.time() if now is None else now
+        if self.channels_checked is None:
+            self.load(now)
+            return
+        self._poll_channels(now)
+        self._poll_records(now)
+
+    def expire(self, now=None):
+        """Alert about the channels whose deadline has passed, and return
+        their number.
+        """
+
+        now = time.time() if now is None else now
+        expired = self.deadlines.pop_expired(now)
+        if not expired:
+            return 0
+
+        # Deleted channels, or ones no longer monitored, are left out.
+        channels = list(Channel.objects
+                        .filter(pk__in=expired,
+                                update_interval__isnull=False)
+                        .select_related("user", "notification_email"))
+        for pk in set(expired) - {ch.pk for ch in channels}:
+            self.intervals.pop(pk, None)
+
+        emails = []
+        for ch in channels:
+            self.inactive.add(ch.pk)
+            if ch.notification_email:
+                emails.append(inactivity_email(ch))
+            else:
+                logger.warning("No email connected to the inactive "
+                               "channel %s.", ch)
+
+        Channel.objects.filter(pk__in=[ch.pk for ch in channels]).update(
+            inactive_since=timezone.now())
+        send_emails(emails)
+        return len(channels)
+
+    def next_wakeup(self, poll_interval, now=None):
+        """Return the seconds to wait before the next deadline or poll."""
+
+        now = time.time() if now is None else now
+        deadline = self.deadlines.next_deadline()
+        if deadline is None:
+            return poll_interval
+        return max(0, min(poll_interval, deadline - now))
+
+
+def inactivity_email(channel):
+    return build_email(
+        recipients_list=[channel.notification_email.email],
+        subject="Alert. No updates on channel {}".format(channel),
+        text_body=("No records have been received on channel {} in the "
+                   "last {} seconds.".format(channel,
+                                             channel.update_interval)),
+    )
@@ -0,0 +1,451 @@
+"""Validation and storage of the records uploaded to a channel.
+
+Records are checked against the FieldMetadata objects of the channel before
+touching the DB, so that a batch is either saved completely or not at all.
+"""
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import QueryDict
+from django.utils import dateparse, timezone
+
+from .models import Record, Field, decode_value, typed_columns
+from .schema import get_schema
+from .credentials import get_channel
+from .sequence import filter_new
+from .conditions import get_conditions
+from .dispatch import react_within_transaction
+from .rollups import add_to_rollups, stored_samples
+
+import re
+import json
+from datetime import datetime
+
+field_pattern = re.compile(r"(field[0-9]+)")
+field_extract_number = re.compile(r"field([0-9]+)")
+
+# Optional key that carries the time a record has been collected on the device.
+TIMESTAMP_KEY = "timestamp"
+# Optional key that carries the sequence number of a record (see sequence.py).
+SEQUENCE_KEY = "seq"
+
+messages = {
+    "WRONG_WRITE_KEY": ("Incorrect SEST write key associated with the "
+                        "channel you have chosen."),
+    "MISSING_WRITE_KEY": "Missing writing API key.",
+    "UNKNOWN_CHANNEL": "Missing or unknown channel.",
+    "NUMBER_FIELDS_EXCEEDED": "Max number of fields exceeded.",
+    "WRONG_FIELDS_PASSED": "One or more fields sent have wrong names.",
+    "WRONG_VALUE_FIELD_ENCODING": ("One of the value sent was not coherent "
+                                   "with the encoding defined for the field "
+                                   "number for the channel, or the channel is"
+                                   "not defined to handle that field number."),
+    "EMPTY_VALUES_NOT_ALLOWED": "Fields with empty values are not allowed.",
+    "WRONG_BATCH_FORMAT": ("The body of the request doesn't contain a valid "
+                           "list of records."),
+    "NUMBER_RECORDS_EXCEEDED": "Max number of records in a batch exceeded.",
+    "WRONG_TIMESTAMP": "One or more records have an invalid timestamp.",
+    "WRONG_BINARY_FORMAT": "The body of the request isn't a valid SEST frame.",
+    "LINE_TOO_LONG": "Line too long.",
+    "WRONG_SEQUENCE": "Sequence numbers must be non-negative integers.",
+    "WRONG_DATAGRAM": ("The datagram doesn't contain the channel, the write "
+                       "key and the fields separated by spaces."),
+}
+
+
+class IngestError(Exception):
+    """Raised when the data uploaded to a channel can't be saved; the message
+    is one of the strings defined in `messages'.
+    """
+    pass
+
+
+def authenticate(channel_id, write_key):
+    """Return the channel, read from the cache, if the write key matches the
+    one of the channel.
+    """
+
+    if not write_key:
+        raise IngestError(messages["MISSING_WRITE_KEY"])
+
+    try:
+        channel = get_channel(channel_id)
+    except (TypeError, ValueError, OverflowError):
+        # Not a number, or an infinite one.
+        channel = None
+
+    if channel is None:
+        raise IngestError(messages["UNKNOWN_CHANNEL"])
+
+    if str(channel.write_key) != str(write_key):
+        raise IngestError(messages["WRONG_WRITE_KEY"])
+
+    return channel
+
+
+def parse_timestamp(value):
+    """Convert the timestamp sent with a record to an aware datetime.
+
+    Both unix epochs and ISO 8601 strings are accepted; naive datetimes are
+    considered to be in the current time zone.
+    """
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.fromtimestamp(value, tz=timezone.utc)
+        except (ValueError, OverflowError, OSError):
+            # Out of the range of the datetimes, or NaN.
+            raise IngestError(messages["WRONG_TIMESTAMP"])
+
+    if not isinstance(value, str):
+        raise IngestError(messages["WRONG_TIMESTAMP"])
+
+    try:
+        return datetime.fromtimestamp(float(value), tz=timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        pass
+
+    # Timestamps like the ones in sample_without_header.csv.
+    if value.endswith(" UTC"):
+        value = value[:-len(" UTC")] + "+00:00"
+
+    try:
+        dt = dateparse.parse_datetime(value)
+    except ValueError:
+        dt = None
+
+    if dt is None:
+        raise IngestError(messages["WRONG_TIMESTAMP"])
+
+    if timezone.is_naive(dt):
+        try:
+            dt = timezone.make_aware(dt)
+        except OverflowError:
+            # At the edges of the range of the datetimes.
+            raise IngestError(messages["WRONG_TIMESTAMP"])
+    return dt
+
+
+def parse_sequence(value):
+    """Convert the sequence number sent with a record to an int."""
+
+    # isdigit() is true for digits (like "²") that int() doesn't accept.
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        value = int(value)
+
+    if (not isinstance(value, int) or isinstance(value, bool) or
+            not 0 <= value < 2 ** 63):
+        raise IngestError(messages["WRONG_SEQUENCE"])
+    return value
+
+
+def pop_sequences(records):
+    """Remove the sequence numbers from the records (as returned by
+    `parse_batch'), and return them as a list with None for the records
+    without one, or None if no record has one.
+    """
+
+    sequences = [parse_sequence(r.pop(SEQUENCE_KEY))
+                 if SEQUENCE_KEY in r else None
+                 for r in records]
+
+    if all(seq is None for seq in sequences):
+        return None
+    return sequences
+
+
+def validate_values(values, encodings):
+    """Check the values of a single record, keyed by field number, against
+    the encodings of the fields (as in ChannelSchema.encodings).
+
+    Return the values, ready to be stored.
+    """
+
+    if len(values) > settings.MAX_NUMBER_FIELDS:
+        raise IngestError(messages["NUMBER_FIELDS_EXCEEDED"])
+
+    elif not values:
+        # The user tried to insert an empty record.
+        raise IngestError(messages["WRONG_FIELDS_PASSED"])
+
+    for field_no, val in values.items():
+        if val is None or val == "":
+            raise IngestError(messages["EMPTY_VALUES_NOT_ALLOWED"])
+        if isinstance(val, (bool, dict, list)):
+            raise IngestError(messages["WRONG_VALUE_FIELD_ENCODING"])
+
+        try:
+            decode_value(encodings[field_no], val)
+        except (KeyError, ValueError):
+            # No FieldMetadata for the field number, or a value not coherent
+            # with its encoding.
+            raise IngestError(messages["WRONG_VALUE_FIELD_ENCODING"])
+
+    return values
+
+
+def validate_fields(fields, encodings):
+    """Check the fields of a single record and decode their values.
+
+    `fields' maps names like 'field2' to the values sent; `encodings' maps
+    field numbers to the encoding of the FieldMetadata of the channel.
+    Return a dict of field numbers to the values as strings, ready to be
+    stored.
+    """
+
+    # Use a regex to select only the fields like 'field<number>'.
+    names = [k for k in fields if field_pattern.match(k)]
+
+    if len(names) > settings.MAX_NUMBER_FIELDS:
+        raise IngestError(messages["NUMBER_FIELDS_EXCEEDED"])
+
+    elif not names or len(names) < len(fields):
+        # This means that the user inserted at least one field with an
+        # incorrect name, or tried to insert an empty record.
+        raise IngestError(messages["WRONG_FIELDS_PASSED"])
+
+    values = {}
+    for field_name in names:
+        val = fields[field_name]
+        # Extract the field number, to store it to the right position.
+        field_no = int(field_extract_number.findall(field_name)[0])
+        if field_no in values:
+            # e.g. "field1" and "field01": one of them would be lost.
+            raise IngestError(messages["WRONG_FIELDS_PASSED"])
+        values[field_no] = (val if val is None or
+                            isinstance(val, (bool, dict, list)) else str(val))
+
+    return validate_values(values, encodings)
+
+
+def validate_record(channel, fields):
+    """Validate the fields of a single record uploaded to the channel (see
+    `validate_fields').
+    """
+
+    return validate_fields(fields, get_schema(channel.id).encodings)
+
+
+def parse_batch(body, content_type):
+    """Split the body of a batch upload into a list of dicts, one for each
+    record, with the field names (and the optional timestamp) as keys.
+
+    Two formats are accepted:
+    * application/json: a list of objects, or an object with a "records" key
+      holding the list, e.g. [{"field1": 21.5, "timestamp": 1482230083}];
+    * text/plain: one form-encoded record per line, e.g. field1=21.5&field2=4
+    """
+
+    try:
+        body = body.decode("utf-8")
+    except UnicodeDecodeError:
+        raise IngestError(messages["WRONG_BATCH_FORMAT"])
+
+    if content_type == "application/json":
+        try:
+            records = json.loads(body)
+        except ValueError:
+            raise IngestError(messages["WRONG_BATCH_FORMAT"])
+
+        if isinstance(records, dict):
+            records = records.get("records")
+
+        if (not isinstance(records, list) or
+                not all(isinstance(r, dict) for r in records)):
+            raise IngestError(messages["WRONG_BATCH_FORMAT"])
+
+    else:
+        records = [QueryDict(line).dict() for line in body.splitlines()
+                   if line.strip()]
+
+    if not records:
+        raise IngestError(messages["WRONG_BATCH_FORMAT"])
+
+    return records
+
+
+def validate_batch(channel, records):
+    """Validate a list of records (as returned by `parse_batch') against the
+    FieldMetadata of the channel.
+
+    Return a list of (timestamp, {field_no: value}) tuples; the timestamp is
+    None when the device didn't send one.
+    """
+
+    if len(records) > settings.MAX_BATCH_RECORDS:
+        raise IngestError(messages["NUMBER_RECORDS_EXCEEDED"])
+
+    encodings = get_schema(channel.id).encodings
+    validated = []
+    for record in records:
+        record = dict(record)
+        timestamp = record.pop(TIMESTAMP_KEY, None)
+        if timestamp is not None:
+            timestamp = parse_timestamp(timestamp)
+
+        validated.append((timestamp, validate_fields(record, encodings)))
+
+    return validated
+
+
+def validate_numbered_batch(channel, records):
+    """Validate a list of (timestamp, {field_no: value}) tuples, such as the
+    ones decoded by `binary.parse_frame', against the FieldMetadata of the
+    channel. Return them ready to be stored.
+    """
+
+    if len(records) > settings.MAX_BATCH_RECORDS:
+        raise IngestError(messages["NUMBER_RECORDS_EXCEEDED"])
+
+    encodings = get_schema(channel.id).encodings
+    return [(timestamp, validate_values(values, encodings))
+            for timestamp, values in records]
+
+
+def _bulk_insert_returns_pks():
+    features = connection.features
+    # The name of the feature changed in Django 3.0.
+    return getattr(features, "can_return_rows_from_bulk_insert",
+                   getattr(features, "can_return_ids_from_bulk_insert", False))
+
+
+def store_records(channel, validated, react=True):
+    """Save the records validated by `validate_batch' in a single transaction.
+
+    The fields of all the records are inserted with a single bulk_create; the
+    records too, when the DB backend returns the primary keys of the objects
+    inserted in bulk, or else one at a time. The rollups of the fields are
+    updated in the same transaction (see rollups.py).
+    Return a list of (record, fields) tuples with the objects created, to be
+    passed to `react_to_records'; in outbox mode, the reactions are written
+    within the transaction instead, unless `react' is False.
+    """
+
+    encodings = get_schema(channel.id).encodings
+    now = timezone.now()
+    stored = [(Record(channel=channel, insertion_time=timestamp or now),
+               values)
+              for timestamp, values in validated]
+
+    with transaction.atomic():
+        if _bulk_insert_returns_pks():
+            Record.objects.bulk_create([r for r, _ in stored])
+        else:
+            for r, _ in stored:
+                # Skip Record.save, which would look for reactions on a
+                # record without fields.
+                r.save_base(force_insert=True)
+
+        stored = [(r, [Field(record=r, field_no=field_no,
+                             **typed_columns(encodings.get(field_no), val))
+                       for field_no, val in sorted(values.items())])
+                  for r, values in stored]
+        Field.objects.bulk_create([f for _, fields in stored for f in fields])
+        add_to_rollups(channel.id, stored_samples(stored))
+
+        if react and react_within_transaction():
+            _check_reactions(channel, stored)
+
+    return stored
+
+
+def _check_reactions(channel, stored):
+    if not get_conditions(channel.id):
+        return
+
+    for r, fields in stored:
+        channel.check_and_react(r, fields=fields)
+
+
+def react_to_records(channel, stored):
+    """Check whether the records just stored trigger a reaction, using the
+    objects still in memory instead of reading them again from the DB.
+
+    In outbox mode, this already happened within the transaction that
+    stored them.
+    """
+
+    if not react_within_transaction():
+        _check_reactions(channel, stored)
+
+
+def drop_duplicates(channel, validated, sequences):
+    """Return the records, already validated, whose sequence number hasn't
+    been received yet by the channel (see sequence.py).
+
+    Call it within the transaction that stores them.
+    """
+
+    return [v for v, new in zip(validated, filter_new(channel, sequences))
+            if new]
+
+
+def ingest_validated(channel, validated, sequences=None):
+    """Store and react to records already validated, either by
+    `validate_batch' or by `validate_numbered_batch'.
+
+    With `sequences', the records already received (as told by their
+    sequence numbers) are dropped, and aren't part of the list returned.
+    """
+
+    if sequences is None:
+        stored = store_records(channel, validated)
+    else:
+        with transaction.atomic():
+            validated = drop_duplicates(channel, validated, sequences)
+            stored = store_records(channel, validated) if validated else []
+
+    react_to_records(channel, stored)
+    return [r for r, _ in stored]
+
+
+def store_grouped(validated_by_channel):
+    """Store the records of many channels, already validated and grouped in
+    a dict {channel: [validated records]}, with a single transaction.
+
+    Return a list of (channel, [(record, fields)]) tuples, to be passed to
+    `react_to_records'.
+    """
+
+    with transaction.atomic():
+        return [(channel, store_records(channel, validated))
+                for channel, validated in validated_by_channel.items()]
+
+
+def ingest_grouped(validated_by_channel):
+    """Store the records of many channels (see `store_grouped') and check
+    their reactions. Return the number of records saved.
+    """
+
+    stored = store_grouped(validated_by_channel)
+    for channel, records in stored:
+        react_to_records(channel, records)
+
+    return sum(len(records) for _, records in stored)
+
+
+def ingest_record(channel, fields, timestamp=None, sequence=None):
+    """Validate, store and react to a single record uploaded to the channel.
+
+    The values are checked before writing anything, so that nothing has to
+    be cleaned up in case of errors, and the record and its fields are then
+    written with a query each.
+    Return the record, or None if its sequence number has already been
+    received.
+    """
+
+    records = ingest_validated(
+        channel, [(timestamp, validate_record(channel, fields))],
+        None if sequence is None else [sequence])
+    return records[0] if records else None
+
+
+def ingest_batch(channel, records):
+    """Validate, store and react to the records (as returned by
+    `parse_batch') uploaded to the channel. Either all of them are saved, or
+    none is. Records with a sequence number already received are dropped.
+    """
+
+    sequences = pop_sequences(records)
+    return ingest_validated(channel, validate_batch(channel, records),
+                            sequences)
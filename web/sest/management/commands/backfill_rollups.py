@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from sest.models import Channel, Rollup
+from sest.rollups import backfill
+
+
+class Command(BaseCommand):
+    help = ("Compute again the minute, hour and day aggregates of the "
+            "numeric fields of the channels from all their records.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("channels", nargs="*", type=int,
+                            help="Ids of the channels (default: all).")
+        parser.add_argument("--resolution", action="append",
+                            choices=[r for r, _ in Rollup.RESOLUTIONS],
+                            help="Resolution to compute, can be repeated "
+                                 "(default: ROLLUP_RESOLUTIONS).")
+
+    def handle(self, *args, **options):
+        channels = options["channels"]
+        if not channels:
+            channels = Channel.objects.order_by("pk").values_list("pk",
+                                                                  flat=True)
+        elif Channel.objects.filter(pk__in=channels).count() < len(
+                set(channels)):
+            raise CommandError("Unknown channel.")
+
+        resolutions = options["resolution"] or settings.ROLLUP_RESOLUTIONS
+        for channel_id in channels:
+            n_rollups = backfill(channel_id, resolutions)
+            self.stdout.write("Channel {}: {} rollups.".format(channel_id,
+                                                               n_rollups))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from sest.outbox import deliver
+
+import time
+
+
+class Command(BaseCommand):
+    help = ("Send the reactions written to the outbox (when REACTIONS_MODE "
+            "is 'outbox'), retrying the ones that failed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Max number of reactions sent with each "
+                                 "transaction (default: OUTBOX_BATCH).")
+        parser.add_argument("--interval", type=float, default=5.0,
+                            help="Seconds to wait when no reaction is due.")
+        parser.add_argument("--once", action="store_true",
+                            help="Exit as soon as no reaction is due.")
+
+    def handle(self, *args, **options):
+        while True:
+            n_delivered, n_failed = deliver(options["batch_size"])
+            if n_delivered or n_failed:
+                self.stdout.write("{} reactions delivered, {} failed.".format(
+                    n_delivered, n_failed))
+            elif options["once"]:
+                return
+            else:
+                time.sleep(options["interval"])
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, InterfaceError, close_old_connections
+
+from sest.spool import get_spool, drain
+
+import sqlite3
+import time
+
+# Longest wait between the attempts while the DB or the spool is unavailable,
+# in seconds.
+MAX_BACKOFF = 60
+
+
+class Command(BaseCommand):
+    help = ("Move the records queued by the upload view (when INGEST_MODE is "
+            "'queue') to the DB, in large transactions.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Max number of records saved with each "
+                                 "transaction (default: INGEST_SPOOL_BATCH).")
+        parser.add_argument("--interval", type=float, default=1.0,
+                            help="Seconds to wait when the spool is empty.")
+        parser.add_argument("--once", action="store_true",
+                            help="Exit as soon as the spool is empty.")
+
+    def handle(self, *args, **options):
+        spool = get_spool()
+        backoff = options["interval"]
+
+        while True:
+            try:
+                n_records = drain(spool, options["batch_size"])
+            except (OperationalError, InterfaceError,
+                    sqlite3.OperationalError) as e:
+                # E.g. the DB or the spool is locked: the records are still in
+                # the spool, and are saved once it's available again.
+                self.stderr.write("Records not saved ({}), retrying in {:g} "
+                                  "seconds.".format(e, backoff))
+                close_old_connections()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+
+            backoff = options["interval"]
+            if n_records:
+                self.stdout.write("{} records saved.".format(n_records))
+            elif options["once"]:
+                return
+            else:
+                time.sleep(options["interval"])
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sest.models import Channel
+from sest.export import parse_export, export_chunks, FORMATS
+from sest.series import QueryError
+
+
+class Command(BaseCommand):
+    help = ("Write the records of a channel, one per line, as CSV or "
+            "NDJSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("channel", type=int, help="Id of the channel.")
+        parser.add_argument("--start",
+                            help="Unix epoch or ISO 8601 date of the first "
+                                 "record (default: the oldest one).")
+        parser.add_argument("--end",
+                            help="Unix epoch or ISO 8601 date after the last "
+                                 "record (default: the newest one).")
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument("--header", action="store_true",
+                            help="Start the CSV with the names of the "
+                                 "columns.")
+        parser.add_argument("-o", "--output",
+                            help="File to write (default: the standard "
+                                 "output).")
+
+    def handle(self, *args, **options):
+        if not Channel.objects.filter(pk=options["channel"]).exists():
+            raise CommandError("Unknown channel.")
+        params = {"start": options["start"], "end": options["end"],
+                  "format": options["format"],
+                  "header": "1" if options["header"] else None}
+        try:
+            query = parse_export(options["channel"], params)
+        except QueryError as e:
+            raise CommandError(str(e))
+
+        if options["output"] is None:
+            for chunk in export_chunks(query):
+                self.stdout.write(chunk, ending="")
+            return
+
+        with open(options["output"], "w", newline="") as out:
+            for chunk in export_chunks(query):
+                out.write(chunk)
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sest.models import Channel
+from sest.importer import (CSVImportError, read_csv, resume_point,
+                           skip_imported, import_records)
+
+import sys
+import time
+
+
+class Command(BaseCommand):
+    help = ("Import the history of a channel from a CSV file with the layout "
+            "of sample_without_header.csv (time, id, field values), keeping "
+            "the timestamps of the records.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("channel", type=int, help="Id of the channel.")
+        parser.add_argument("file", help="CSV file to import, or - to read "
+                                         "the standard input.")
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Records saved with each transaction "
+                                 "(default: IMPORT_BATCH_SIZE).")
+        parser.add_argument("--no-reactions", action="store_true",
+                            help="Don't check the conditions of the channel "
+                                 "on the records imported.")
+        parser.add_argument("--resume", action="store_true",
+                            help="Skip the records of the file (in order of "
+                                 "time) not newer than the last one of the "
+                                 "channel, already imported by a previous "
+                                 "run.")
+
+    def handle(self, *args, **options):
+        try:
+            channel = Channel.objects.get(pk=options["channel"])
+        except Channel.DoesNotExist:
+            raise CommandError("Unknown channel.")
+
+        if options["file"] == "-":
+            self._import(channel, sys.stdin, options)
+        else:
+            with open(options["file"], newline="") as lines:
+                self._import(channel, lines, options)
+
+    def _import(self, channel, lines, options):
+        records = read_csv(lines, channel.id)
+        if options["resume"]:
+            last, n_at_last = resume_point(channel.id)
+            if last is not None:
+                self.stdout.write("Resuming after the records of {}.".format(
+                    last.isoformat()))
+                records = skip_imported(records, last, n_at_last)
+
+        started = time.monotonic()
+        n_records = 0
+        try:
+            for n_stored in import_records(channel, records,
+                                           options["batch_size"],
+                                           not options["no_reactions"]):
+                n_records += n_stored
+                elapsed = max(time.monotonic() - started, 1e-6)
+                self.stdout.write("{} records imported, {:.0f} records/s."
+                                  .format(n_records, n_records / elapsed))
+        except CSVImportError as e:
+            raise CommandError("{} ({} records imported before it).".format(
+                e, n_records))
+
+        self.stdout.write("Imported {} records in {:.1f} s.".format(
+            n_records, time.monotonic() - started))
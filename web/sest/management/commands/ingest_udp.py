@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from sest.udp import IngestProtocol, process_datagrams
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+def process(datagrams):
+    # As done for each request, drop the connection to the DB if it's broken
+    # or older than CONN_MAX_AGE.
+    close_old_connections()
+    return process_datagrams(datagrams)
+
+
+class Command(BaseCommand):
+    help = ("Listen for records sent as UDP datagrams, and save them in "
+            "batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default=settings.UDP_INGEST_HOST,
+                            help="Address to listen on (default: "
+                                 "UDP_INGEST_HOST).")
+        parser.add_argument("--port", type=int,
+                            default=settings.UDP_INGEST_PORT,
+                            help="Port to listen on (default: "
+                                 "UDP_INGEST_PORT).")
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Max number of datagrams saved with each "
+                                 "transaction (default: UDP_BATCH_SIZE).")
+        parser.add_argument("--flush-interval", type=float, default=None,
+                            help="Max seconds a datagram waits before being "
+                                 "saved (default: UDP_FLUSH_INTERVAL).")
+
+    def handle(self, *args, **options):
+        # A single worker, so that the batches are saved in order.
+        executor = ThreadPoolExecutor(max_workers=1)
+        loop = asyncio.new_event_loop()
+
+        transport, protocol = loop.run_until_complete(
+            loop.create_datagram_endpoint(
+                lambda: IngestProtocol(
+                    executor, batch_size=options["batch_size"],
+                    flush_interval=options["flush_interval"],
+                    process=process),
+                local_addr=(options["host"], options["port"])))
+
+        self.stdout.write("Listening on {}:{}.".format(
+            *transport.get_extra_info("sockname")[:2]))
+
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            protocol.flush()
+            transport.close()
+            executor.submit(lambda: connections.close_all())
+            executor.shutdown(wait=True)
+            loop.close()
+            if protocol.dropped:
+                self.stdout.write("{} datagrams dropped.".format(
+                    protocol.dropped))
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from sest.inactivity import InactivityMonitor
+
+import time
+
+
+class Command(BaseCommand):
+    help = ("Send an alert for the channels that receive no record within "
+            "their update interval.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--poll-interval", type=float, default=None,
+                            help="Seconds between the reads of the new "
+                                 "records (default: INACTIVITY_POLL).")
+        parser.add_argument("--once", action="store_true",
+                            help="Check the deadlines once, and exit.")
+
+    def handle(self, *args, **options):
+        poll_interval = options["poll_interval"] or settings.INACTIVITY_POLL
+        monitor = InactivityMonitor()
+        monitor.load()
+        self.stdout.write("Watching {} channels.".format(
+            len(monitor.intervals)))
+
+        next_poll = time.time() + poll_interval
+        while True:
+            now = time.time()
+            if now >= next_poll:
+                monitor.poll(now)
+                next_poll = now + poll_interval
+
+            n_inactive = monitor.expire(now)
+            if n_inactive:
+                self.stdout.write("{} channels inactive.".format(n_inactive))
+            if options["once"]:
+                return
+
+            close_old_connections()
+            time.sleep(min(monitor.next_wakeup(poll_interval, now),
+                           max(0, next_poll - now)))
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:19
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sest', '0019_auto_20170305_1647'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='record',
+            name='insertion_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='registration date and time'),
+        ),
+    ]
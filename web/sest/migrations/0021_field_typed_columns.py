@@ -0,0 +1,96 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:24
+
+from django.db import migrations, models
+
+import math
+
+BATCH_SIZE = 1000
+
+
+def to_typed_columns(apps, schema_editor):
+    """Move the values of the fields with a float or int encoding from the
+    string column to the typed ones.
+    """
+
+    Field = apps.get_model("sest", "Field")
+    FieldMetadata = apps.get_model("sest", "FieldMetadata")
+
+    numeric = (FieldMetadata.objects
+               .filter(encoding__in=("float", "int"))
+               .values_list("channel_id", "field_no", "encoding"))
+
+    for channel_id, field_no, encoding in numeric:
+        fields = (Field.objects
+                  .filter(record__channel_id=channel_id, field_no=field_no,
+                          _value_real__isnull=True, _value_int__isnull=True)
+                  .exclude(_value=""))
+        batch = []
+        for f in fields.iterator():
+            try:
+                v = float(f._value)
+            except ValueError:
+                continue
+
+            if not math.isfinite(v):
+                continue
+            elif encoding == "float":
+                f._value_real = v
+            elif -2 ** 63 <= int(v) < 2 ** 63:
+                f._value_int = int(v)
+            else:
+                continue
+
+            f._value = ""
+            batch.append(f)
+            if len(batch) == BATCH_SIZE:
+                Field.objects.bulk_update(batch, ["_value", "_value_real",
+                                                  "_value_int"])
+                batch = []
+
+        Field.objects.bulk_update(batch, ["_value", "_value_real",
+                                          "_value_int"])
+
+
+def to_string_column(apps, schema_editor):
+    Field = apps.get_model("sest", "Field")
+
+    batch = []
+    for f in (Field.objects.filter(_value="")
+              .exclude(_value_real__isnull=True, _value_int__isnull=True)
+              .iterator()):
+        if f._value_real is not None:
+            f._value = str(f._value_real)
+        else:
+            f._value = str(f._value_int)
+        batch.append(f)
+        if len(batch) == BATCH_SIZE:
+            Field.objects.bulk_update(batch, ["_value"])
+            batch = []
+
+    Field.objects.bulk_update(batch, ["_value"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sest', '0020_alter_record_insertion_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='field',
+            name='_value_int',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='field',
+            name='_value_real',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='field',
+            name='_value',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.RunPython(to_typed_columns, to_string_column),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sest', '0021_field_typed_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSequence',
+            fields=[
+                ('channel', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='sest.channel')),
+                ('high', models.BigIntegerField(default=-1)),
+                ('bitmap', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
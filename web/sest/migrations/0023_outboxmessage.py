@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sest', '0022_uploadsequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('retrying', 'Retrying'), ('delivered', 'Delivered'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('delivered', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('condition', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sest.conditionandreaction')),
+                ('record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sest.record')),
+            ],
+            options={
+                'index_together': {('status', 'next_attempt')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sest', '0023_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConditionState',
+            fields=[
+                ('condition', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='sest.conditionandreaction')),
+                ('active', models.BooleanField(default=False)),
+                ('last_fired', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='conditionandreaction',
+            name='cooldown',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conditionandreaction',
+            name='hysteresis',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conditionandreaction',
+            name='on_transition',
+            field=models.BooleanField(default=False),
+        ),
+    ]
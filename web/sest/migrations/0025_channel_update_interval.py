@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sest', '0024_condition_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='inactive_since',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='update_interval',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='channel',
+            name='last_update',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sest', '0025_channel_update_interval'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conditionandreaction',
+            name='aggregate',
+            field=models.CharField(blank=True, default='', max_length=5),
+        ),
+        migrations.AddField(
+            model_name='conditionandreaction',
+            name='window_seconds',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conditionandreaction',
+            name='window_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
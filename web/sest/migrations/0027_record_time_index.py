@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:49
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sest', '0026_condition_aggregate'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='record',
+            index_together={('channel', 'insertion_time')},
+        ),
+    ]
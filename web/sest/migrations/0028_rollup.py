@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sest', '0027_record_time_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field_no', models.PositiveSmallIntegerField()),
+                ('resolution', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')], max_length=6)),
+                ('bucket', models.DateTimeField()),
+                ('count', models.BigIntegerField()),
+                ('min', models.FloatField()),
+                ('max', models.FloatField()),
+                ('sum', models.FloatField()),
+                ('sum_sq', models.FloatField()),
+                ('channel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sest.channel')),
+            ],
+            options={
+                'unique_together': {('channel', 'field_no', 'resolution', 'bucket')},
+            },
+        ),
+    ]
@@ -1,12 +1,17 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
-from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
 
-from .email_collection import send_email_wrapper
+from .email_collection import build_email, send_emails
+from .schema import get_schema
+from .conditions import compile_condition, get_conditions, CompiledConditions
+from .dispatch import dispatch_reaction
+from .debounce import StateTracker
 
 import uuid
-import operator as op
-from itertools import product
+import math
+from collections import namedtuple
 
 
 messages = {
@@ -19,6 +24,69 @@ messages = {
 }
 
 
+# Functions that restore the original meaning of the values, which are stored
+# as strings, according to the encoding set in the FieldMetadata objects.
+decoders = {
+    "float": float,
+    # See R18.
+    "int": lambda v: int(float(v)),
+    "string": str,
+}
+
+
+def decode_value(encoding, value):
+    """Restore the original value of a field from its string representation.
+
+    Raise a KeyError in case no decoding operation is defined for the
+    encoding, and a ValueError in case the value doesn't match it.
+    """
+
+    try:
+        return decoders[encoding](value)
+    except OverflowError:
+        # int(float("inf")) overflows instead of raising a ValueError.
+        raise ValueError(value)
+
+
+def typed_columns(encoding, value):
+    """Return the values of the columns of a Field that stores `value',
+    which has already been checked against the encoding.
+
+    Numbers are stored in the column of their type, so that reading them
+    doesn't need any parsing and the DB can compare them; strings, and the
+    numbers that don't fit in the numeric columns (e.g. NaN), in _value.
+    """
+
+    columns = {"_value": "", "_value_real": None, "_value_int": None}
+
+    if encoding == "float":
+        columns["_value_real"] = float(value)
+        if math.isfinite(columns["_value_real"]):
+            return columns
+    elif encoding == "int":
+        columns["_value_int"] = decode_value(encoding, value)
+        if -2 ** 63 <= columns["_value_int"] < 2 ** 63:
+            return columns
+
+    return {"_value": str(value), "_value_real": None, "_value_int": None}
+
+
+def stored_value(value, value_real, value_int):
+    """Return the value of a field from its columns: a number for the ones
+    saved in the typed columns, a string otherwise (see typed_columns).
+    """
+
+    if value_real is not None:
+        return value_real
+    if value_int is not None:
+        return value_int
+    return value
+
+
+# A record with the values of its fields, as displayed in the channel page.
+RecordRow = namedtuple("RecordRow", ("pk", "insertion_time", "values"))
+
+
 class WrongEncoding(Exception):
     """Raised when attempting to save an object with an encoding different than
     the one defined in its associated FieldMetadata
@@ -65,9 +133,10 @@ class Channel(models.Model):
     # An autoincrement field called `id' is automatically provided by django.
     title = models.CharField(max_length=200, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    last_update = models.DateTimeField(auto_now=True, blank=True)
+    # Indexed, to find the channels changed since a time (see inactivity.py).
+    last_update = models.DateTimeField(auto_now=True, blank=True,
+                                       db_index=True)
     description = models.TextField(max_length=500, blank=True)
-    # TODO: create a method that allows the user to regenerate another uuid.
     write_key = models.UUIDField(default=uuid.uuid4, editable=False)
     number_fields = models.PositiveSmallIntegerField()
 
@@ -75,10 +144,25 @@ class Channel(models.Model):
                                            blank=True, null=True,
                                            on_delete=models.CASCADE)
 
+    # Seconds within which a record is expected: an alert is sent when none
+    # arrives (see inactivity.py). Channels without it aren't monitored.
+    update_interval = models.PositiveIntegerField(null=True, blank=True)
+    # When the channel was reported as inactive, until a record arrives.
+    inactive_since = models.DateTimeField(null=True, blank=True,
+                                          editable=False)
+
     def __str__(self):
         return "{} (created by user: '{}')".format(str(self.id),
                                                    repr(self.user))
 
+    def regenerate_write_key(self):
+        """Replace the write key with a new one: uploads signed with the old
+        key are refused from now on.
+        """
+
+        self.write_key = uuid.uuid4()
+        self.save(update_fields=["write_key"])
+
     def get_field_encoding(self, field_no):
         # There should never be a MultipleObjectsReturned exception, since
         # there's a unique constraint on channel and field_no fields of the
@@ -86,41 +170,132 @@ class Channel(models.Model):
         return self.fieldmetadata_set.get(field_no=field_no)
 
     def get_encoding(self, field_no):
-        return self.get_field_encoding(field_no).encoding
+        # Read from the cache of the FieldMetadata, to avoid a query for each
+        # field decoded.
+        try:
+            return get_schema(self.id).encodings[field_no]
+        except KeyError:
+            raise FieldMetadata.DoesNotExist(
+                "No FieldMetadata for field no. {}.".format(field_no))
 
     def get_field_names(self):
-        return (f_md.name for f_md in self.fieldmetadata_set.all())
+        schema = get_schema(self.id)
+        return tuple(schema.names[n] for n in schema.field_numbers)
+
+    def last_rows(self, n):
+        """Return the last `n' records, as RecordRow tuples, with the values
+        of their fields decoded and in the order of the field numbers (the
+        one of `get_field_names'), or None for the fields they lack.
+
+        The records and all their fields are read with two queries, whatever
+        their number, and decoded with the encodings in the cache.
+        """
 
-    def send_email(self, message=""):
+        records = list(Record.objects
+                       .filter(channel=self.id)
+                       .order_by("-insertion_time", "-pk")
+                       .values_list("pk", "insertion_time")[:n])
+        if not records:
+            return []
+
+        schema = get_schema(self.id)
+        columns = {field_no: i
+                   for i, field_no in enumerate(schema.field_numbers)}
+        values = {pk: [None] * len(columns) for pk, _ in records}
+
+        fields = (Field.objects
+                  .filter(record__in=values)
+                  .values_list("record_id", "field_no", "_value",
+                               "_value_real", "_value_int"))
+        for record_id, field_no, *columns_values in fields:
+            if field_no not in columns:
+                continue
+            v = stored_value(*columns_values)
+            try:
+                v = decode_value(schema.encodings[field_no], v)
+            except ValueError:
+                # Show the values saved with a wrong encoding as they are.
+                pass
+            values[record_id][columns[field_no]] = v
+
+        return [RecordRow(pk, t, values[pk]) for pk, t in records]
+
+    def alert_email(self, message=""):
         if not self.notification_email:
             raise ValueError("No email connected to the "
                              "channel {}.".format(self))
 
-        send_email_wrapper(
+        return build_email(
             recipients_list=[self.notification_email.email],
             subject="Alert. Condition validated on channel {}".format(self),
             text_body=message,
         )
 
-    def check_and_react(self, record_to_check):
-        """For every possible combination of conditions in the channel and
-        fields in the record, check whether at least one is satisfied and
-        then trigger the action in that channel.
-
-        TODO: do we want to let the user trigger multiple conditions, or
-        execute only the first one and then stop the checking? Actually the
-        first one prevents the others from being executed.
+    def send_email(self, message="", fail_silently=True):
+        send_emails([self.alert_email(message)], fail_silently)
+
+    def check_and_react(self, record_to_check, fields=None, conditions=None,
+                        match=None):
+        """Check whether at least one of the conditions in the channel is
+        satisfied by the fields in the record, and then trigger the action
+        of the first one, or of all of them when `match' (by default
+        CONDITIONS_MATCH) is "all".
+
+        The fields of the record are read from the DB, unless they're
+        already available in memory and passed as arguments; the conditions
+        of the channel come from the cache of the compiled conditions (see
+        conditions.py), unless a list of them is passed.
+        The conditions with a cooldown, on_transition or hysteresis, and the
+        ones on an aggregate, react according to the records checked before
+        (see debounce.py and windows.py).
+        The actions run now, or in another thread, according to
+        REACTIONS_MODE (see dispatch.py).
         """
 
-        for cond, f in product(self.conditionandreaction_set.all(),
-                               record_to_check.field_set.all()):
+        if conditions is None:
+            compiled = get_conditions(self.id)
+        else:
+            compiled = CompiledConditions(conditions)
+
+        if not compiled:
+            return
+
+        if fields is None:
+            fields = record_to_check.field_set.all()
+
+        match_all = (match or settings.CONDITIONS_MATCH) == "all"
+
+        def reacting(extra=()):
+            if match_all:
+                return compiled.all_matches(fields, extra)
+            # If a condition is validated, trigger the relative action and
+            # then quit the execution of further actions.
+            cond = compiled.first_match(fields, extra)
+            return [] if cond is None else [cond]
+
+        if compiled.stateful or compiled.windowed:
+            tracker = StateTracker(self.id, record_to_check)
+            conds = tracker.save(reacting(tracker.check(compiled, fields)))
+        else:
+            conds = reacting()
+
+        for cond in conds:
+            dispatch_reaction(cond, record_to_check)
+
+
+class UploadSequence(models.Model):
+    """Sliding window of the sequence numbers of the last uploads received by
+    a channel, used to drop the ones retried by the devices (see
+    sequence.py).
+
+    `high' is the highest sequence number received; bit i of `bitmap' is set
+    when the number high - i has been received too.
+    """
 
-            reaction = cond.check_condition(f)
-            if reaction:
-                # If a condition is validated, trigger the relative action and
-                # then quit the execution of further actions.
-                cond.react(record_to_check)
-                return
+    channel = models.OneToOneField(Channel, on_delete=models.CASCADE,
+                                   primary_key=True)
+    high = models.BigIntegerField(default=-1)
+    bitmap = models.BigIntegerField(default=0)
 
 
 class FieldMetadata(models.Model):
@@ -174,6 +349,18 @@ class ConditionAndReaction(models.Model):
     * ew: ends with
     * eq: is equal
     * ne: isn't equal/is different from
+
+    A condition can also remember the previous records (see debounce.py),
+    to avoid reacting to every record of a value that keeps on satisfying
+    it, or that hovers around a threshold:
+    * cooldown: seconds after a reaction during which it doesn't react again;
+    * on_transition: react only when it becomes satisfied, not while it
+      stays so;
+    * hysteresis: once satisfied, lt, le, gt, ge, bt and ot stay so until
+      the value goes past the threshold by this amount.
+
+    Numeric conditions can compare an aggregate (avg, min, max, rate, count)
+    of the last values of the field, instead of the last one.
     """
 
     # FIXME: implement all the checks to validate user's input.
@@ -191,6 +378,17 @@ class ConditionAndReaction(models.Model):
     # Store the action the user choose to perform if the condition is met.
     action = models.CharField(max_length=10)
 
+    cooldown = models.PositiveIntegerField(default=0)
+    on_transition = models.BooleanField(default=False)
+    hysteresis = models.FloatField(default=0)
+
+    # The aggregate of the last values of the field compared instead of the
+    # value just uploaded, over the last `window_size' values and/or the ones
+    # of the last `window_seconds' seconds (see windows.py).
+    aggregate = models.CharField(max_length=5, blank=True, default="")
+    window_size = models.PositiveIntegerField(null=True, blank=True)
+    window_seconds = models.PositiveIntegerField(null=True, blank=True)
+
     @property
     def val(self):
         if self.condition_op in ("lt", "le", "eq", "ne",
@@ -217,61 +415,58 @@ class ConditionAndReaction(models.Model):
         if field_obj.field_no != self.field_no:
             return False
 
-        if self.condition_op == "lt":
-            return op.lt(field_obj.val, self.val)
-        elif self.condition_op == "le":
-            return op.le(field_obj.val, self.val)
-        elif self.condition_op == "eq":
-            return op.eq(field_obj.val, self.val)
-        elif self.condition_op == "ne":
-            return op.ne(field_obj.val, self.val)
-        elif self.condition_op == "gt":
-            return op.gt(field_obj.val, self.val)
-        elif self.condition_op == "ge":
-            return op.ge(field_obj.val, self.val)
-
-        elif self.condition_op == "bt":
-            return self.val < field_obj.val < self.val_opt
-        elif self.condition_op == "ot":
-            return not (self.val < field_obj.val < self.val_opt)
-
+        # The operators are defined once, in conditions.py, for both the
+        # single conditions and the ones compiled for a whole channel.
         # TODO: test correctness with str and bytes objects (py3).
-        elif self.condition_op == "cn":
-            return self.val in field_obj.val
-        elif self.condition_op == "nc":
-            return self.val not in field_obj.val
-        elif self.condition_op == "sw":
-            return field_obj.val.startswith(self.val)
-        elif self.condition_op == "ew":
-            return field_obj.val.endswith(self.val)
-        # We can rely on eq and ne in the arithmetic section also for strings.
-
-        # In case no operation is defined for the given condition_op string:
-        raise ValueError("No conditional operation is defined for operation "
-                         "'{}'.".format(self.condition_op))
-
-    def react(self, record_to_send):
+        return compile_condition(self)(field_obj.val)
+
+    def reaction_email(self, record_to_send):
+        """Return the email to send when the record satisfies the
+        condition.
+        """
+
+        if self.action != "email":
+            # So far there are no other actions allowed to be executed.
+            raise ValueError("No other actions allowed.")
+
         sentence = ("The following record, registered on: {}, verified one of"
                     " your conditions you set on channel {}.".format(
                         record_to_send,
                         self.channel)
                     )
+        return self.channel.alert_email(message=sentence)
 
-        if self.action == "email":
-            self.channel.send_email(message=sentence)
-            return
+    def react(self, record_to_send, fail_silently=True):
+        send_emails([self.reaction_email(record_to_send)], fail_silently)
+
+
+class ConditionState(models.Model):
+    """What a condition with a cooldown, on_transition or hysteresis
+    remembers of the records already checked (see debounce.py).
+    """
 
-        # So far there are no other actions allowed to be executed.
-        raise ValueError("No other actions allowed.")
+    condition = models.OneToOneField(ConditionAndReaction,
+                                     on_delete=models.CASCADE,
+                                     primary_key=True)
+    # Whether the last record checked satisfied the condition.
+    active = models.BooleanField(default=False)
+    # Time of the record the condition last reacted to.
+    last_fired = models.DateTimeField(null=True, blank=True)
 
 
 class Record(models.Model):
     channel = models.ForeignKey(Channel, on_delete=models.CASCADE)
+    # Not an auto_now_add field, because records uploaded in batches can carry
+    # the time they have been collected on the device.
     insertion_time = models.DateTimeField('registration date and time',
-                                          auto_now_add=True)
+                                          default=timezone.now)
     # In order to save also the time the object has been created, create
     # another DateTimeField with auto_now=True.
 
+    class Meta:
+        # The records of a channel are read by range of time.
+        index_together = ("channel", "insertion_time")
+
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         if self.field_set.count() > 0:
@@ -285,13 +480,30 @@ class Record(models.Model):
                            ", ".join(_fields)))
 
 
+class FieldQuerySet(models.QuerySet):
+
+    def value_between(self, low, high):
+        """Filter the numeric fields with a value in the closed interval
+        [low, high], letting the DB compare the typed columns.
+        """
+
+        return self.filter(models.Q(_value_real__range=(low, high)) |
+                           models.Q(_value_int__range=(low, high)))
+
+
 class Field(models.Model):
     record = models.ForeignKey(Record, on_delete=models.CASCADE)
     field_no = models.PositiveSmallIntegerField()
     # We save every field value as a string, and then we use a function defined
     # by the user inside each channel to restore the original meaning of the
     # value.
-    _value = models.CharField(max_length=100)
+    # Values of fields with a float or int encoding are stored in the typed
+    # columns instead, and _value is left empty (see typed_columns).
+    _value = models.CharField(max_length=100, blank=True)
+    _value_real = models.FloatField(null=True, blank=True)
+    _value_int = models.BigIntegerField(null=True, blank=True)
+
+    objects = FieldQuerySet.as_manager()
 
     class Meta:
         unique_together = ("record", "field_no")
@@ -311,53 +523,156 @@ class Field(models.Model):
             # encoding from a restricted and system-defined list.
             raise ValueError
 
+        if self._value_real is None and self._value_int is None:
+            encoding = get_schema(self.record.channel_id).encodings[
+                self.field_no]
+            for column, v in typed_columns(encoding, self._value).items():
+                setattr(self, column, v)
+
         super().save(*args, **kwargs)
 
     def __str__(self):
         return "{}".format(self.val)
 
+    @property
+    def stored_value(self):
+        """The value as stored in the DB: a number for the fields saved in the
+        typed columns, a string otherwise.
+        """
+
+        return stored_value(self._value, self._value_real, self._value_int)
+
     @property
     def val(self):
+        # Use the id of the channel, so that the channel object doesn't need
+        # to be fetched from the DB.
+        schema = get_schema(self.record.channel_id)
+        value = self.stored_value
         try:
-            encoding = self.record.channel.get_encoding(field_no=self.field_no)
-        except ObjectDoesNotExist:
+            encoding = schema.encodings[self.field_no]
+        except KeyError:
             # If no FieldMetadata are defined for the field the user attempts
             # to save:
             raise NoEncoding(messages["NO_ENCODING"].format(
                 self.field_no,
                 self.record.channel,
                 None,
-                self._value,
+                value,
             )
             )
 
         try:
-            if encoding == "float":
-                return float(self._value)
-            elif encoding == "int":
-                # See R18.
-                return int(float(self._value))
-            elif encoding == "string":
-                return self._value
+            # Values in the typed columns are converted without any parsing.
+            return decode_value(encoding, value)
         except ValueError:
             # If an incorrect value has been saved as a string into the DB:
             raise WrongEncoding(messages["WRONG_ENCODING"].format(
                 self.field_no,
                 self.record.channel,
                 encoding,
-                self._value,
+                value,
             )
             )
-        else:
+        except KeyError:
             # If no decoding operations are defined to restore the value:
             raise NoEncoding(messages["NO_ENCODING"].format(
                 self.field_no,
                 self.record.channel,
                 encoding,
-                self._value,
+                value,
             )
             )
 
     @val.setter
     def val(self, v):
         self._value = v
+        self._value_real = None
+        self._value_int = None
+
+
+class Rollup(models.Model):
+    """Aggregates of the numeric values of a field of a channel, over the
+    minute, the hour or the day (UTC) starting at `bucket' (see rollups.py).
+    """
+
+    MINUTE = "minute"
+    HOUR = "hour"
+    DAY = "day"
+    RESOLUTIONS = (
+        (MINUTE, "Minute"),
+        (HOUR, "Hour"),
+        (DAY, "Day"),
+    )
+
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE)
+    field_no = models.PositiveSmallIntegerField()
+    resolution = models.CharField(max_length=6, choices=RESOLUTIONS)
+    bucket = models.DateTimeField()
+    count = models.BigIntegerField()
+    min = models.FloatField()
+    max = models.FloatField()
+    sum = models.FloatField()
+    # Sum of the squares, for the variance.
+    sum_sq = models.FloatField()
+
+    class Meta:
+        unique_together = ("channel", "field_no", "resolution", "bucket")
+
+    def __str__(self):
+        return "Rollup of field no. {} of channel {} ({} from {})".format(
+            self.field_no, self.channel_id, self.resolution, self.bucket)
+
+    @property
+    def mean(self):
+        return self.sum / self.count
+
+    @property
+    def variance(self):
+        # Population variance; rounding can make it slightly negative.
+        return max(self.sum_sq / self.count - self.mean ** 2, 0.0)
+
+
+class OutboxMessage(models.Model):
+    """A reaction waiting to be delivered, written in the same transaction
+    as the record that triggered it when REACTIONS_MODE is "outbox" (see
+    outbox.py).
+    """
+
+    PENDING = "pending"
+    RETRYING = "retrying"
+    DELIVERED = "delivered"
+    FAILED = "failed"
+    STATUSES = (
+        (PENDING, "Pending"),
+        (RETRYING, "Retrying"),
+        (DELIVERED, "Delivered"),
+        (FAILED, "Failed"),
+    )
+
+    condition = models.ForeignKey(ConditionAndReaction,
+                                  on_delete=models.CASCADE)
+    record = models.ForeignKey(Record, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUSES,
+                              default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created = models.DateTimeField(default=timezone.now)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    delivered = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        index_together = ("status", "next_attempt")
+
+    def __str__(self):
+        return "Reaction of condition {} to record {} ({})".format(
+            self.condition_id, self.record_id, self.status)
+
+    @property
+    def latency(self):
+        """Time from the collection of the record to the delivery of the
+        reaction.
+        """
+
+        if self.delivered is None:
+            return None
+        return self.delivered - self.record.insertion_time
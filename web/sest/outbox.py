@@ -0,0 +1,118 @@
+"""Durable delivery of the reactions, used when REACTIONS_MODE = "outbox".
+
+The reactions triggered by a record are written as OutboxMessage rows within
+the transaction that stores the record: either both are saved, or neither.
+The `deliver_outbox' management command then sends them in batches, outside
+of the upload requests. The ones that fail are retried with an exponential
+backoff, OUTBOX_BACKOFF seconds after the first failure and up to
+OUTBOX_MAX_BACKOFF, and marked as failed after OUTBOX_MAX_ATTEMPTS attempts.
+
+The state of every reaction can be queried, e.g. the ones still waiting:
+
+    OutboxMessage.objects.filter(status__in=("pending", "retrying"))
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxMessage
+from .email_collection import send_emails
+
+import logging
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(cond, record):
+    """Write the reaction of the condition satisfied by the record to the
+    outbox.
+    """
+
+    OutboxMessage.objects.create(condition=cond, record=record)
+
+
+def backoff(attempts):
+    """Return the time to wait before retrying a reaction that has failed
+    `attempts' times.
+    """
+
+    seconds = settings.OUTBOX_BACKOFF * 2 ** (attempts - 1)
+    return timedelta(seconds=min(seconds, settings.OUTBOX_MAX_BACKOFF))
+
+
+def _claim(now, batch_size):
+    """Return the reactions due, up to `batch_size', with their next
+    attempt moved OUTBOX_CLAIM_TIMEOUT seconds later, so that the other
+    instances of the command skip them while they're being sent.
+    """
+
+    with transaction.atomic():
+        # Other instances of the command skip the rows being claimed, on the
+        # DBs that support it.
+        due = list(
+            OutboxMessage.objects
+            .select_for_update(skip_locked=True)
+            .filter(status__in=(OutboxMessage.PENDING,
+                                OutboxMessage.RETRYING),
+                    next_attempt__lte=now)
+            .select_related("condition__channel__notification_email",
+                            "record")
+            .order_by("next_attempt", "pk")
+            [:batch_size])
+        OutboxMessage.objects.filter(pk__in=[msg.pk for msg in due]).update(
+            next_attempt=now + timedelta(
+                seconds=settings.OUTBOX_CLAIM_TIMEOUT))
+    return due
+
+
+def deliver(batch_size=None, now=None):
+    """Send the reactions due, up to `batch_size' (by default
+    OUTBOX_BATCH), and return the number of them sent and of the ones
+    failed.
+
+    The reactions are claimed and their results saved in two short
+    transactions, and no transaction is open while the emails are sent.
+    The ones claimed by a command that stopped before saving the results
+    are sent again after OUTBOX_CLAIM_TIMEOUT seconds.
+    """
+
+    now = now or timezone.now()
+    n_delivered = n_failed = 0
+
+    due = _claim(now, batch_size or settings.OUTBOX_BATCH)
+    if not due:
+        return n_delivered, n_failed
+
+    # Build all the emails first, to send them together.
+    emails, errors = {}, {}
+    for msg in due:
+        try:
+            emails[msg.pk] = msg.condition.reaction_email(msg.record)
+        except Exception as e:
+            errors[msg.pk] = e
+    errors.update(zip(emails, send_emails(list(emails.values()))))
+
+    with transaction.atomic():
+        for msg in due:
+            e = errors[msg.pk]
+            msg.attempts += 1
+            if e is not None:
+                logger.warning("Delivery of %s failed: %s", msg, e)
+                n_failed += 1
+                msg.last_error = "{}: {}".format(type(e).__name__, e)
+                if msg.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                    msg.status = OutboxMessage.FAILED
+                else:
+                    msg.status = OutboxMessage.RETRYING
+                    msg.next_attempt = now + backoff(msg.attempts)
+            else:
+                n_delivered += 1
+                msg.status = OutboxMessage.DELIVERED
+                msg.delivered = timezone.now()
+
+            msg.save(update_fields=["status", "attempts", "next_attempt",
+                                    "delivered", "last_error"])
+
+    return n_delivered, n_failed
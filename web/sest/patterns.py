@@ -0,0 +1,183 @@
+"""Index of the string conditions on a field (cn, nc, sw, ew), to match a
+value against all of them in a single pass over its characters.
+
+* cn/nc: an Aho-Corasick automaton of the patterns finds all the ones the
+  value contains, whatever their number;
+* sw: a trie of the patterns, walked along the value, finds the ones that
+  are prefixes of it;
+* ew: a trie of the reversed patterns, walked along the reversed value, finds
+  the ones that are suffixes of it.
+
+As in thresholds.py, the entries indexed are (position, condition) tuples.
+"""
+
+from collections import deque
+
+
+class Trie:
+    """Trie of strings, each one with a list of entries attached."""
+
+    def __init__(self):
+        self.children = [{}]
+        self.entries = [[]]
+
+    def add(self, key, entry):
+        node = 0
+        for ch in key:
+            next_node = self.children[node].get(ch)
+            if next_node is None:
+                next_node = len(self.children)
+                self.children.append({})
+                self.entries.append([])
+                self.children[node][ch] = next_node
+            node = next_node
+        self.entries[node].append(entry)
+        return node
+
+    def prefixes(self, text):
+        """Return the entries of the keys that are prefixes of `text'."""
+
+        found = list(self.entries[0])
+        node = 0
+        for ch in text:
+            node = self.children[node].get(ch)
+            if node is None:
+                break
+            found.extend(self.entries[node])
+        return found
+
+
+class AhoCorasick:
+    """Automaton that finds which ones of a set of patterns occur in a text,
+    in time linear in the length of the text plus the number of patterns
+    found.
+    """
+
+    def __init__(self, patterns):
+        self._trie = Trie()
+        for pattern_id, pattern in enumerate(patterns):
+            self._trie.add(pattern, pattern_id)
+
+        goto = self._trie.children
+        n_nodes = len(goto)
+        # Longest proper suffix of the string of each node that is also in
+        # the trie, and closest node along that chain ending a pattern.
+        self.fail = [0] * n_nodes
+        self.output_link = [-1] * n_nodes
+
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                queue.append(child)
+
+                f = self.fail[node]
+                while f and ch not in goto[f]:
+                    f = self.fail[f]
+                f = goto[f].get(ch, 0)
+                self.fail[child] = f if f != child else 0
+
+                f = self.fail[child]
+                self.output_link[child] = (f if self._trie.entries[f] or
+                                           f == 0 else self.output_link[f])
+
+    def search(self, text):
+        """Return the set of the ids (the order in the list passed to the
+        constructor) of the patterns that occur in `text'.
+        """
+
+        goto, fail = self._trie.children, self.fail
+        entries, output_link = self._trie.entries, self.output_link
+
+        # The empty pattern, if any, is in every text.
+        found = set(entries[0])
+        visited = set()
+
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+
+            # Collect the patterns ending here, following the output links
+            # only up to a node already collected.
+            out = node
+            while out > 0 and out not in visited:
+                visited.add(out)
+                found.update(entries[out])
+                out = output_link[out]
+
+        return found
+
+
+class PatternIndex:
+    """String conditions on a field, as (operation, pattern, position,
+    condition) tuples.
+    """
+
+    def __init__(self, entries):
+        entries = list(entries)
+        self.size = len(entries)
+
+        patterns = {}
+        # {pattern id: [(position, condition)]}, for cn and nc.
+        self.contains = {}
+        self.not_contains = []
+        self.starts = Trie()
+        self.ends = Trie()
+
+        for operation, pattern, position, cond in entries:
+            if operation == "sw":
+                self.starts.add(pattern, (position, cond))
+            elif operation == "ew":
+                self.ends.add(pattern[::-1], (position, cond))
+            else:
+                pattern_id = patterns.setdefault(pattern, len(patterns))
+                if operation == "cn":
+                    self.contains.setdefault(pattern_id, []).append(
+                        (position, cond))
+                else:
+                    self.not_contains.append((position, pattern_id, cond))
+
+        self.not_contains.sort(key=lambda e: e[0])
+        self.automaton = AhoCorasick(sorted(patterns, key=patterns.get))
+
+    def __len__(self):
+        return self.size
+
+    def _found(self, text):
+        if self.contains or self.not_contains:
+            return self.automaton.search(text)
+        return set()
+
+    def matches(self, text):
+        """Return the entries satisfied by the string `text'."""
+
+        found = self._found(text)
+
+        matched = self.starts.prefixes(text)
+        matched.extend(self.ends.prefixes(text[::-1]))
+        for pattern_id in found:
+            matched.extend(self.contains.get(pattern_id, ()))
+        matched.extend((position, cond)
+                       for position, pattern_id, cond in self.not_contains
+                       if pattern_id not in found)
+        return matched
+
+    def first(self, text):
+        """Return the entry with the lowest position satisfied by the string
+        `text', or None.
+        """
+
+        found = self._found(text)
+
+        candidates = self.starts.prefixes(text)
+        candidates.extend(self.ends.prefixes(text[::-1]))
+        for pattern_id in found:
+            candidates.extend(self.contains.get(pattern_id, ()))
+        for position, pattern_id, cond in self.not_contains:
+            if pattern_id not in found:
+                candidates.append((position, cond))
+                break
+
+        return min(candidates) if candidates else None
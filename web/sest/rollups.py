@@ -0,0 +1,316 @@
+"""Aggregates of the numeric fields of the channels over every minute, hour
+and day, kept up to date as the records are stored.
+
+Each Rollup row holds the count, the minimum, the maximum, the sum and the
+sum of the squares of the values of a field within a bucket of time, so
+that the statistics over a long range (e.g. the mean and the standard
+deviation over a month) need to read a row per bucket instead of every
+value. The read API uses them for its buckets (see series.py).
+
+The records stored by `ingest.store_records' update the rollups of the
+resolutions in ROLLUP_RESOLUTIONS within the same transaction, with a single
+upsert for a whole batch where the DB supports it. The records saved in
+other ways (e.g. by Record.save), and the ones saved before the rollups
+existed, are added by the `backfill_rollups' management command, which
+computes the rollups of a channel again from all its values.
+"""
+
+from django.conf import settings
+from django.db import connection, transaction, IntegrityError
+from django.db.models import F
+from django.db.models.functions import Least, Greatest
+
+from .models import Rollup, Field
+
+import math
+from datetime import datetime, timezone
+from itertools import chain
+
+# Length of the buckets of each resolution, in seconds.
+RESOLUTIONS = {
+    Rollup.MINUTE: 60,
+    Rollup.HOUR: 3600,
+    Rollup.DAY: 86400,
+}
+
+# Rows written by each statement, below the limit of 999 parameters of the
+# older SQLite versions.
+UPSERT_CHUNK = 100
+
+COLUMNS = ("channel_id", "field_no", "resolution", "bucket", "count", "min",
+           "max", "sum", "sum_sq")
+
+
+def bucket_start(timestamp, resolution):
+    """Return the start of the bucket of the resolution holding the time
+    (a unix epoch), as an aware datetime.
+    """
+
+    size = RESOLUTIONS[resolution]
+    return datetime.fromtimestamp(timestamp // size * size, timezone.utc)
+
+
+def aggregate(samples, resolutions=None):
+    """Aggregate the (time, field number, value) samples, with the time as
+    a unix epoch, and return {(field number, resolution, bucket): [count,
+    min, max, sum, sum of squares]}.
+    """
+
+    if resolutions is None:
+        resolutions = settings.ROLLUP_RESOLUTIONS
+
+    found = {}
+    for t, field_no, v in samples:
+        # The squares of the large integers don't fit in the INTEGER of the
+        # DBs, and the columns are floats anyway.
+        v = float(v)
+        for resolution in resolutions:
+            key = (field_no, resolution, bucket_start(t, resolution))
+            a = found.get(key)
+            if a is None:
+                found[key] = [1, v, v, v, v * v]
+            else:
+                a[0] += 1
+                if v < a[1]:
+                    a[1] = v
+                if v > a[2]:
+                    a[2] = v
+                a[3] += v
+                a[4] += v * v
+    return found
+
+
+def _upsert_sql(n_rows):
+    qn = connection.ops.quote_name
+    table = qn(Rollup._meta.db_table)
+    columns = ", ".join(qn(c) for c in COLUMNS)
+    row = "({})".format(", ".join(["%s"] * len(COLUMNS)))
+    values = ", ".join([row] * n_rows)
+    count, low, high, total, total_sq = (qn(c) for c in COLUMNS[4:])
+
+    if connection.vendor == "mysql":
+        return (
+            "INSERT INTO {table} ({columns}) VALUES {values} "
+            "ON DUPLICATE KEY UPDATE "
+            "{count} = {count} + VALUES({count}), "
+            "{low} = LEAST({low}, VALUES({low})), "
+            "{high} = GREATEST({high}, VALUES({high})), "
+            "{total} = {total} + VALUES({total}), "
+            "{total_sq} = {total_sq} + VALUES({total_sq})").format(**locals())
+
+    # SQLite has the multi-argument MIN and MAX instead of LEAST and
+    # GREATEST.
+    least, greatest = (("MIN", "MAX") if connection.vendor == "sqlite" else
+                       ("LEAST", "GREATEST"))
+    keys = ", ".join(qn(c) for c in COLUMNS[:4])
+    return (
+        "INSERT INTO {table} ({columns}) VALUES {values} "
+        "ON CONFLICT ({keys}) DO UPDATE SET "
+        "{count} = {table}.{count} + excluded.{count}, "
+        "{low} = {least}({table}.{low}, excluded.{low}), "
+        "{high} = {greatest}({table}.{high}, excluded.{high}), "
+        "{total} = {table}.{total} + excluded.{total}, "
+        "{total_sq} = {table}.{total_sq} + excluded.{total_sq}"
+    ).format(**locals())
+
+
+def _upsert(channel_id, rows):
+    bucket_field = Rollup._meta.get_field("bucket")
+    items = list(rows.items())
+    for i in range(0, len(items), UPSERT_CHUNK):
+        chunk = items[i:i + UPSERT_CHUNK]
+        params = []
+        for (field_no, resolution, bucket), a in chunk:
+            params.extend([channel_id, field_no, resolution,
+                           bucket_field.get_db_prep_value(bucket, connection)])
+            params.extend(a)
+        with connection.cursor() as cursor:
+            cursor.execute(_upsert_sql(len(chunk)), params)
+
+
+def _update_one(channel_id, key, a):
+    field_no, resolution, bucket = key
+    count, low, high, total, total_sq = a
+    rows = Rollup.objects.filter(channel=channel_id, field_no=field_no,
+                                 resolution=resolution, bucket=bucket)
+    return rows.update(count=F("count") + count,
+                       min=Least("min", low),
+                       max=Greatest("max", high),
+                       sum=F("sum") + total,
+                       sum_sq=F("sum_sq") + total_sq)
+
+
+def _update(channel_id, rows):
+    for key, a in rows.items():
+        if _update_one(channel_id, key, a):
+            continue
+        field_no, resolution, bucket = key
+        try:
+            with transaction.atomic():
+                Rollup.objects.create(
+                    channel_id=channel_id, field_no=field_no,
+                    resolution=resolution, bucket=bucket,
+                    **dict(zip(COLUMNS[4:], a)))
+        except IntegrityError:
+            # Created in the meanwhile by another transaction.
+            _update_one(channel_id, key, a)
+
+
+def add_to_rollups(channel_id, samples):
+    """Add the (time, field number, value) samples of the channel to its
+    rollups.
+    """
+
+    rows = aggregate(samples)
+    if not rows:
+        return
+    if connection.vendor in ("sqlite", "postgresql", "mysql"):
+        _upsert(channel_id, rows)
+    else:
+        _update(channel_id, rows)
+
+
+def stored_samples(stored):
+    """Yield the samples of the numeric values of the (record, fields)
+    tuples returned by `ingest.store_records'.
+    """
+
+    for r, fields in stored:
+        t = r.insertion_time.timestamp()
+        for f in fields:
+            # The finite numbers are the ones in the typed columns.
+            v = f._value_real if f._value_real is not None else f._value_int
+            if v is not None:
+                yield (t, f.field_no, v)
+
+
+def backfill(channel_id, resolutions=None, chunk_size=20000):
+    """Compute again the rollups of the channel from all its values, and
+    return the number of rollups written.
+
+    Records stored while it runs may be counted twice or not at all: run it
+    before enabling the rollups, or while the channel is quiet.
+    """
+
+    if resolutions is None:
+        resolutions = settings.ROLLUP_RESOLUTIONS
+
+    values = (Field.objects
+              .filter(record__channel=channel_id)
+              .values_list("record__insertion_time", "field_no",
+                           "_value_real", "_value_int")
+              .iterator(chunk_size=chunk_size))
+
+    def samples():
+        for t, field_no, real, integer in values:
+            v = real if real is not None else integer
+            if v is not None:
+                yield (t.timestamp(), field_no, float(v))
+
+    with transaction.atomic():
+        Rollup.objects.filter(channel=channel_id,
+                              resolution__in=resolutions).delete()
+        rows = aggregate(samples(), resolutions)
+        Rollup.objects.bulk_create(
+            [Rollup(channel_id=channel_id, field_no=field_no,
+                    resolution=resolution, bucket=bucket,
+                    **dict(zip(COLUMNS[4:], a)))
+             for (field_no, resolution, bucket), a in rows.items()],
+            batch_size=1000)
+
+    return len(rows)
+
+
+def read_rollups(channel_id, field_no, resolution, start, end):
+    """Return the rollups of a field with buckets starting in [start, end),
+    in order of time.
+    """
+
+    return (Rollup.objects
+            .filter(channel=channel_id, field_no=field_no,
+                    resolution=resolution, bucket__gte=start,
+                    bucket__lt=end)
+            .order_by("bucket"))
+
+
+def summary(channel_id, field_no, resolution, start, end):
+    """Return the count, min, max, mean and standard deviation of the values
+    of a field, from the rollups of the buckets in [start, end), or None if
+    there are no values.
+    """
+
+    count, low, high, total, total_sq = 0, None, None, 0.0, 0.0
+    for r in read_rollups(channel_id, field_no, resolution, start, end):
+        count += r.count
+        low = r.min if low is None else min(low, r.min)
+        high = r.max if high is None else max(high, r.max)
+        total += r.sum
+        total_sq += r.sum_sq
+
+    if not count:
+        return None
+    mean = total / count
+    return {"count": count, "min": low, "max": high, "mean": mean,
+            "stddev": max(total_sq / count - mean ** 2, 0.0) ** 0.5}
+
+
+def rollup_resolution(width):
+    """Return the coarsest resolution of the rollups with buckets not longer
+    than `width' seconds, or None.
+    """
+
+    return max((r for r in settings.ROLLUP_RESOLUTIONS
+                if RESOLUTIONS[r] <= width),
+               key=RESOLUTIONS.get, default=None)
+
+
+def full_buckets(start, end, resolution):
+    """Return the start of the first and the end of the last bucket of the
+    resolution within the unix epochs `start' and `end', i.e. the range
+    covered by whole rollups (empty if the two are equal).
+    """
+
+    size = RESOLUTIONS[resolution]
+    first = math.ceil(start / size) * size
+    return first, max(first, math.floor(end / size) * size)
+
+
+def rollup_buckets(channel_id, field_no, resolution, start, end, n,
+                   points=()):
+    """Merge the rollups of a field into `n' buckets of the same length
+    between the unix epochs `start' and `end', and return them as
+    `downsample.buckets' does.
+
+    Only the rollups within the range are read (see `full_buckets'): the
+    (time, value) `points' must be the values of the rest of the range,
+    at its edges. Every rollup goes to the bucket holding its middle, and
+    every point to the one holding its time.
+    """
+
+    size = RESOLUTIONS[resolution]
+    width = (end - start) / n
+    first, last = full_buckets(start, end, resolution)
+    rollups = (read_rollups(channel_id, field_no, resolution,
+                            datetime.fromtimestamp(first, timezone.utc),
+                            datetime.fromtimestamp(last, timezone.utc))
+               .values_list("bucket", "count", "min", "max", "sum"))
+    aggregates = chain(
+        ((bucket.timestamp() + size / 2, count, low, high, total)
+         for bucket, count, low, high, total in rollups),
+        ((t, 1, v, v, v) for t, v in points))
+
+    # {bucket: [min, max, sum, count]}
+    found = {}
+    for t, count, low, high, total in aggregates:
+        i = min(max(int((t - start) / width), 0), n - 1)
+        b = found.get(i)
+        if b is None:
+            found[i] = [low, high, total, count]
+        else:
+            b[0] = min(b[0], low)
+            b[1] = max(b[1], high)
+            b[2] += total
+            b[3] += count
+
+    return [(start + i * width, low, high, total / count, count)
+            for i, (low, high, total, count) in sorted(found.items())]
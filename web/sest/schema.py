@@ -0,0 +1,40 @@
+"""Cache of the FieldMetadata of each channel.
+
+Decoding a field needs the encoding of its field number: reading it from the
+cache, instead of querying the DB every time, makes the number of queries
+needed to save or display a record independent of the number of its fields.
+"""
+
+from .cache import ChannelCache
+
+
+class ChannelSchema:
+    """The encodings and the names of the fields of a channel, keyed by field
+    number.
+    """
+
+    def __init__(self, field_metadata):
+        # `field_metadata' is an iterable of (field_no, encoding, name).
+        self.encodings = {}
+        self.names = {}
+        for field_no, encoding, name in field_metadata:
+            self.encodings[field_no] = encoding
+            self.names[field_no] = name
+
+        self.field_numbers = sorted(self.encodings)
+
+
+def load_schema(channel_id):
+    # Imported here since the models use the cache too.
+    from .models import FieldMetadata
+
+    return ChannelSchema(FieldMetadata.objects
+                         .filter(channel=channel_id)
+                         .values_list("field_no", "encoding", "name"))
+
+
+schemas = ChannelCache(load_schema)
+
+
+def get_schema(channel_id):
+    return schemas.get(channel_id)
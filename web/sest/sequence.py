@@ -0,0 +1,83 @@
+"""Detection of the uploads retried by the devices.
+
+A device can send a sequence number with each record, increasing by one for
+each upload: when the reply to an upload gets lost, the device sends the
+record again with the same number, and the copy is dropped instead of being
+saved (and reacted to) twice.
+
+Instead of looking up the sequence number among all the records of the
+channel, only the highest number received and a bitmap of the WINDOW numbers
+below it are kept for each channel (in an UploadSequence row), as done
+against replayed packets by IPsec (RFC 4303, section 3.4.3):
+
+* numbers above the highest one are new, and move the window forward;
+* numbers inside the window are new unless their bit is set;
+* numbers below the window are considered to come from a device that has
+  restarted its counter, e.g. after a reboot, and restart the window.
+
+Devices should hence keep their counter across reboots (e.g. in the RTC
+memory of the ESP8266), or start it again from a number far from the last
+one used.
+"""
+
+from .models import UploadSequence
+
+# Numbers tracked below the highest one: the bitmap fits the signed 64 bits
+# column.
+WINDOW = 63
+MASK = (1 << WINDOW) - 1
+
+
+def advance(high, bitmap, seq):
+    """Check the sequence number `seq' against the window (high, bitmap).
+
+    Return a (new, high, bitmap) tuple, where `new' is False for the numbers
+    already received, and (high, bitmap) is the updated window.
+    """
+
+    if seq > high:
+        shift = seq - high
+        bitmap = ((bitmap << shift) | 1) & MASK if shift < WINDOW else 1
+        return True, seq, bitmap
+
+    offset = high - seq
+    if offset >= WINDOW:
+        # The device has restarted its counter.
+        return True, seq, 1
+
+    if bitmap >> offset & 1:
+        return False, high, bitmap
+    return True, high, bitmap | 1 << offset
+
+
+def filter_new(channel, sequences):
+    """Return a list of booleans telling which of the uploads to the channel,
+    with the given sequence numbers (None when missing), are new, and record
+    them as received.
+
+    Must be called in the same transaction that saves the records: the row
+    of the window is locked until it ends, and the window is rolled back
+    together with the records in case of errors.
+    """
+
+    if all(seq is None for seq in sequences):
+        return [True] * len(sequences)
+
+    window, _ = (UploadSequence.objects.select_for_update()
+                 .get_or_create(channel_id=channel.id))
+    high, bitmap = window.high, window.bitmap
+
+    keep = []
+    for seq in sequences:
+        if seq is None:
+            keep.append(True)
+            continue
+
+        new, high, bitmap = advance(high, bitmap, seq)
+        keep.append(new)
+
+    if (high, bitmap) != (window.high, window.bitmap):
+        (UploadSequence.objects.filter(pk=window.pk)
+         .update(high=high, bitmap=bitmap))
+
+    return keep
@@ -0,0 +1,255 @@
+"""Read API of the values of the numeric fields of a channel over a range of
+time, for charts and dashboards:
+
+    GET /12345678/data/?start=2017-03-01&end=2017-03-15&fields=1,2
+        &max_points=500&downsampling=lttb&format=json
+
+* start, end: unix epochs or ISO 8601 dates (by default, the last
+  READ_DEFAULT_RANGE seconds);
+* fields: comma-separated field numbers (by default, all the numeric ones);
+* max_points: max number of points returned for each field (by default
+  READ_MAX_POINTS, and at most READ_MAX_POINTS_LIMIT);
+* downsampling: "lttb" (the default) or "buckets", used for the fields with
+  more values than max_points in the range (see downsample.py);
+* format: "json" (the default) or "csv".
+
+With "lttb", each field has a list of [time, value] points; with "buckets",
+a list of [time, min, max, avg, count] buckets, where the values not
+downsampled make buckets of their own. Times are unix epochs.
+
+Buckets at least as long as the ones of a resolution of the rollups are
+merged from them (see rollups.py), reading a row for each rollup instead of
+every value.
+
+Like the channel page, the API doesn't need any key.
+"""
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Field
+from .schema import get_schema
+from .ingest import parse_timestamp, IngestError
+from .downsample import lttb_stream, buckets
+from .rollups import rollup_resolution, rollup_buckets, full_buckets
+
+import csv
+from datetime import datetime, timedelta
+from itertools import chain, islice
+
+messages = {
+    "WRONG_RANGE": ("The start and the end of the range must be unix epochs "
+                    "or ISO 8601 dates, with the start before the end."),
+    "WRONG_FIELDS_REQUESTED": ("The fields requested must be numbers of "
+                               "numeric fields of the channel, separated by "
+                               "commas."),
+    "WRONG_MAX_POINTS": "The max number of points must be at least 3.",
+    "WRONG_DOWNSAMPLING": "The downsampling must be 'lttb' or 'buckets'.",
+    "WRONG_FORMAT": "The format must be 'json' or 'csv'.",
+}
+
+NUMERIC_ENCODINGS = ("float", "int")
+DOWNSAMPLINGS = ("lttb", "buckets")
+FORMATS = ("json", "csv")
+
+
+class QueryError(Exception):
+    """Raised when the parameters of a request to the read API are wrong;
+    the message is one of the strings defined in `messages'.
+    """
+    pass
+
+
+class SeriesQuery:
+
+    def __init__(self, channel_id, start, end, fields, max_points,
+                 downsampling="lttb", format="json"):
+        self.channel_id = channel_id
+        self.start = start
+        self.end = end
+        self.fields = fields
+        self.max_points = max_points
+        self.downsampling = downsampling
+        self.format = format
+
+
+def _parse_time(value):
+    try:
+        return parse_timestamp(value)
+    except IngestError:
+        raise QueryError(messages["WRONG_RANGE"])
+
+
+def parse_query(channel_id, params):
+    """Return the SeriesQuery of the parameters of the request."""
+
+    end = params.get("end")
+    end = timezone.now() if end is None else _parse_time(end)
+    start = params.get("start")
+    if start is None:
+        try:
+            start = end - timedelta(seconds=settings.READ_DEFAULT_RANGE)
+        except OverflowError:
+            # An end at the beginning of the range of the datetimes.
+            raise QueryError(messages["WRONG_RANGE"])
+    else:
+        start = _parse_time(start)
+    if start >= end:
+        raise QueryError(messages["WRONG_RANGE"])
+
+    schema = get_schema(channel_id)
+    numeric = [n for n in schema.field_numbers
+               if schema.encodings[n] in NUMERIC_ENCODINGS]
+    fields = params.get("fields")
+    if fields is None:
+        fields = numeric
+    else:
+        try:
+            fields = [int(n) for n in fields.split(",")]
+        except ValueError:
+            raise QueryError(messages["WRONG_FIELDS_REQUESTED"])
+        if not set(fields) <= set(numeric):
+            raise QueryError(messages["WRONG_FIELDS_REQUESTED"])
+
+    try:
+        max_points = int(params.get("max_points", settings.READ_MAX_POINTS))
+    except ValueError:
+        raise QueryError(messages["WRONG_MAX_POINTS"])
+    if max_points < 3:
+        raise QueryError(messages["WRONG_MAX_POINTS"])
+
+    downsampling = params.get("downsampling", "lttb")
+    if downsampling not in DOWNSAMPLINGS:
+        raise QueryError(messages["WRONG_DOWNSAMPLING"])
+    format = params.get("format", "json")
+    if format not in FORMATS:
+        raise QueryError(messages["WRONG_FORMAT"])
+
+    return SeriesQuery(channel_id, start, end, fields,
+                       min(max_points, settings.READ_MAX_POINTS_LIMIT),
+                       downsampling, format)
+
+
+def _field_rows(channel_id, field_no, start, end, include_end=True):
+    rows = Field.objects.filter(record__channel=channel_id,
+                                field_no=field_no,
+                                record__insertion_time__gte=start)
+    if include_end:
+        return rows.filter(record__insertion_time__lte=end)
+    return rows.filter(record__insertion_time__lt=end)
+
+
+def count_points(channel_id, field_no, start, end):
+    """Return the number of points `read_points' yields."""
+
+    return (_field_rows(channel_id, field_no, start, end)
+            .exclude(_value_real=None, _value_int=None)
+            .count())
+
+
+def read_points(channel_id, field_no, start, end, include_end=True):
+    """Yield the (time, value) points of a numeric field in the range, in
+    order of time, reading them from the DB a chunk at a time.
+    """
+
+    rows = (_field_rows(channel_id, field_no, start, end, include_end)
+            .order_by("record__insertion_time", "record_id")
+            .values_list("record__insertion_time", "_value", "_value_real",
+                         "_value_int")
+            .iterator(chunk_size=2000))
+
+    for t, value, real, integer in rows:
+        if real is not None:
+            v = real
+        elif integer is not None:
+            v = integer
+        else:
+            # Only the non-finite numbers are stored as strings, and JSON
+            # can't represent them.
+            continue
+        yield (t.timestamp(), v)
+
+
+def _bucket_of(point):
+    t, v = point
+    return (t, v, v, v, 1)
+
+
+def read_field(query, field_no):
+    """Return the points, or the buckets, of a field, and whether they have
+    been downsampled.
+    """
+
+    start, end = query.start.timestamp(), query.end.timestamp()
+    if query.downsampling == "buckets":
+        resolution = rollup_resolution((end - start) / query.max_points)
+        if resolution is not None:
+            # The values of the rollups only partly in the range are read
+            # one by one, so that the result is the one of the values.
+            first, last = (datetime.fromtimestamp(t, timezone.utc)
+                           for t in full_buckets(start, end, resolution))
+            edges = chain(read_points(query.channel_id, field_no,
+                                      query.start, first, include_end=False),
+                          read_points(query.channel_id, field_no, last,
+                                      query.end))
+            return rollup_buckets(query.channel_id, field_no, resolution,
+                                  start, end, query.max_points, edges), True
+
+    points = read_points(query.channel_id, field_no, query.start, query.end)
+    # Keep the points in memory only until there are too many of them.
+    head = list(islice(points, query.max_points + 1))
+    downsampled = len(head) > query.max_points
+
+    if query.downsampling == "lttb":
+        if downsampled:
+            # The buckets of LTTB depend on the number of points, counted
+            # so that they're read only once, like for `buckets'.
+            n = count_points(query.channel_id, field_no, query.start,
+                             query.end)
+            head = lttb_stream(chain(head, points), n, query.max_points)
+        return head, downsampled
+
+    if not downsampled:
+        return [_bucket_of(p) for p in head], False
+    return buckets(chain(head, points), start, end, query.max_points), True
+
+
+def read_series(query):
+    """Return the series of the fields of the query, as a dict ready to be
+    serialized to JSON.
+    """
+
+    names = get_schema(query.channel_id).names
+    key = "points" if query.downsampling == "lttb" else "buckets"
+
+    series = []
+    for field_no in query.fields:
+        values, downsampled = read_field(query, field_no)
+        series.append({"field_no": field_no,
+                       "name": names.get(field_no),
+                       "downsampled": downsampled,
+                       key: values})
+
+    return {"channel": query.channel_id,
+            "start": query.start.timestamp(),
+            "end": query.end.timestamp(),
+            "downsampling": query.downsampling,
+            "fields": series}
+
+
+def write_csv(series, out):
+    """Write the series returned by `read_series' to the file-like object
+    `out', a row for each point or bucket.
+    """
+
+    writer = csv.writer(out)
+    if series["downsampling"] == "lttb":
+        writer.writerow(("field_no", "time", "value"))
+        key = "points"
+    else:
+        writer.writerow(("field_no", "time", "min", "max", "avg", "count"))
+        key = "buckets"
+
+    for field in series["fields"]:
+        for row in field[key]:
+            writer.writerow((field["field_no"],) + tuple(row))
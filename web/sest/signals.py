@@ -0,0 +1,43 @@
+"""Keep the caches of the channels coherent with the DB.
+
+Note that bulk operations on querysets (update, bulk_create) don't send any
+signal: the entries touched that way expire only after CHANNEL_CACHE_TTL.
+"""
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Channel, FieldMetadata, ConditionAndReaction
+from .schema import schemas
+from .credentials import channels
+from .conditions import conditions
+from .debounce import states
+from .windows import windows
+
+
+@receiver(post_save, sender=Channel)
+@receiver(post_delete, sender=Channel)
+def invalidate_channel(sender, instance, **kwargs):
+    # Also covers the regeneration of the write key.
+    channels.invalidate(instance.pk)
+    schemas.invalidate(instance.pk)
+    # The compiled conditions keep the channel they react on.
+    conditions.invalidate(instance.pk)
+    states.invalidate(instance.pk)
+    windows.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=FieldMetadata)
+@receiver(post_delete, sender=FieldMetadata)
+def invalidate_field_metadata(sender, instance, **kwargs):
+    schemas.invalidate(instance.channel_id)
+
+
+@receiver(post_save, sender=ConditionAndReaction)
+@receiver(post_delete, sender=ConditionAndReaction)
+def invalidate_conditions(sender, instance, **kwargs):
+    conditions.invalidate(instance.channel_id)
+    # Reload the states too, from the DB they're written to, and the windows
+    # the conditions need.
+    states.invalidate(instance.channel_id)
+    windows.invalidate(instance.channel_id)
@@ -0,0 +1,219 @@
+"""Local queue of the records uploaded to the channels, used when
+INGEST_MODE = "queue".
+
+The upload view only validates the records and appends them to a SQLite file
+separated from the main DB, which is cheap and never waits for the lock held
+by the writers of the main DB. The `drain_ingest_spool' management command
+then moves them to the main DB in large transactions, and checks the
+reactions.
+
+Records are removed from the spool only after the transaction on the main DB
+has been committed: if the writer is killed in between, the records of the
+last batch are saved again the next time it starts.
+
+When a batch can't be saved, its records are saved again one at a time, and
+the ones that still fail (or that can't even be read) are moved, with the
+error, to the `failed' table of the spool, so that they don't block the
+records queued after them.
+"""
+
+from django.conf import settings
+from django.db import OperationalError, InterfaceError
+from django.utils import timezone
+
+from .models import Channel
+from .ingest import store_grouped, react_to_records
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class Spool:
+
+    def __init__(self, path):
+        self.path = path
+        # sqlite3 connections can't be shared among threads.
+        self._local = threading.local()
+
+    @property
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30,
+                                   isolation_level=None)
+            # The WAL journal lets the writer read while the views append.
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS spool ("
+                         "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "channel_id INTEGER NOT NULL, "
+                         "insertion_time REAL NOT NULL, "
+                         "fields TEXT NOT NULL)")
+            # Records that can't be saved, set aside by `drain'.
+            conn.execute("CREATE TABLE IF NOT EXISTS failed ("
+                         "id INTEGER PRIMARY KEY, "
+                         "channel_id INTEGER, "
+                         "insertion_time REAL, "
+                         "fields TEXT, "
+                         "error TEXT NOT NULL, "
+                         "failed_at REAL NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def append(self, channel_id, validated):
+        """Queue the records validated by `ingest.validate_batch' (or a
+        single one by `ingest.validate_fields'), keeping the time of arrival
+        of the records without a timestamp.
+        """
+
+        now = timezone.now().timestamp()
+        rows = [(channel_id,
+                 timestamp.timestamp() if timestamp else now,
+                 json.dumps(values))
+                for timestamp, values in validated]
+
+        with self._conn:
+            self._conn.executemany("INSERT INTO spool (channel_id, "
+                                   "insertion_time, fields) VALUES (?, ?, ?)",
+                                   rows)
+
+    def peek(self, limit):
+        """Return the oldest records in the queue, as a list of
+        (id, channel_id, timestamp, {field_no: value}) tuples; the timestamp
+        and the values are None for the records that can't be read.
+        """
+
+        rows = self._conn.execute("SELECT id, channel_id, insertion_time, "
+                                  "fields FROM spool ORDER BY id LIMIT ?",
+                                  (limit,))
+        records = []
+        for _id, channel_id, ts, fields in rows:
+            try:
+                timestamp = datetime.fromtimestamp(ts, tz=timezone.utc)
+                values = {int(k): v for k, v in json.loads(fields).items()}
+            except (TypeError, ValueError, AttributeError, OverflowError,
+                    OSError):
+                timestamp = values = None
+            records.append((_id, channel_id, timestamp, values))
+        return records
+
+    def remove(self, up_to_id):
+        with self._conn:
+            self._conn.execute("DELETE FROM spool WHERE id <= ?", (up_to_id,))
+
+    def fail(self, record_id, error):
+        """Move a record from the queue to the `failed' table, with the
+        reason why it can't be saved.
+        """
+
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            conn.execute("INSERT OR REPLACE INTO failed (id, channel_id, "
+                         "insertion_time, fields, error, failed_at) "
+                         "SELECT id, channel_id, insertion_time, fields, ?, ? "
+                         "FROM spool WHERE id = ?",
+                         (error, time.time(), record_id))
+            conn.execute("DELETE FROM spool WHERE id = ?", (record_id,))
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def failed(self):
+        """Return the number of records in the `failed' table."""
+
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM failed").fetchone()[0]
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+
+_spools = {}
+_spools_lock = threading.Lock()
+
+
+def get_spool():
+    """Return the spool at INGEST_SPOOL_PATH, shared by the whole process."""
+
+    path = settings.INGEST_SPOOL_PATH
+    with _spools_lock:
+        if path not in _spools:
+            _spools[path] = Spool(path)
+        return _spools[path]
+
+
+def _store(rows):
+    by_channel = {}
+    for _, channel_id, timestamp, values in rows:
+        by_channel.setdefault(channel_id, []).append((timestamp, values))
+
+    # Records of channels deleted in the meantime are dropped.
+    channels = Channel.objects.in_bulk(list(by_channel))
+
+    return store_grouped({channels[channel_id]: validated
+                          for channel_id, validated in by_channel.items()
+                          if channel_id in channels})
+
+
+def _fail(spool, record_id, error):
+    logger.warning("Spooled record %d not saved: %s", record_id, error)
+    spool.fail(record_id, error)
+
+
+def _store_each(spool, rows):
+    """Save the records one at a time, with a transaction each, setting
+    aside the ones that fail because of their contents.
+    """
+
+    stored = []
+    for row in rows:
+        try:
+            stored.extend(_store([row]))
+        except (OperationalError, InterfaceError):
+            # The DB is unavailable (or locked): the record isn't to blame.
+            raise
+        except Exception as e:
+            _fail(spool, row[0], repr(e))
+        else:
+            spool.remove(row[0])
+    return stored
+
+
+def drain(spool, batch_size=None):
+    """Move a batch of records from the spool to the DB, with a single
+    transaction, then check their reactions.
+
+    If the batch can't be saved, its records are saved one at a time, and
+    the ones that fail are set aside (see Spool.fail).
+    Return the number of records read from the spool.
+    """
+
+    rows = spool.peek(batch_size or settings.INGEST_SPOOL_BATCH)
+    if not rows:
+        return 0
+
+    readable = []
+    for row in rows:
+        if row[3] is None:
+            _fail(spool, row[0], "Corrupt record.")
+        else:
+            readable.append(row)
+
+    try:
+        stored = _store(readable)
+    except Exception:
+        stored = _store_each(spool, readable)
+    else:
+        spool.remove(rows[-1][0])
+
+    for channel, records in stored:
+        react_to_records(channel, records)
+
+    return len(rows)
@@ -0,0 +1,154 @@
+"""Ingest of long streams of records, possibly for many channels, sent by
+gateways with a single (usually chunked) request.
+
+Each line of the body is a JSON object with the id and the write key of the
+channel, besides the fields of the record and an optional timestamp:
+
+    {"channel": 3, "write_key": "e2af5d04-...", "field1": 21.5}
+    {"channel": 4, "write_key": "0b8a4c44-...", "field2": 7, "timestamp": ...}
+
+The body is read one line at a time, and the records are saved in batches of
+STREAM_BATCH_SIZE lines, so that the memory used doesn't depend on the length
+of the stream. Lines with errors are skipped, and reported in the summary.
+"""
+
+from django.conf import settings
+
+from .ingest import (IngestError, messages, authenticate, parse_timestamp,
+                     validate_fields, TIMESTAMP_KEY, ingest_grouped)
+from .schema import get_schema
+from .spool import get_spool
+
+import json
+
+
+def request_stream(request):
+    """Return a file-like object to read the body of the request from.
+
+    Django reads at most CONTENT_LENGTH bytes of the body, which is missing
+    from chunked requests: in that case read directly the input provided by
+    the WSGI server, which has already decoded the chunks.
+    """
+
+    if (not request.META.get("CONTENT_LENGTH") and
+            request.META.get("HTTP_TRANSFER_ENCODING", "").lower() ==
+            "chunked"):
+        return request.META["wsgi.input"]
+    return request
+
+
+def iter_lines(stream, max_length):
+    """Yield the lines of the stream, or None in place of the lines longer
+    than `max_length' bytes, which are skipped without being kept in memory.
+    """
+
+    while True:
+        line = stream.readline(max_length + 1)
+        if not line:
+            return
+
+        if len(line) > max_length:
+            while line and not line.endswith(b"\n"):
+                line = stream.readline(max_length + 1)
+            yield None
+        else:
+            yield line
+
+
+def validate_line(line):
+    """Return the channel and the validated record of a line."""
+
+    try:
+        record = json.loads(line.decode("utf-8"))
+    except ValueError:
+        raise IngestError(messages["WRONG_BATCH_FORMAT"])
+
+    if not isinstance(record, dict):
+        raise IngestError(messages["WRONG_BATCH_FORMAT"])
+
+    channel = authenticate(record.pop("channel", None),
+                           record.pop("write_key", None))
+
+    timestamp = record.pop(TIMESTAMP_KEY, None)
+    if timestamp is not None:
+        timestamp = parse_timestamp(timestamp)
+
+    return channel, (timestamp, validate_fields(
+        record, get_schema(channel.id).encodings))
+
+
+class StreamSummary:
+    """Counters of the lines processed, and the first STREAM_MAX_ERRORS
+    errors found.
+    """
+
+    def __init__(self):
+        self.lines = 0
+        self.saved = 0
+        self.queued = 0
+        self.errors = []
+        self.errors_omitted = 0
+
+    def add_error(self, line_no, error):
+        if len(self.errors) < settings.STREAM_MAX_ERRORS:
+            self.errors.append({"line": line_no, "error": error})
+        else:
+            self.errors_omitted += 1
+
+    def as_dict(self):
+        return {
+            "lines": self.lines,
+            "saved": self.saved,
+            "queued": self.queued,
+            "failed": len(self.errors) + self.errors_omitted,
+            "errors": self.errors,
+            "errors_omitted": self.errors_omitted,
+        }
+
+
+def _flush(pending, summary):
+    if settings.INGEST_MODE == "queue":
+        for channel, validated in pending.items():
+            get_spool().append(channel.id, validated)
+            summary.queued += len(validated)
+    else:
+        summary.saved += ingest_grouped(pending)
+
+
+def ingest_stream(stream):
+    """Validate and save the records of the stream, committing them every
+    STREAM_BATCH_SIZE lines, and return a StreamSummary.
+    """
+
+    summary = StreamSummary()
+    pending = {}
+    n_pending = 0
+
+    for line_no, line in enumerate(iter_lines(stream,
+                                              settings.STREAM_MAX_LINE), 1):
+        if line is None:
+            summary.lines += 1
+            summary.add_error(line_no, messages["LINE_TOO_LONG"])
+            continue
+        if not line.strip():
+            continue
+
+        summary.lines += 1
+        try:
+            channel, validated = validate_line(line)
+        except IngestError as e:
+            summary.add_error(line_no, str(e))
+            continue
+
+        pending.setdefault(channel, []).append(validated)
+        n_pending += 1
+
+        if n_pending >= settings.STREAM_BATCH_SIZE:
+            _flush(pending, summary)
+            pending = {}
+            n_pending = 0
+
+    if pending:
+        _flush(pending, summary)
+
+    return summary
@@ -0,0 +1,135 @@
+from django.test import TestCase, Client
+from django.conf import settings
+from django.core import mail
+
+from .models import *
+from .views import messages
+
+import json
+from datetime import datetime
+
+
+class BatchUpload(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.u = User.objects.create(username="test")
+        self.ch = Channel.objects.create(user=self.u,
+                                         number_fields=2
+                                         )
+        self.channel_uuid = str(self.ch.write_key)
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float")
+        self.ch.fieldmetadata_set.create(field_no=2, encoding="int")
+
+    def post_batch(self, body, content_type="text/plain"):
+        return self.client.post("/{}/".format(self.ch.id), body,
+                                content_type=content_type,
+                                HTTP_X_SEST_WRITE_KEY=self.channel_uuid)
+
+    def test_upload_lines_successful(self):
+        """Save every line of a text/plain body as a separate record."""
+
+        body = "field1=21.5&field2=40\nfield1=22&field2=41\n\nfield2=42\n"
+        response = self.post_batch(body)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Record.objects.count(), 3)
+        self.assertEqual(Field.objects.count(), 5)
+        self.assertEqual(
+            sorted(f.val for f in Field.objects.filter(field_no=2)),
+            [40, 41, 42])
+
+    def test_upload_json_with_timestamps(self):
+        """Keep the timestamps the device sent with the records."""
+
+        body = {"records": [
+            {"field1": 21.5, "timestamp": 1482230083},
+            {"field1": 22.5, "timestamp": "2016-12-20 10:35:07 UTC"},
+            {"field1": 23.5},
+        ]}
+        response = self.post_batch(json.dumps(body), "application/json")
+
+        self.assertEqual(response.status_code, 200)
+        times = [r.insertion_time for r in
+                 Record.objects.order_by("insertion_time")]
+        self.assertEqual(times[0], datetime(2016, 12, 20, 10, 34, 43,
+                                            tzinfo=timezone.utc))
+        self.assertEqual(times[1], datetime(2016, 12, 20, 10, 35, 7,
+                                            tzinfo=timezone.utc))
+        self.assertGreater(times[2], times[1])
+
+    def test_upload_wrong_record_saves_nothing(self):
+        """Refuse the whole batch when a single record has a value that
+        doesn't match the encoding of the field.
+        """
+
+        body = [{"field1": 21.5}, {"field2": "asdf"}]
+        response = self.post_batch(json.dumps(body), "application/json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.content.decode("utf-8"),
+                         messages["WRONG_VALUE_FIELD_ENCODING"])
+        self.assertEqual(Record.objects.count(), 0)
+
+    def test_upload_wrong_format(self):
+        for body in ("asdf", "{}", "[1, 2]", "[]"):
+            response = self.post_batch(body, "application/json")
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.content.decode("utf-8"),
+                             messages["WRONG_BATCH_FORMAT"])
+
+    def test_upload_wrong_timestamp(self):
+        response = self.post_batch("field1=2&timestamp=yesterday")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.content.decode("utf-8"),
+                         messages["WRONG_TIMESTAMP"])
+
+    def test_upload_timestamp_out_of_range(self):
+        for timestamp in ("1e20", "-1e20", "NaN"):
+            response = self.post_batch(
+                '[{{"field1": 2, "timestamp": {}}}]'.format(timestamp),
+                "application/json")
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.content.decode("utf-8"),
+                             messages["WRONG_TIMESTAMP"])
+
+        response = self.post_batch("field1=2&timestamp=0001-01-01T00:00:00")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Record.objects.count(), 0)
+
+    def test_upload_duplicate_field_numbers(self):
+        for body, content_type in (
+                ("field1=1&field01=2", "text/plain"),
+                ('[{"field2": 1, "field002": 2}]', "application/json")):
+            response = self.post_batch(body, content_type)
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.content.decode("utf-8"),
+                             messages["WRONG_FIELDS_PASSED"])
+        self.assertEqual(Record.objects.count(), 0)
+
+    def test_upload_exceeding_no_records(self):
+        body = "field1=1\n" * (settings.MAX_BATCH_RECORDS + 1)
+        response = self.post_batch(body)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.content.decode("utf-8"),
+                         messages["NUMBER_RECORDS_EXCEEDED"])
+
+    def test_upload_batch_triggers_reactions(self):
+        recipient = self.u.notificationemail_set.create(
+            address=settings.DEFAULT_FROM_EMAIL)
+        self.ch.notification_email = recipient
+        self.ch.save()
+        self.ch.conditionandreaction_set.create(condition_op="gt",
+                                                field_no=1,
+                                                val=30,
+                                                action="email"
+                                                )
+
+        self.post_batch("field1=21\nfield1=31\nfield1=35\n")
+
+        self.assertEqual(len(mail.outbox), 2)
@@ -0,0 +1,77 @@
+from django.test import TestCase, Client
+
+from .models import *
+from .views import messages
+from .binary import CONTENT_TYPE, parse_frame, encode_frame
+
+import struct
+
+
+class BinaryUpload(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.u = User.objects.create(username="test")
+        self.ch = Channel.objects.create(user=self.u,
+                                         number_fields=3
+                                         )
+        self.channel_uuid = str(self.ch.write_key)
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float")
+        self.ch.fieldmetadata_set.create(field_no=2, encoding="int")
+        self.ch.fieldmetadata_set.create(field_no=3, encoding="string")
+
+    def post_frame(self, frame):
+        return self.client.post("/{}/".format(self.ch.id), frame,
+                                content_type=CONTENT_TYPE,
+                                HTTP_X_SEST_WRITE_KEY=self.channel_uuid)
+
+    def test_frame_round_trip(self):
+        records = [(None, {1: 21.5, 2: 40, 3: "ok"}),
+                   (1482230083, {2: 2 ** 40})]
+        decoded = parse_frame(encode_frame(records))
+
+        self.assertEqual(decoded[0], (None, {1: 21.5, 2: 40, 3: "ok"}))
+        self.assertEqual(decoded[1][0].timestamp(), 1482230083)
+        self.assertEqual(decoded[1][1], {2: 2 ** 40})
+
+    def test_upload_float32_record(self):
+        """Upload a frame packed by hand, as a device would do."""
+
+        frame = (b"SE" + struct.pack("<BH", 1, 1) +
+                 struct.pack("<BB", 0, 2) +
+                 struct.pack("<BBf", 1, 1, 21.5) +
+                 struct.pack("<BBi", 2, 3, 43))
+        response = self.post_frame(frame)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(f.val for f in Field.objects.all()),
+                         [21.5, 43])
+
+    def test_upload_many_records(self):
+        frame = encode_frame([(1482230083 + i, {1: float(i), 3: "s"})
+                              for i in range(10)])
+        response = self.post_frame(frame)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Record.objects.count(), 10)
+        self.assertEqual(Field.objects.count(), 20)
+
+    def test_upload_wrong_frames(self):
+        frame = encode_frame([(None, {1: 21.5})])
+
+        # No records, wrong magic, truncated, trailing bytes, unknown type.
+        for wrong in (b"SE\x01\0\0", b"XX" + frame[2:], frame[:-1],
+                      frame + b"\0", frame[:-9] + b"\x09" + frame[-8:]):
+            response = self.post_frame(wrong)
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.content.decode("utf-8"),
+                             messages["WRONG_BINARY_FORMAT"])
+        self.assertEqual(Record.objects.count(), 0)
+
+    def test_upload_wrong_value_encoding(self):
+        response = self.post_frame(encode_frame([(None, {2: "asdf"})]))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.content.decode("utf-8"),
+                         messages["WRONG_VALUE_FIELD_ENCODING"])
@@ -0,0 +1,172 @@
+from django.test import TestCase, Client
+from django.core import mail
+
+from .models import *
+from .conditions import get_conditions, CompiledConditions
+from .patterns import AhoCorasick
+from .schema import get_schema
+
+import random
+from types import SimpleNamespace
+
+
+class ChannelConditions(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.u = User.objects.create(username="test")
+        ne = NotificationEmail.objects.create(user=self.u,
+                                              address="whatever@test.it")
+        self.ch = Channel.objects.create(user=self.u,
+                                         number_fields=2,
+                                         notification_email=ne
+                                         )
+        self.channel_uuid = str(self.ch.write_key)
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float")
+        self.ch.fieldmetadata_set.create(field_no=2, encoding="string")
+
+    def post(self, d):
+        return self.client.post("/{}/".format(self.ch.id), d,
+                                HTTP_X_SEST_WRITE_KEY=self.channel_uuid)
+
+    def test_checked_without_queries(self):
+        self.ch.conditionandreaction_set.create(condition_op="gt", field_no=1,
+                                                val=10, action="email")
+        get_conditions(self.ch.id)
+        get_schema(self.ch.id)
+
+        r = Record.objects.create(channel=self.ch)
+        fields = [Field(record=r, field_no=1, val="3"),
+                  Field(record=r, field_no=2, val="ok")]
+        with self.assertNumQueries(0):
+            self.ch.check_and_react(r, fields=fields)
+
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_first_condition_reacts(self):
+        """Only the first condition satisfied reacts, even if it checks a
+        field that comes later in the record.
+        """
+
+        first = self.ch.conditionandreaction_set.create(
+            condition_op="sw", field_no=2, val="err", action="email")
+        self.ch.conditionandreaction_set.create(
+            condition_op="bt", field_no=1, val=0, val_opt=10, action="email")
+
+        r = Record.objects.create(channel=self.ch)
+        fields = [Field(record=r, field_no=1, val="5"),
+                  Field(record=r, field_no=2, val="error 3")]
+
+        self.assertEqual(get_conditions(self.ch.id).first_match(fields).pk,
+                         first.pk)
+        self.assertIsNone(get_conditions(self.ch.id).first_match(fields[:0]))
+
+    def test_invalidated_when_conditions_change(self):
+        cond = self.ch.conditionandreaction_set.create(
+            condition_op="lt", field_no=1, val=0, action="email")
+
+        self.post({"field1": 5})
+        self.assertEqual(len(mail.outbox), 0)
+
+        cond.val = 10
+        cond.save()
+        self.post({"field1": 5})
+        self.assertEqual(len(mail.outbox), 1)
+
+        cond.delete()
+        self.post({"field1": 5})
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_unknown_operation(self):
+        self.ch.conditionandreaction_set.create(condition_op="xx", field_no=1,
+                                                val=0, action="email")
+
+        r = Record.objects.create(channel=self.ch)
+        with self.assertRaises(ValueError):
+            self.ch.check_and_react(
+                r, fields=[Field(record=r, field_no=1, val="1")])
+        # Conditions on other fields are never checked.
+        self.ch.check_and_react(r, fields=[Field(record=r, field_no=2,
+                                                 val="a")])
+
+    def test_unknown_operation_after_match(self):
+        """The conditions after the first one satisfied aren't checked."""
+
+        self.ch.conditionandreaction_set.create(condition_op="gt", field_no=1,
+                                                val=0, action="email")
+        self.ch.conditionandreaction_set.create(condition_op="xx", field_no=1,
+                                                val=0, action="email")
+
+        r = Record.objects.create(channel=self.ch)
+        fields = [Field(record=r, field_no=1, val="1")]
+        self.assertEqual(get_conditions(self.ch.id).first_match(fields).pk,
+                         self.ch.conditionandreaction_set.first().pk)
+        with self.assertRaises(ValueError):
+            get_conditions(self.ch.id).all_matches(fields)
+
+    def test_react_to_all_conditions(self):
+        self.ch.conditionandreaction_set.create(condition_op="gt", field_no=1,
+                                                val=0, action="email")
+        self.ch.conditionandreaction_set.create(condition_op="ot", field_no=1,
+                                                val=0, val_opt=3,
+                                                action="email")
+
+        with self.settings(CONDITIONS_MATCH="all"):
+            self.post({"field1": 5})
+        self.assertEqual(len(mail.outbox), 2)
+
+
+class ConditionIndexes(TestCase):
+    """The indexes of the numeric conditions find the same conditions as
+    checking them one by one.
+    """
+
+    def test_same_as_linear_check(self):
+        rnd = random.Random(42)
+        operations = ("lt", "le", "eq", "ne", "gt", "ge", "bt", "ot")
+        conditions = []
+        for _ in range(300):
+            cond = ConditionAndReaction(field_no=1, action="email",
+                                        condition_op=rnd.choice(operations),
+                                        val=rnd.randint(-20, 20))
+            if cond.condition_op in ("bt", "ot"):
+                cond.val_opt = rnd.randint(-20, 20)
+            conditions.append(cond)
+
+        compiled = CompiledConditions(conditions)
+
+        for v in [x / 2 for x in range(-50, 50)] + [float("inf"), 7]:
+            field = SimpleNamespace(field_no=1, val=v)
+            expected = [c for c in conditions if c.check_condition(field)]
+
+            self.assertEqual(compiled.all_matches([field]), expected)
+            self.assertIs(compiled.first_match([field]),
+                          expected[0] if expected else None)
+
+    def test_strings_same_as_linear_check(self):
+        rnd = random.Random(42)
+        words = ["", "a", "ab", "abc", "b", "bc", "bca", "c", "cab", "err",
+                 "error", "ror", "rr"]
+        conditions = [
+            ConditionAndReaction(field_no=1, action="email",
+                                 condition_op=rnd.choice(("cn", "nc", "sw",
+                                                          "ew")),
+                                 val=rnd.choice(words))
+            for _ in range(300)
+        ]
+        compiled = CompiledConditions(conditions)
+
+        for v in ["", "abcab", "error: bca", "xyz", "rror", "cabc"]:
+            field = SimpleNamespace(field_no=1, val=v)
+            expected = [c for c in conditions if c.check_condition(field)]
+
+            self.assertEqual(compiled.all_matches([field]), expected)
+            self.assertIs(compiled.first_match([field]),
+                          expected[0] if expected else None)
+
+    def test_aho_corasick(self):
+        automaton = AhoCorasick(["he", "she", "his", "hers", "e"])
+
+        self.assertEqual(automaton.search("ushers"), {0, 1, 3, 4})
+        self.assertEqual(automaton.search("this"), {2})
+        self.assertEqual(automaton.search("xyz"), set())
@@ -0,0 +1,163 @@
+from django.test import TestCase
+from django.db import transaction
+from django.core import mail
+from django.utils import timezone
+
+from .models import *
+from .conditions import compile_condition
+from .debounce import states
+
+from datetime import timedelta
+
+
+class Debouncing(TestCase):
+
+    def setUp(self):
+        self.u = User.objects.create(username="test")
+        ne = NotificationEmail.objects.create(user=self.u,
+                                              address="whatever@test.it")
+        self.ch = Channel.objects.create(user=self.u,
+                                         number_fields=1,
+                                         notification_email=ne
+                                         )
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float")
+        self.start = timezone.now()
+
+    def check(self, values, seconds=1):
+        """Check a record for each value, `seconds' apart, and return the
+        number of emails sent.
+        """
+
+        sent = len(mail.outbox)
+        for i, v in enumerate(values):
+            r = Record.objects.create(
+                channel=self.ch,
+                insertion_time=self.start + timedelta(seconds=i * seconds))
+            # The states are cached once committed.
+            with self.captureOnCommitCallbacks(execute=True):
+                self.ch.check_and_react(r, fields=[Field(record=r, field_no=1,
+                                                         val=str(v))])
+        self.start += timedelta(seconds=len(values) * seconds)
+        return len(mail.outbox) - sent
+
+    def condition(self, **kwargs):
+        kwargs.setdefault("condition_op", "gt")
+        kwargs.setdefault("val", 30)
+        return self.ch.conditionandreaction_set.create(field_no=1,
+                                                       action="email",
+                                                       **kwargs)
+
+    def test_without_state(self):
+        self.condition()
+        self.assertEqual(self.check([30.5, 29.5, 30.5, 31, 28]), 3)
+        self.assertFalse(ConditionState.objects.exists())
+
+    def test_on_transition(self):
+        self.condition(on_transition=True)
+        self.assertEqual(self.check([31, 32, 33, 20, 31, 32]), 2)
+
+    def test_hysteresis(self):
+        self.condition(on_transition=True, hysteresis=2)
+        # Flapping around the threshold reacts only once.
+        self.assertEqual(self.check([30.5, 29.5, 30.5, 29.5, 30.5]), 1)
+        # Until the value goes below it by the hysteresis.
+        self.assertEqual(self.check([28, 30.5]), 1)
+
+    def test_hysteresis_of_ranges(self):
+        bt = self.condition(condition_op="bt", val=0, val_opt=10,
+                            hysteresis=1)
+        ot = self.condition(condition_op="ot", val=0, val_opt=10,
+                            hysteresis=1)
+        inside = compile_condition(bt, bt.hysteresis)
+        outside = compile_condition(ot, ot.hysteresis)
+
+        self.assertTrue(inside(-0.5) and inside(10.5))
+        self.assertFalse(inside(-1) or inside(11))
+        self.assertTrue(outside(0.5) and outside(9.5))
+        self.assertFalse(outside(1.5) or outside(8.5))
+
+    def test_cooldown(self):
+        self.condition(cooldown=60)
+        self.assertEqual(self.check([31] * 10, seconds=10), 2)
+        self.assertEqual(self.check([31], seconds=10), 0)
+        self.assertEqual(self.check([20, 31], seconds=10), 1)
+
+    def test_state_in_db(self):
+        cond = self.condition(on_transition=True)
+        self.check([31])
+
+        state = ConditionState.objects.get(condition=cond)
+        self.assertTrue(state.active)
+        self.assertIsNotNone(state.last_fired)
+
+        # Another process, or a restart, reads the state from the DB.
+        states.invalidate()
+        self.assertEqual(self.check([32]), 0)
+
+    def test_state_rolled_back(self):
+        """The state changed by a record whose transaction is rolled back is
+        neither saved nor cached.
+        """
+
+        self.condition(on_transition=True)
+        r = Record.objects.create(channel=self.ch)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(ZeroDivisionError), transaction.atomic():
+                self.ch.check_and_react(r, fields=[Field(record=r, field_no=1,
+                                                         val="31")])
+                1 / 0
+
+        self.assertEqual(callbacks, [])
+        self.assertFalse(ConditionState.objects.exists())
+        self.assertEqual(self.check([32]), 1)
+
+    def test_state_changed_by_another_process(self):
+        """Only one of the records checked at the same time by different
+        processes reacts after the cooldown.
+        """
+
+        cond = self.condition(cooldown=60)
+        self.assertEqual(self.check([31]), 1)
+
+        # Another process, whose cache had the same state, reacts first.
+        fired = self.start + timedelta(seconds=120)
+        ConditionState.objects.filter(condition=cond).update(
+            last_fired=fired)
+        self.start = fired + timedelta(seconds=1)
+        self.assertEqual(self.check([31]), 0)
+        self.assertEqual(ConditionState.objects.get().last_fired, fired)
+
+        # The state is then read again from the DB.
+        self.assertEqual(self.check([31]), 0)
+        self.start = fired + timedelta(seconds=60)
+        self.assertEqual(self.check([31]), 1)
+
+    def test_state_created_by_another_process(self):
+        cond = self.condition(on_transition=True)
+        self.assertEqual(self.check([20]), 0)
+
+        ConditionState.objects.create(condition=cond, active=True,
+                                      last_fired=self.start)
+        self.assertEqual(self.check([31]), 0)
+        self.assertEqual(self.check([32]), 0)
+
+    def test_state_checked_without_queries(self):
+        self.condition(on_transition=True)
+        self.check([31])
+
+        r = Record.objects.create(channel=self.ch)
+        fields = [Field(record=r, field_no=1, val="32")]
+        with self.assertNumQueries(0):
+            self.ch.check_and_react(r, fields=fields)
+
+    def test_first_match(self):
+        """A stateful condition that doesn't react leaves the choice to the
+        ones after it.
+        """
+
+        self.condition(on_transition=True)
+        self.condition(val=20)
+        self.check([31])
+
+        self.assertEqual(self.check([32, 33]), 2)
+        self.assertEqual(len(mail.outbox), 3)
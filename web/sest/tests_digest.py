@@ -0,0 +1,116 @@
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core import mail
+
+from .models import *
+from .digest import DigestCollector, get_digests
+
+import time
+
+
+class Digests(TestCase):
+
+    def setUp(self):
+        self.u = User.objects.create(username="test")
+        self.ne = NotificationEmail.objects.create(user=self.u,
+                                                   address="whatever@test.it")
+        self.channels = [Channel.objects.create(user=self.u,
+                                                number_fields=1,
+                                                notification_email=self.ne)
+                         for _ in range(3)]
+        for ch in self.channels:
+            ch.fieldmetadata_set.create(field_no=1, encoding="float")
+            ch.conditionandreaction_set.create(condition_op="gt", field_no=1,
+                                               val=10, action="email")
+
+    def react(self, ch, value):
+        r = Record.objects.create(channel=ch)
+        ch.check_and_react(r, fields=[Field(record=r, field_no=1,
+                                            val=str(value))])
+
+    @override_settings(REACTIONS_MODE="digest")
+    def test_one_email_per_recipient(self):
+        for ch in self.channels:
+            for v in (11, 12):
+                self.react(ch, v)
+
+        other = NotificationEmail.objects.create(user=self.u,
+                                                 address="other@test.it")
+        ch = self.channels[0]
+        ch.notification_email = other
+        ch.save()
+        self.react(ch, 13)
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(get_digests().flush(everything=True), 2)
+
+        self.assertEqual(len(mail.outbox), 2)
+        by_address = {m.to[0]: m for m in mail.outbox}
+        digest = by_address["whatever@test.it"]
+        self.assertIn("6 conditions", digest.subject)
+        self.assertIn(str(self.channels[2]), digest.body)
+        self.assertIn("1 conditions", by_address["other@test.it"].subject)
+
+    def test_records_listed(self):
+        collector = DigestCollector(window=600, max_records=2)
+        cond = self.channels[0].conditionandreaction_set.get()
+        for _ in range(5):
+            collector.add(cond, Record.objects.create(
+                channel=self.channels[0]))
+
+        self.assertEqual(collector.stats()["waiting"], 5)
+        # The window isn't over yet.
+        self.assertEqual(collector.flush(), 0)
+        self.assertEqual(collector.flush(everything=True), 1)
+
+        body = mail.outbox[0].body
+        self.assertEqual(body.count(str(self.channels[0])), 2)
+        self.assertIn("and 3 more", body)
+        self.assertEqual(collector.stats()["recipients"], 0)
+
+    def test_failing_digest(self):
+        """A digest that can't be built doesn't prevent sending the
+        others.
+        """
+
+        class BrokenRecord:
+            def __str__(self):
+                raise ValueError("Broken record")
+
+        ch = self.channels[1]
+        ch.notification_email = NotificationEmail.objects.create(
+            user=self.u, address="other@test.it")
+        ch.save()
+
+        collector = DigestCollector(window=600, max_records=10)
+        collector.add(ch.conditionandreaction_set.get(), BrokenRecord())
+        cond = self.channels[0].conditionandreaction_set.get()
+        collector.add(cond, Record.objects.create(channel=self.channels[0]))
+
+        with self.assertLogs("sest.digest", "ERROR"):
+            self.assertEqual(collector.flush(everything=True), 1)
+        self.assertEqual([m.to for m in mail.outbox], [["whatever@test.it"]])
+        self.assertEqual(collector.stats()["recipients"], 0)
+
+
+class DigestWindow(TransactionTestCase):
+
+    def test_sent_after_window(self):
+        u = User.objects.create(username="test")
+        ne = NotificationEmail.objects.create(user=u,
+                                              address="whatever@test.it")
+        ch = Channel.objects.create(user=u, number_fields=1,
+                                    notification_email=ne)
+        cond = ch.conditionandreaction_set.create(condition_op="gt",
+                                                  field_no=1, val=10,
+                                                  action="email")
+
+        collector = DigestCollector(window=0.2, max_records=10)
+        collector.add(cond, Record.objects.create(channel=ch))
+        collector.add(cond, Record.objects.create(channel=ch))
+
+        deadline = time.monotonic() + 5
+        while not mail.outbox and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("2 conditions", mail.outbox[0].subject)
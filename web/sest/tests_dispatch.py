@@ -0,0 +1,104 @@
+from django.test import TestCase, TransactionTestCase, Client
+from django.core import mail
+
+from .models import *
+from .dispatch import ReactionDispatcher, get_dispatcher
+
+import threading
+
+
+class Dispatcher(TestCase):
+
+    def test_depth_and_lag(self):
+        dispatcher = ReactionDispatcher(workers=1, max_size=10)
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        dispatcher.submit(block)
+        started.wait(5)
+        dispatcher.submit(lambda: None)
+        dispatcher.submit(lambda: None)
+
+        stats = dispatcher.stats()
+        self.assertEqual((stats["depth"], stats["in_flight"]), (2, 1))
+
+        release.set()
+        dispatcher.join()
+
+        stats = dispatcher.stats()
+        self.assertEqual((stats["depth"], stats["in_flight"]), (0, 0))
+        self.assertEqual((stats["submitted"], stats["completed"]), (3, 3))
+        self.assertGreater(stats["max_lag"], 0)
+
+    def test_full_queue_runs_inline(self):
+        dispatcher = ReactionDispatcher(workers=1, max_size=1)
+        started, release = threading.Event(), threading.Event()
+        ran = []
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        dispatcher.submit(block)
+        started.wait(5)
+        dispatcher.submit(ran.append, "queued")
+        dispatcher.submit(ran.append, "inline")
+
+        self.assertEqual(ran, ["inline"])
+        release.set()
+        dispatcher.join()
+        self.assertEqual(ran, ["inline", "queued"])
+        self.assertEqual(dispatcher.stats()["run_inline"], 1)
+
+    def test_failures_counted(self):
+        dispatcher = ReactionDispatcher(workers=1, max_size=10)
+        with self.assertLogs("sest.dispatch", "ERROR"):
+            dispatcher.submit(lambda: 1 / 0)
+            dispatcher.submit(lambda: None)
+            dispatcher.join()
+
+        stats = dispatcher.stats()
+        self.assertEqual((stats["completed"], stats["failed"]), (1, 1))
+
+    def test_status_view(self):
+        client = Client()
+        client.force_login(User.objects.create(username="admin",
+                                               is_staff=True))
+
+        response = client.get("/status/reactions/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["mode"], "sync")
+        self.assertIn("depth", response.json())
+
+
+class PooledReactions(TransactionTestCase):
+    """The reactions run in the threads of the dispatcher, which read the DB
+    with their own connections, hence the TransactionTestCase.
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.u = User.objects.create(username="test")
+        ne = NotificationEmail.objects.create(user=self.u,
+                                              address="whatever@test.it")
+        self.ch = Channel.objects.create(user=self.u,
+                                         number_fields=1,
+                                         notification_email=ne
+                                         )
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float")
+        self.ch.conditionandreaction_set.create(condition_op="gt", field_no=1,
+                                                val=10, action="email")
+
+    def test_email_sent_by_the_pool(self):
+        with self.settings(REACTIONS_MODE="pool"):
+            response = self.client.post(
+                "/{}/".format(self.ch.id), {"field1": 42},
+                HTTP_X_SEST_WRITE_KEY=str(self.ch.write_key))
+            get_dispatcher().join()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 1)
@@ -0,0 +1,191 @@
+from django.test import TestCase
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+
+from .email_collection import (EmailTransport, Provider, NoProviderAvailable,
+                               build_email, send_emails)
+
+import smtplib
+import socketserver
+import threading
+
+
+class RecordingBackend(EmailBackend):
+    """locmem backend that logs the connections opened and the emails sent,
+    by provider, failing after sending `fail_after' emails (if not None).
+    """
+
+    log = []
+
+    def __init__(self, name="", down=False, fail_after=None, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.down = down
+        self.fail_after = fail_after
+
+    def open(self):
+        self.log.append((self.name, "open"))
+
+    def send_messages(self, messages):
+        if self.down or self.fail_after == 0:
+            raise smtplib.SMTPServerDisconnected("Provider down")
+        if self.fail_after is not None:
+            self.fail_after -= len(messages)
+        self.log.append((self.name, len(messages)))
+        return super().send_messages(messages)
+
+
+BACKEND = "sest.tests_email.RecordingBackend"
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough of SMTP for smtplib, counting the connections and the
+    messages received by the server.
+    """
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 localhost")
+        for line in self.rfile:
+            command = line[:4].upper()
+            if command == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                for line in self.rfile:
+                    if line == b".\r\n":
+                        break
+                self.server.messages += 1
+                self.reply("250 OK")
+            elif command == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+    def reply(self, text):
+        self.wfile.write(text.encode() + b"\r\n")
+
+
+def provider(name, **kwargs):
+    options = {"name": name, "down": kwargs.pop("down", False),
+               "fail_after": kwargs.pop("fail_after", None)}
+    return Provider(name, BACKEND, options, **kwargs)
+
+
+class Transport(TestCase):
+
+    def setUp(self):
+        RecordingBackend.log = []
+
+    def emails(self, n):
+        return [build_email(["a{}@test.it".format(i)], "Alert", text_body="!")
+                for i in range(n)]
+
+    def test_batches_over_one_connection(self):
+        transport = EmailTransport([provider("a")], batch_size=50,
+                                   cooldown=60)
+
+        self.assertEqual(transport.send(self.emails(120)), [None] * 120)
+        transport.send(self.emails(1))
+
+        self.assertEqual(RecordingBackend.log,
+                         [("a", "open")] + [("a", 1)] * 121)
+        self.assertEqual(len(mail.outbox), 121)
+
+    def test_rotation_by_quota(self):
+        transport = EmailTransport([provider("a", quota=2),
+                                    provider("b", quota=2)],
+                                   batch_size=50, cooldown=60)
+
+        for _ in range(4):
+            transport.send(self.emails(1))
+        errors = transport.send(self.emails(1))
+
+        self.assertEqual([name for name, n in RecordingBackend.log
+                          if n != "open"], ["a", "b", "a", "b"])
+        self.assertIsInstance(errors[0], NoProviderAvailable)
+
+    def test_failed_provider_skipped(self):
+        transport = EmailTransport([provider("a", down=True), provider("b")],
+                                   batch_size=50, cooldown=60)
+
+        with self.assertLogs("sest.email_collection", "WARNING"):
+            self.assertEqual(transport.send(self.emails(3)), [None] * 3)
+        transport.send(self.emails(1))
+
+        self.assertEqual([entry for entry in RecordingBackend.log
+                          if entry[1] != "open"], [("b", 1)] * 4)
+
+    def test_partial_batch(self):
+        """The emails sent before a provider fails aren't sent again."""
+
+        transport = EmailTransport([provider("a", fail_after=2),
+                                    provider("b")],
+                                   batch_size=50, cooldown=60)
+
+        with self.assertLogs("sest.email_collection", "WARNING"):
+            self.assertEqual(transport.send(self.emails(5)), [None] * 5)
+
+        self.assertEqual([entry for entry in RecordingBackend.log
+                          if entry[1] != "open"],
+                         [("a", 1)] * 2 + [("b", 1)] * 3)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox),
+                         ["a{}@test.it".format(i) for i in range(5)])
+
+    def test_closed_connection_reopened(self):
+        transport = EmailTransport([provider("a")], batch_size=50,
+                                   cooldown=60)
+        transport.send(self.emails(1))
+        # The server closed the connection kept open.
+        transport.providers[0]._connection.fail_after = 0
+
+        self.assertEqual(transport.send(self.emails(2)), [None] * 2)
+        self.assertEqual(RecordingBackend.log,
+                         [("a", "open"), ("a", 1), ("a", "open"), ("a", 1),
+                          ("a", 1)])
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_errors_raised_unless_silent(self):
+        with self.settings(EMAIL_PROVIDERS=[{"name": "a", "backend": BACKEND,
+                                             "options": {"down": True}}]), \
+                self.assertLogs("sest.email_collection", "WARNING"):
+            errors = send_emails(self.emails(1))
+            self.assertIsInstance(errors[0], smtplib.SMTPException)
+
+            # The provider is skipped until the cooldown is over.
+            with self.assertRaises(NoProviderAvailable):
+                send_emails(self.emails(1), fail_silently=False)
+
+    def test_failing_without_cooldown(self):
+        """Without a cooldown, the providers that fail are given up for the
+        emails being sent, instead of being tried forever.
+        """
+
+        transport = EmailTransport([provider("a", down=True),
+                                    provider("b", down=True)],
+                                   batch_size=50, cooldown=0)
+
+        with self.assertLogs("sest.email_collection", "WARNING") as logs:
+            errors = transport.send(self.emails(2))
+        self.assertEqual(len(logs.records), 2)
+        self.assertTrue(all(isinstance(e, smtplib.SMTPException)
+                            for e in errors))
+
+    def test_smtp_server(self):
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", 0),
+                                                 SMTPHandler)
+        server.daemon_threads = True
+        server.connections = server.messages = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        transport = EmailTransport([Provider(
+            "smtp", "django.core.mail.backends.smtp.EmailBackend",
+            {"host": "127.0.0.1", "port": server.server_address[1]})],
+            batch_size=2, cooldown=60)
+        self.addCleanup(transport.close)
+
+        self.assertEqual(transport.send(self.emails(5)), [None] * 5)
+        self.assertEqual(transport.send(self.emails(1)), [None])
+        # All the batches over the connection kept open.
+        self.assertEqual((server.connections, server.messages), (1, 6))
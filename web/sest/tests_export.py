@@ -0,0 +1,99 @@
+from django.test import TestCase, Client, override_settings
+from django.core.management import call_command
+from django.utils import timezone
+
+from .models import *
+from .views import messages
+from .ingest import ingest_batch
+from .export import LINES_PER_CHUNK
+
+import io
+import json
+from datetime import datetime, timedelta
+
+
+class Export(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.u = User.objects.create(username="test")
+        self.ch = Channel.objects.create(user=self.u, number_fields=3)
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float")
+        self.ch.fieldmetadata_set.create(field_no=2, encoding="int")
+        self.ch.fieldmetadata_set.create(field_no=3, encoding="string")
+        self.start = datetime(2016, 12, 20, 10, 34, 43,
+                              tzinfo=timezone.utc)
+
+        for first in (0, 600):
+            ingest_batch(self.ch, [
+                {"field1": i / 2, "field2": i, "field3": "s{}".format(i),
+                 "timestamp": (self.start + timedelta(seconds=i)).timestamp()}
+                for i in range(first, first + 600)])
+        # A record lacking some fields.
+        ingest_batch(self.ch, [
+            {"field2": -1,
+             "timestamp": (self.start - timedelta(days=1)).timestamp()}])
+        self.records = list(Record.objects.filter(channel=self.ch)
+                            .order_by("insertion_time")
+                            .values_list("pk", flat=True))
+
+    def export(self, **params):
+        response = self.client.get("/{}/export/".format(self.ch.id), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv(self):
+        lines = self.export().splitlines()
+        self.assertEqual(len(lines), 1201)
+        self.assertEqual(lines[0], "2016-12-19 10:34:43 UTC,{},,-1,".format(
+            self.records[0]))
+        self.assertEqual(lines[2], "2016-12-20 10:34:44 UTC,{},0.5,1,s1"
+                         .format(self.records[2]))
+
+        lines = self.export(header="1").splitlines()
+        self.assertEqual(lines[0], "time,id,field1,field2,field3")
+
+    def test_ndjson(self):
+        lines = self.export(format="ndjson").splitlines()
+        self.assertEqual(json.loads(lines[0]), {
+            "id": self.records[0], "field2": -1,
+            "timestamp": (self.start - timedelta(days=1)).timestamp()})
+        self.assertEqual(json.loads(lines[-1])["field3"], "s1199")
+
+    def test_range(self):
+        lines = self.export(
+            start=self.start.isoformat(),
+            end=(self.start + timedelta(seconds=10)).timestamp()
+        ).splitlines()
+        self.assertEqual(len(lines), 10)
+        self.assertTrue(lines[-1].endswith(",s9"))
+
+    @override_settings(EXPORT_CHUNK_SIZE=7)
+    def test_chunks(self):
+        """The rows fetched a chunk at a time make the same records, and the
+        response is written a few lines at a time.
+        """
+
+        response = self.client.get("/{}/export/".format(self.ch.id))
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(len(chunks[0].decode().splitlines()),
+                         LINES_PER_CHUNK)
+        self.assertEqual(b"".join(chunks).decode(), self.export())
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command("export_channel", str(self.ch.id), "--format=ndjson",
+                     stdout=out)
+        self.assertEqual(out.getvalue(), self.export(format="ndjson"))
+
+    def test_wrong_parameters(self):
+        for params, message in (
+                ({"start": "yesterday"}, "WRONG_RANGE"),
+                ({"start": 2, "end": 1}, "WRONG_RANGE"),
+                ({"format": "json"}, "WRONG_EXPORT_FORMAT")):
+            response = self.client.get("/{}/export/".format(self.ch.id),
+                                       params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.content.decode(), messages[message])
@@ -33,6 +33,60 @@ class UploadView(TestCase):
                          len(self.d))
         self.assertEqual(response.status_code, 200)
 
+    def test_upload_query_count(self):
+        """The number of queries needed to save a record doesn't depend on
+        the number of its fields: once the channel and its conditions are
+        cached, insert the record, its fields and their rollups.
+        Inside a TestCase the transaction adds a SAVEPOINT and a RELEASE.
+        """
+
+        # Load the channel and its FieldMetadata in the caches.
+        self.client.post("/{}/".format(self.ch.id), self.d,
+                         HTTP_X_SEST_WRITE_KEY=self.channel_uuid)
+
+        for d in ({"field1": 1}, {"field1": 1, "field2": 2}):
+            with self.assertNumQueries(5):
+                response = self.client.post(
+                    "/{}/".format(self.ch.id), d,
+                    HTTP_X_SEST_WRITE_KEY=self.channel_uuid)
+            self.assertEqual(response.status_code, 200)
+
+    def test_upload_wrong_write_API_no_queries(self):
+        """Once the channel is cached, uploads with a wrong write key are
+        refused without querying the DB.
+        """
+
+        self.client.post("/{}/".format(self.ch.id), self.d,
+                         HTTP_X_SEST_WRITE_KEY=self.channel_uuid)
+
+        with self.assertNumQueries(0):
+            response = self.client.post("/{}/".format(self.ch.id), self.d,
+                                        HTTP_X_SEST_WRITE_KEY=uuid.uuid4())
+        self.assertEqual(response.status_code, 400)
+
+    def test_upload_regenerated_write_API(self):
+        """Refuse the old write key as soon as a new one is generated."""
+
+        self.client.post("/{}/".format(self.ch.id), self.d,
+                         HTTP_X_SEST_WRITE_KEY=self.channel_uuid)
+        self.ch.regenerate_write_key()
+
+        response = self.client.post("/{}/".format(self.ch.id), self.d,
+                                    HTTP_X_SEST_WRITE_KEY=self.channel_uuid)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.content.decode("utf-8"),
+                         messages["WRONG_WRITE_KEY"])
+
+        new_key = str(self.ch.write_key)
+        response = self.client.post("/{}/".format(self.ch.id), self.d,
+                                    HTTP_X_SEST_WRITE_KEY=new_key)
+        self.assertEqual(response.status_code, 200)
+
+    def test_upload_missing_channel(self):
+        response = self.client.post("/{}/".format(self.ch.id + 1), self.d,
+                                    HTTP_X_SEST_WRITE_KEY=self.channel_uuid)
+        self.assertEqual(response.status_code, 404)
+
     def test_upload_exceeding_no_fields(self):
         """Use a POST http (made with the Client class from the test module) to
         check that we are not allowed to post more fields than the max number
@@ -216,3 +270,53 @@ class EmailSendingGeneral(TestCase):
         self.ch.send_email("test message")
 
         self.assertEqual(len(mail.outbox), 0)
+
+
+class ChannelPage(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.u = User.objects.create(username="test")
+        self.ch = Channel.objects.create(user=self.u, number_fields=3)
+        # Created out of order: the columns follow the field numbers.
+        self.ch.fieldmetadata_set.create(field_no=3, encoding="string",
+                                         name="f3")
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float",
+                                         name="f1")
+        self.ch.fieldmetadata_set.create(field_no=2, encoding="int",
+                                         name="f2")
+
+    def add_records(self, n):
+        for i in range(n):
+            r = Record.objects.create(channel=self.ch)
+            r.field_set.create(field_no=3, val="s{}".format(i))
+            r.field_set.create(field_no=1, val=str(i / 2))
+            if i % 2:
+                r.field_set.create(field_no=2, val=str(i))
+
+    def test_rows(self):
+        self.add_records(3)
+        rows = self.ch.last_rows(20)
+
+        self.assertEqual(self.ch.get_field_names(), ("f1", "f2", "f3"))
+        self.assertEqual([row.values for row in rows],
+                         [[1.0, None, "s2"], [0.5, 1, "s1"],
+                          [0.0, None, "s0"]])
+
+    def test_query_count(self):
+        """The page is rendered with the same number of queries, whatever
+        the number of the records and of their fields: the channel, the
+        records and their fields.
+        """
+
+        self.add_records(1)
+        self.client.get("/{}/".format(self.ch.id))
+        with self.assertNumQueries(3):
+            response = self.client.get("/{}/".format(self.ch.id))
+        self.assertContains(response, "<td>s0</td>")
+
+        self.add_records(30)
+        with self.assertNumQueries(3):
+            response = self.client.get("/{}/".format(self.ch.id))
+        self.assertContains(response, "<th>f2</th>")
+        self.assertContains(response, "last 20 records")
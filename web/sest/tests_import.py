@@ -0,0 +1,84 @@
+from django.test import TestCase
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from .models import *
+
+import io
+import os
+import tempfile
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                      "sample_without_header.csv")
+
+
+class ImportCSV(TestCase):
+
+    def setUp(self):
+        self.u = User.objects.create(username="test")
+        ne = NotificationEmail.objects.create(user=self.u,
+                                              address="whatever@test.it")
+        self.ch = Channel.objects.create(user=self.u, number_fields=2,
+                                         notification_email=ne)
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float")
+        self.ch.fieldmetadata_set.create(field_no=2, encoding="float")
+        with open(SAMPLE) as f:
+            self.lines = f.read().splitlines()
+
+    def run_import(self, path, *args):
+        out = io.StringIO()
+        call_command("import_channel_csv", str(self.ch.id), path, *args,
+                     stdout=out)
+        return out.getvalue()
+
+    def write(self, lines):
+        f = tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False)
+        self.addCleanup(os.remove, f.name)
+        with f:
+            f.write("\n".join(lines) + "\n")
+        return f.name
+
+    def test_sample(self):
+        out = self.run_import(SAMPLE, "--batch-size=100")
+        self.assertIn("Imported {} records".format(len(self.lines)), out)
+
+        records = Record.objects.filter(channel=self.ch)
+        self.assertEqual(records.count(), len(self.lines))
+        first = records.order_by("insertion_time").first()
+        self.assertEqual(first.insertion_time.strftime("%Y-%m-%d %H:%M:%S"),
+                         "2016-12-20 10:34:43")
+        self.assertEqual([f.val for f in first.field_set.order_by("field_no")],
+                         [22.0, 43.0])
+
+    def test_reactions(self):
+        self.ch.conditionandreaction_set.create(field_no=1, condition_op="gt",
+                                                val=0, action="email")
+        path = self.write(self.lines[:3])
+
+        self.run_import(path, "--no-reactions")
+        self.assertEqual(len(mail.outbox), 0)
+        self.run_import(path)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_resume(self):
+        # Two records with the same time, split by the interruption.
+        lines = self.lines[:10] + [self.lines[9]] + self.lines[10:20]
+        self.run_import(self.write(lines[:10]))
+
+        out = self.run_import(self.write(lines), "--resume")
+        self.assertIn("Resuming after", out)
+        self.assertIn("Imported 11 records", out)
+        self.assertEqual(Record.objects.filter(channel=self.ch).count(), 21)
+
+    def test_wrong_line(self):
+        path = self.write(self.lines[:3] + ["2016-12-20 10:40:00 UTC,1,x,1"] +
+                          self.lines[3:6])
+        with self.assertRaisesRegex(CommandError, r"Line 4: .*\(0 records"):
+            self.run_import(path)
+        # Nothing of the batch with the wrong line is saved.
+        self.assertFalse(Record.objects.filter(channel=self.ch).exists())
+
+        with self.assertRaisesRegex(CommandError, "Line 2"):
+            self.run_import(self.write(["time,id,field1,field2",
+                                        "2016-12-20,1,1,2,3"]))
@@ -0,0 +1,127 @@
+from django.test import TestCase
+from django.core import mail
+from django.core.management import call_command
+
+from .models import *
+from .inactivity import DeadlineHeap, InactivityMonitor
+
+import io
+import random
+import time
+from datetime import timedelta
+
+
+class Deadlines(TestCase):
+
+    def test_heap_order(self):
+        heap = DeadlineHeap()
+        deadlines = {}
+        for _ in range(2000):
+            key, deadline = random.randrange(100), random.random()
+            if random.random() < 0.1:
+                heap.discard(key)
+                deadlines.pop(key, None)
+            else:
+                heap.set(key, deadline)
+                deadlines[key] = deadline
+
+        self.assertEqual(len(heap), len(deadlines))
+        self.assertEqual(heap.next_deadline(), min(deadlines.values()))
+        # Moved deadlines don't pile up in the heap.
+        self.assertLessEqual(len(heap._heap), 2 * len(deadlines) + 64)
+
+        expired = heap.pop_expired(0.5)
+        self.assertEqual(sorted(expired),
+                         sorted(k for k, d in deadlines.items() if d <= 0.5))
+        self.assertTrue(all(d > 0.5 for d, _ in heap._heap))
+
+
+class Monitor(TestCase):
+
+    def setUp(self):
+        self.u = User.objects.create(username="test")
+        ne = NotificationEmail.objects.create(user=self.u,
+                                              address="whatever@test.it")
+        self.ch = Channel.objects.create(user=self.u,
+                                         number_fields=1,
+                                         notification_email=ne,
+                                         update_interval=60)
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float")
+        self.quiet = Channel.objects.create(user=self.u, number_fields=1)
+        self.now = time.time()
+
+    def upload(self):
+        r = Record.objects.create(channel=self.ch)
+        r.field_set.create(field_no=1, val="1")
+
+    def test_alert_once(self):
+        monitor = InactivityMonitor()
+        monitor.load(self.now)
+        self.assertEqual(set(monitor.intervals), {self.ch.pk})
+
+        self.assertEqual(monitor.expire(self.now + 30), 0)
+        self.assertEqual(monitor.expire(self.now + 61), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("No updates", mail.outbox[0].subject)
+
+        self.ch.refresh_from_db()
+        self.assertIsNotNone(self.ch.inactive_since)
+        # No more alerts until a record arrives.
+        self.assertEqual(monitor.expire(self.now + 1000), 0)
+
+        self.upload()
+        monitor.poll(self.now + 1000)
+        self.ch.refresh_from_db()
+        self.assertIsNone(self.ch.inactive_since)
+
+        self.assertEqual(monitor.expire(self.now + 1059), 0)
+        self.assertEqual(monitor.expire(self.now + 1061), 1)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_records_postpone(self):
+        monitor = InactivityMonitor()
+        monitor.load(self.now)
+
+        self.upload()
+        monitor.poll(self.now + 50)
+        self.assertEqual(monitor.expire(self.now + 100), 0)
+        self.assertEqual(monitor.expire(self.now + 111), 1)
+
+    def test_poll_reads_only_news(self):
+        monitor = InactivityMonitor()
+        monitor.load(self.now)
+        self.upload()
+        monitor.poll(self.now + 1)
+
+        # Just the changed channels and the new records.
+        with self.assertNumQueries(2):
+            monitor.poll(self.now + 2)
+        self.assertEqual(monitor.next_wakeup(10, self.now + 2), 10)
+        self.assertAlmostEqual(monitor.next_wakeup(100, self.now + 2), 59)
+
+    def test_interval_changes(self):
+        monitor = InactivityMonitor()
+        monitor.load(self.now)
+
+        self.quiet.update_interval = 10
+        self.quiet.save()
+        self.ch.update_interval = None
+        self.ch.save()
+        monitor.poll(self.now + 1)
+
+        self.assertEqual(set(monitor.intervals), {self.quiet.pk})
+        # Without an email there's nowhere to send the alert.
+        with self.assertLogs("sest.inactivity", "WARNING"):
+            self.assertEqual(monitor.expire(self.now + 100), 1)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_command(self):
+        Channel.objects.filter(pk=self.ch.pk).update(update_interval=1)
+        Record.objects.create(channel=self.ch,
+                              insertion_time=timezone.now() -
+                              timedelta(seconds=10))
+        out = io.StringIO()
+        call_command("watch_inactivity", once=True, stdout=out)
+
+        self.assertIn("1 channels inactive", out.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
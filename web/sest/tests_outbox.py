@@ -0,0 +1,135 @@
+from django.test import TestCase, Client
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.db import transaction
+
+from .models import *
+from .ingest import ingest_record
+from .outbox import deliver
+
+import io
+import smtplib
+
+
+class FailingBackend(BaseEmailBackend):
+    """Email backend of a provider that is down."""
+
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+
+
+class ClaimCheckingBackend(BaseEmailBackend):
+    """Email backend that counts the reactions due while it sends, which
+    the other instances of `deliver_outbox' would send too.
+    """
+
+    due = None
+
+    def send_messages(self, email_messages):
+        ClaimCheckingBackend.due = OutboxMessage.objects.filter(
+            status=OutboxMessage.PENDING,
+            next_attempt__lte=timezone.now()).count()
+        return len(email_messages)
+
+
+class Outbox(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.u = User.objects.create(username="test")
+        ne = NotificationEmail.objects.create(user=self.u,
+                                              address="whatever@test.it")
+        self.ch = Channel.objects.create(user=self.u,
+                                         number_fields=1,
+                                         notification_email=ne
+                                         )
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float")
+        self.ch.conditionandreaction_set.create(condition_op="gt", field_no=1,
+                                                val=10, action="email")
+
+    def post(self, d):
+        with self.settings(REACTIONS_MODE="outbox"):
+            return self.client.post(
+                "/{}/".format(self.ch.id), d,
+                HTTP_X_SEST_WRITE_KEY=str(self.ch.write_key))
+
+    def test_reaction_delivered_later(self):
+        self.post({"field1": 42})
+        self.post({"field1": 1})
+
+        msg = OutboxMessage.objects.get()
+        self.assertEqual(msg.status, OutboxMessage.PENDING)
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(deliver(), (1, 0))
+
+        msg.refresh_from_db()
+        self.assertEqual(msg.status, OutboxMessage.DELIVERED)
+        self.assertEqual(msg.attempts, 1)
+        self.assertGreaterEqual(msg.latency.total_seconds(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(deliver(), (0, 0))
+
+    def test_written_with_the_record(self):
+        """The reaction isn't written if the record is rolled back."""
+
+        with self.settings(REACTIONS_MODE="outbox"):
+            try:
+                with transaction.atomic():
+                    ingest_record(self.ch, {"field1": "42"})
+                    self.assertEqual(OutboxMessage.objects.count(), 1)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+
+        self.assertEqual(Record.objects.count(), 0)
+        self.assertEqual(OutboxMessage.objects.count(), 0)
+
+    def test_retried_with_backoff(self):
+        self.post({"field1": 42})
+
+        with self.settings(EMAIL_BACKEND="sest.tests_outbox.FailingBackend",
+                           OUTBOX_BACKOFF=10, OUTBOX_MAX_ATTEMPTS=3), \
+                self.assertLogs("sest", "WARNING"):
+            now = timezone.now()
+            self.assertEqual(deliver(now=now), (0, 1))
+
+            msg = OutboxMessage.objects.get()
+            self.assertEqual(msg.status, OutboxMessage.RETRYING)
+            self.assertEqual((msg.next_attempt - now).total_seconds(), 10)
+            self.assertIn("SMTPServerDisconnected", msg.last_error)
+
+            # Not due yet.
+            self.assertEqual(deliver(now=now), (0, 0))
+
+            deliver(now=msg.next_attempt)
+            msg.refresh_from_db()
+            self.assertEqual((msg.next_attempt - now).total_seconds(), 30)
+
+            deliver(now=msg.next_attempt)
+            msg.refresh_from_db()
+            self.assertEqual(msg.status, OutboxMessage.FAILED)
+            self.assertEqual(msg.attempts, 3)
+
+        self.assertEqual(deliver(now=msg.next_attempt), (0, 0))
+
+    def test_claimed_while_sent(self):
+        self.post({"field1": 42})
+
+        with self.settings(
+                EMAIL_BACKEND="sest.tests_outbox.ClaimCheckingBackend"):
+            self.assertEqual(deliver(), (1, 0))
+        self.assertEqual(ClaimCheckingBackend.due, 0)
+
+        msg = OutboxMessage.objects.get()
+        self.assertEqual(msg.status, OutboxMessage.DELIVERED)
+
+    def test_command(self):
+        self.post({"field1": 42})
+
+        out = io.StringIO()
+        call_command("deliver_outbox", once=True, stdout=out)
+
+        self.assertEqual(out.getvalue(), "1 reactions delivered, 0 failed.\n")
+        self.assertEqual(len(mail.outbox), 1)
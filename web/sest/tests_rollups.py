@@ -0,0 +1,156 @@
+from django.test import TestCase, Client
+from django.core.management import call_command
+from django.utils import timezone
+
+from .models import *
+from .ingest import ingest_batch
+from .rollups import aggregate, summary, bucket_start
+
+import io
+import random
+import statistics
+from datetime import timedelta
+
+
+class Aggregation(TestCase):
+
+    def test_aggregate(self):
+        samples = [(random.uniform(0, 7200), 1, random.uniform(-5, 5))
+                   for _ in range(1000)]
+
+        found = aggregate(samples, ("minute", "hour"))
+        for (field_no, resolution, bucket), a in found.items():
+            size = 60 if resolution == "minute" else 3600
+            values = [v for t, _, v in samples
+                      if bucket_start(t, resolution) == bucket]
+            self.assertEqual(bucket.timestamp() % size, 0)
+            self.assertEqual(a[:3], [len(values), min(values), max(values)])
+            self.assertAlmostEqual(a[3], sum(values))
+            self.assertAlmostEqual(a[4], sum(v * v for v in values))
+        self.assertEqual(sum(a[0] for (_, r, _), a in found.items()
+                             if r == "hour"), 1000)
+
+
+class Rollups(TestCase):
+
+    def setUp(self):
+        self.u = User.objects.create(username="test")
+        self.ch = Channel.objects.create(user=self.u, number_fields=3)
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float")
+        self.ch.fieldmetadata_set.create(field_no=2, encoding="int")
+        self.ch.fieldmetadata_set.create(field_no=3, encoding="string")
+        self.start = (timezone.now() - timedelta(days=3)).replace(
+            minute=0, second=0, microsecond=0)
+
+    def upload(self, values, start):
+        """Upload a record for each (float, int) couple, 20 seconds apart."""
+
+        ingest_batch(self.ch, [
+            {"field1": real, "field2": integer, "field3": "s",
+             "timestamp": (start + timedelta(seconds=20 * i)).timestamp()}
+            for i, (real, integer) in enumerate(values)])
+
+    def rollups(self, **kwargs):
+        return {(r.field_no, r.resolution, r.bucket):
+                (r.count, r.min, r.max, r.sum, r.sum_sq)
+                for r in Rollup.objects.filter(channel=self.ch, **kwargs)}
+
+    def test_incremental(self):
+        values = [(random.uniform(-5, 5), random.randrange(100))
+                  for _ in range(500)]
+        # The batches overlap some buckets, which add up.
+        self.upload(values[:250], self.start)
+        self.upload(values[250:], self.start + timedelta(seconds=20 * 250))
+
+        minute = self.rollups(field_no=2, resolution="minute")
+        self.assertEqual(len(minute), 167)
+        self.assertEqual(minute[(2, "minute", self.start)][:3], (3, *sorted(
+            v for _, v in values[:3])[::2]))
+
+        hour = self.rollups(field_no=1, resolution="hour")
+        self.assertEqual(sum(a[0] for a in hour.values()), 500)
+        self.assertAlmostEqual(sum(a[3] for a in hour.values()),
+                               sum(v for v, _ in values))
+        # Only the numeric fields have rollups.
+        self.assertFalse(self.rollups(field_no=3))
+
+    def test_backfill(self):
+        self.upload([(1.5, 1), (2.5, 2)], self.start)
+        uploaded = self.rollups()
+
+        # Records saved without the rollups.
+        r = Record.objects.create(channel=self.ch,
+                                  insertion_time=self.start)
+        r.field_set.create(field_no=1, val="3.5")
+        Rollup.objects.filter(resolution="day").delete()
+
+        out = io.StringIO()
+        call_command("backfill_rollups", str(self.ch.id), stdout=out)
+        self.assertEqual(out.getvalue(),
+                         "Channel {}: 6 rollups.\n".format(self.ch.id))
+
+        backfilled = self.rollups()
+        self.assertEqual(backfilled.keys(), uploaded.keys())
+        self.assertEqual(backfilled[(1, "day", bucket_start(
+            self.start.timestamp(), "day"))][:4], (3, 1.5, 3.5, 7.5))
+        self.assertEqual(backfilled[(2, "hour", self.start)],
+                         uploaded[(2, "hour", self.start)])
+
+    def test_large_integers(self):
+        # Their squares overflow the 64-bit integers.
+        self.upload([(0.0, 2 ** 62), (0.0, -2 ** 62)], self.start)
+
+        found = self.rollups(field_no=2, resolution="minute")
+        self.assertEqual(found[(2, "minute", self.start)],
+                         (2, -2.0 ** 62, 2.0 ** 62, 0.0, 2.0 ** 125))
+
+        call_command("backfill_rollups", str(self.ch.id), stdout=io.StringIO())
+        self.assertEqual(self.rollups(field_no=2, resolution="minute"), found)
+
+    def test_summary(self):
+        values = [(random.gauss(10, 2), 0) for _ in range(600)]
+        self.upload(values, self.start)
+
+        found = summary(self.ch.id, 1, "minute", self.start,
+                        self.start + timedelta(days=1))
+        floats = [v for v, _ in values]
+        self.assertEqual(found["count"], 600)
+        self.assertEqual((found["min"], found["max"]),
+                         (min(floats), max(floats)))
+        self.assertAlmostEqual(found["mean"], statistics.mean(floats))
+        self.assertAlmostEqual(found["stddev"], statistics.pstdev(floats))
+
+        self.assertIsNone(summary(self.ch.id, 1, "hour", self.start
+                                  - timedelta(days=1), self.start))
+
+    def test_read_api_edges(self):
+        """The buckets merged from the rollups hold the values of the range
+        requested, like the ones computed from the values.
+        """
+
+        values = [(random.uniform(-5, 5), random.randrange(100))
+                  for _ in range(900)]
+        self.upload(values[:450], self.start)
+        self.upload(values[450:], self.start + timedelta(seconds=20 * 450))
+
+        start = self.start + timedelta(minutes=7, seconds=30)
+        end = self.start + timedelta(hours=4, minutes=3, seconds=50)
+        expected = [v for i, (_, v) in enumerate(values)
+                    if start <= self.start + timedelta(seconds=20 * i) <= end]
+
+        def totals(max_points):
+            response = Client().get("/{}/data/".format(self.ch.id), {
+                "start": start.timestamp(), "end": end.timestamp(),
+                "fields": "2", "downsampling": "buckets",
+                "max_points": max_points})
+            found = response.json()["fields"][0]["buckets"]
+            return (sum(b[4] for b in found), min(b[1] for b in found),
+                    max(b[2] for b in found),
+                    round(sum(b[3] * b[4] for b in found)))
+
+        # Buckets of 4 minutes, merged from the minute and the hour rollups
+        # (whose buckets aren't within the range), and of the values.
+        self.assertEqual(totals(60), totals(2000))
+        self.assertEqual(totals(60), (len(expected), min(expected),
+                                      max(expected), sum(expected)))
+        self.assertEqual(totals(3)[0], len(expected))
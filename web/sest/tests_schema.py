@@ -0,0 +1,86 @@
+from django.test import TestCase, Client, override_settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .models import *
+from .cache import ChannelCache
+
+
+class SchemaCache(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.u = User.objects.create(username="test")
+        self.ch = Channel.objects.create(user=self.u,
+                                         number_fields=3
+                                         )
+        self.channel_uuid = str(self.ch.write_key)
+        for i in range(1, 4):
+            self.ch.fieldmetadata_set.create(field_no=i, encoding="float",
+                                             name="f{}".format(i))
+
+    def metadata_queries_on_upload(self, d):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                "/{}/".format(self.ch.id), d,
+                HTTP_X_SEST_WRITE_KEY=self.channel_uuid)
+        self.assertEqual(response.status_code, 200)
+        return [q for q in ctx.captured_queries
+                if "sest_fieldmetadata" in q["sql"]]
+
+    def test_no_metadata_queries_when_decoding(self):
+        r = Record.objects.create(channel=self.ch)
+        r.field_set.create(field_no=1, val=3)
+        r.field_set.create(field_no=2, val=4)
+
+        r = Record.objects.get(pk=r.pk)
+        fields = list(r.field_set.all())
+
+        with self.assertNumQueries(0):
+            self.assertEqual([f.val for f in fields], [3.0, 4.0])
+            self.assertEqual(self.ch.get_encoding(1), "float")
+            self.assertEqual(self.ch.get_field_names(), ("f1", "f2", "f3"))
+
+    def test_metadata_read_once_on_upload(self):
+        self.assertEqual(len(self.metadata_queries_on_upload(
+            {"field1": 1, "field2": 2, "field3": 3})), 1)
+        self.assertEqual(len(self.metadata_queries_on_upload(
+            {"field1": 1, "field2": 2, "field3": 3})), 0)
+
+    def test_invalidate_on_field_metadata_changes(self):
+        self.assertEqual(self.ch.get_encoding(1), "float")
+
+        fm = self.ch.fieldmetadata_set.get(field_no=1)
+        fm.encoding = "string"
+        fm.save()
+        self.assertEqual(self.ch.get_encoding(1), "string")
+
+        fm.delete()
+        with self.assertRaises(FieldMetadata.DoesNotExist):
+            self.ch.get_encoding(1)
+
+
+class ChannelCacheEviction(TestCase):
+
+    def test_least_recently_used_evicted(self):
+        loaded = []
+        cache = ChannelCache(lambda k: loaded.append(k) or k, max_size=2)
+
+        cache.get(1)
+        cache.get(2)
+        cache.get(1)
+        cache.get(3)
+        self.assertEqual(len(cache), 2)
+
+        cache.get(1)
+        cache.get(2)
+        self.assertEqual(loaded, [1, 2, 3, 2])
+
+    @override_settings(CHANNEL_CACHE_TTL=0)
+    def test_expired_entries_reloaded(self):
+        loaded = []
+        cache = ChannelCache(lambda k: loaded.append(k) or k)
+
+        cache.get(1)
+        cache.get(1)
+        self.assertEqual(loaded, [1, 1])
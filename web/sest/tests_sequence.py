@@ -0,0 +1,98 @@
+from django.test import TestCase, Client
+from django.core import mail
+
+from .models import *
+from .views import messages
+from .sequence import advance, WINDOW
+
+import json
+
+
+class SequenceWindow(TestCase):
+
+    def test_advance(self):
+        high, bitmap = -1, 0
+        received = []
+        for seq in (0, 1, 3, 1, 2, 3, 70, 8, 8):
+            new, high, bitmap = advance(high, bitmap, seq)
+            received.append(new)
+
+        self.assertEqual(received, [True, True, True, False, True, False,
+                                    True, True, False])
+        self.assertEqual(high, 70)
+
+    def test_counter_restarted(self):
+        """Numbers below the window come from a device that rebooted."""
+
+        new, high, bitmap = advance(1000, 1, 1000 - WINDOW)
+        self.assertTrue(new)
+        self.assertEqual((high, bitmap), (1000 - WINDOW, 1))
+
+
+class IdempotentUpload(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.u = User.objects.create(username="test")
+        self.ch = Channel.objects.create(user=self.u,
+                                         number_fields=1
+                                         )
+        self.channel_uuid = str(self.ch.write_key)
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="int")
+
+    def post(self, d, seq):
+        return self.client.post("/{}/".format(self.ch.id), d,
+                                HTTP_X_SEST_WRITE_KEY=self.channel_uuid,
+                                HTTP_X_SEST_SEQUENCE=seq)
+
+    def post_batch(self, records):
+        return self.client.post("/{}/".format(self.ch.id),
+                                json.dumps(records),
+                                content_type="application/json",
+                                HTTP_X_SEST_WRITE_KEY=self.channel_uuid)
+
+    def test_retry_dropped(self):
+        """A record sent again with the same sequence number is neither saved
+        nor reacted to twice.
+        """
+
+        self.ch.notification_email = NotificationEmail.objects.create(
+            user=self.u, address="test@example.com")
+        self.ch.save()
+        self.ch.conditionandreaction_set.create(condition_op="gt", field_no=1,
+                                                val=10, action="email")
+
+        self.assertEqual(self.post({"field1": 42}, "7").content,
+                         b"Record saved.")
+        response = self.post({"field1": 42}, "7")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"Record already received.")
+        self.assertEqual(Record.objects.count(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+        self.post({"field1": 43}, "8")
+        self.assertEqual(Record.objects.count(), 2)
+
+    def test_batch_duplicates_dropped(self):
+        self.post_batch([{"field1": 1, "seq": 1}, {"field1": 2, "seq": 2}])
+        response = self.post_batch([{"field1": 2, "seq": 2},
+                                    {"field1": 3, "seq": 3},
+                                    {"field1": 3, "seq": 3},
+                                    {"field1": 4}])
+
+        self.assertEqual(response.content,
+                         b"2 records saved. 2 records already received.")
+        self.assertEqual(sorted(f.val for f in Field.objects.all()),
+                         [1, 2, 3, 4])
+
+    def test_wrong_sequence(self):
+        for sequence in ("-1", "²", "١٢"):
+            response = self.post({"field1": 1}, sequence)
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.content.decode(),
+                             messages["WRONG_SEQUENCE"])
+        response = self.post_batch([{"field1": 1, "seq": "²"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Record.objects.count(), 0)
@@ -0,0 +1,149 @@
+from django.test import TestCase, Client
+from django.utils import timezone
+
+from .models import *
+from .views import messages
+from .downsample import lttb, lttb_stream, buckets
+from .ingest import ingest_batch
+
+import csv
+import io
+import math
+import random
+from datetime import timedelta
+
+
+class Downsampling(TestCase):
+
+    def test_lttb(self):
+        points = [(t, math.sin(t / 10)) for t in range(1000)]
+        points[500] = (500, 50)
+
+        sampled = lttb(points, 100)
+        self.assertEqual(len(sampled), 100)
+        self.assertEqual((sampled[0], sampled[-1]), (points[0], points[-1]))
+        self.assertEqual(sampled, sorted(sampled))
+        # The spike stands out, and it's kept.
+        self.assertIn((500, 50), sampled)
+
+        self.assertEqual(lttb(points[:10], 100), points[:10])
+
+    def test_lttb_stream(self):
+        points = [(t, random.uniform(-5, 5)) for t in range(1000)]
+        for n in (3, 10, 99, 100, 500):
+            self.assertEqual(lttb_stream(iter(points[:n]), n, 50),
+                             lttb(points[:n], 50))
+
+        # Points saved after counting them.
+        sampled = lttb_stream(iter(points), 900, 50)
+        self.assertEqual(len(sampled), 50)
+        self.assertEqual((sampled[0], sampled[-1]), (points[0], points[-1]))
+        self.assertEqual(sampled, sorted(sampled))
+
+    def test_buckets(self):
+        points = sorted((random.uniform(0, 100), random.uniform(-5, 5))
+                        for _ in range(1000))
+
+        found = buckets(points, 0, 100, 10)
+        self.assertEqual(sum(b[4] for b in found), len(points))
+        for start, low, high, avg, count in found:
+            values = [v for t, v in points if start <= t < start + 10]
+            self.assertEqual((low, high, count),
+                             (min(values), max(values), len(values)))
+            self.assertAlmostEqual(avg, sum(values) / len(values))
+
+
+class ReadAPI(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.u = User.objects.create(username="test")
+        self.ch = Channel.objects.create(user=self.u, number_fields=3)
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float",
+                                         name="temperature")
+        self.ch.fieldmetadata_set.create(field_no=2, encoding="int")
+        self.ch.fieldmetadata_set.create(field_no=3, encoding="string")
+        # At the start of a minute, like the buckets of the rollups.
+        self.start = (timezone.now() - timedelta(days=1)).replace(
+            second=0, microsecond=0)
+
+        ingest_batch(self.ch, [
+            {"field1": i / 10, "field2": i, "field3": "s",
+             "timestamp": (self.start + timedelta(minutes=i)).timestamp()}
+            for i in range(600)])
+
+    def get(self, **params):
+        params.setdefault("start", self.start.timestamp())
+        # None leaves the parameter out.
+        params = {k: v for k, v in params.items() if v is not None}
+        return self.client.get("/{}/data/".format(self.ch.id), params)
+
+    def test_all_points(self):
+        response = self.get(max_points=1000)
+        self.assertEqual(response.status_code, 200)
+
+        data = response.json()
+        self.assertEqual([f["field_no"] for f in data["fields"]], [1, 2])
+        temperature = data["fields"][0]
+        self.assertEqual(temperature["name"], "temperature")
+        self.assertFalse(temperature["downsampled"])
+        self.assertEqual(len(temperature["points"]), 600)
+        self.assertEqual(temperature["points"][1],
+                         [(self.start + timedelta(minutes=1)).timestamp(),
+                          0.1])
+
+    def test_lttb(self):
+        data = self.get(fields="2", max_points=50).json()
+        field = data["fields"][0]
+        self.assertTrue(field["downsampled"])
+        self.assertEqual(len(field["points"]), 50)
+        self.assertEqual(field["points"][-1][1], 599)
+
+    def test_buckets(self):
+        end = self.start + timedelta(minutes=600)
+        data = self.get(fields="2", max_points=60, downsampling="buckets",
+                        end=end.isoformat()).json()
+        found = data["fields"][0]["buckets"]
+        self.assertEqual(len(found), 60)
+        self.assertEqual(found[0][1:], [0, 9, 4.5, 10])
+
+    def test_range(self):
+        end = self.start + timedelta(minutes=99, seconds=30)
+        data = self.get(fields="1", end=end.timestamp()).json()
+        self.assertEqual(len(data["fields"][0]["points"]), 100)
+
+    def test_csv(self):
+        response = self.get(fields="2", max_points=10, format="csv")
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.reader(io.StringIO(response.content.decode())))
+        self.assertEqual(rows[0], ["field_no", "time", "value"])
+        self.assertEqual(len(rows), 11)
+
+    def test_queries_per_field(self):
+        self.get()
+        with self.assertNumQueries(2):
+            self.get(max_points=1000)
+        # The points, and their number for LTTB.
+        with self.assertNumQueries(4):
+            self.get(max_points=10)
+
+    def test_wrong_parameters(self):
+        for params, message in (
+                ({"start": "yesterday"}, "WRONG_RANGE"),
+                ({"end": self.start.timestamp() - 1}, "WRONG_RANGE"),
+                ({"start": None, "end": "0001-01-01T00:00:00+00:00"},
+                 "WRONG_RANGE"),
+                ({"start": None, "end": "0001-01-01T00:00:00"},
+                 "WRONG_RANGE"),
+                ({"fields": "3"}, "WRONG_FIELDS_REQUESTED"),
+                ({"fields": "1,x"}, "WRONG_FIELDS_REQUESTED"),
+                ({"max_points": "2"}, "WRONG_MAX_POINTS"),
+                ({"downsampling": "avg"}, "WRONG_DOWNSAMPLING"),
+                ({"format": "xml"}, "WRONG_FORMAT")):
+            response = self.get(**params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.content.decode(), messages[message])
+
+    def test_unknown_channel(self):
+        response = self.client.get("/{}/data/".format(self.ch.id + 1))
+        self.assertEqual(response.status_code, 404)
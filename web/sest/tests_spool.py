@@ -0,0 +1,159 @@
+from django.test import TestCase, Client, override_settings
+from django.conf import settings
+from django.core import mail
+from django.core.management import call_command
+
+from .models import *
+from .spool import Spool, get_spool, drain, _spools
+
+import os
+import shutil
+import sqlite3
+import tempfile
+from io import StringIO
+
+
+class LockedSpool(Spool):
+    """Spool that is locked the first time it's read."""
+
+    locked = True
+
+    def peek(self, limit):
+        if self.locked:
+            self.locked = False
+            raise sqlite3.OperationalError("database is locked")
+        return super().peek(limit)
+
+
+class QueuedUpload(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        spool_path = os.path.join(self.tmp_dir, "spool.sqlite3")
+        self.settings_override = override_settings(
+            INGEST_MODE="queue", INGEST_SPOOL_PATH=spool_path)
+        self.settings_override.enable()
+
+        self.client = Client()
+        self.u = User.objects.create(username="test")
+        recipient = self.u.notificationemail_set.create(
+            address=settings.DEFAULT_FROM_EMAIL)
+        self.ch = Channel.objects.create(user=self.u,
+                                         number_fields=2,
+                                         notification_email=recipient
+                                         )
+        self.channel_uuid = str(self.ch.write_key)
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float")
+        self.ch.fieldmetadata_set.create(field_no=2, encoding="float")
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.tmp_dir)
+
+    def post(self, d, **kwargs):
+        return self.client.post("/{}/".format(self.ch.id), d,
+                                HTTP_X_SEST_WRITE_KEY=self.channel_uuid,
+                                **kwargs)
+
+    def test_upload_queued_then_saved(self):
+        response = self.post({"field1": 21.5, "field2": 3})
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Record.objects.count(), 0)
+        self.assertEqual(len(get_spool()), 1)
+
+        self.assertEqual(drain(get_spool()), 1)
+        self.assertEqual(len(get_spool()), 0)
+        self.assertEqual(sorted(f.val for f in Field.objects.all()),
+                         [3.0, 21.5])
+
+    def test_batch_queued_with_timestamps(self):
+        response = self.post("field1=1&timestamp=1482230083\nfield1=2\n",
+                             content_type="text/plain")
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(get_spool()), 2)
+
+        drain(get_spool())
+        first = Record.objects.order_by("insertion_time").first()
+        self.assertEqual(first.insertion_time.timestamp(), 1482230083)
+        self.assertEqual(Record.objects.count(), 2)
+
+    def test_wrong_values_not_queued(self):
+        response = self.post({"field1": "asdf"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(get_spool()), 0)
+
+    def test_drain_in_batches_and_react(self):
+        self.ch.conditionandreaction_set.create(condition_op="gt",
+                                                field_no=1,
+                                                val=10,
+                                                action="email"
+                                                )
+        for v in (1, 20, 30):
+            self.post({"field1": v})
+
+        self.assertEqual(drain(get_spool(), batch_size=2), 2)
+        self.assertEqual(Record.objects.count(), 2)
+        self.assertEqual(len(mail.outbox), 1)
+
+        out = StringIO()
+        call_command("drain_ingest_spool", once=True, stdout=out)
+        self.assertEqual(Record.objects.count(), 3)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_sequence_kept_if_not_queued(self):
+        """A record that can't be queued isn't taken as received."""
+
+        missing = os.path.join(self.tmp_dir, "missing", "spool.sqlite3")
+        with self.settings(INGEST_SPOOL_PATH=missing), \
+                self.assertRaises(sqlite3.OperationalError):
+            self.post({"field1": 1}, HTTP_X_SEST_SEQUENCE="1")
+
+        response = self.post({"field1": 1}, HTTP_X_SEST_SEQUENCE="1")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(get_spool()), 1)
+
+    def test_command_retries(self):
+        self.post({"field1": 1})
+        _spools[settings.INGEST_SPOOL_PATH] = LockedSpool(
+            settings.INGEST_SPOOL_PATH)
+        self.addCleanup(_spools.pop, settings.INGEST_SPOOL_PATH)
+
+        out, err = StringIO(), StringIO()
+        call_command("drain_ingest_spool", once=True, interval=0, stdout=out,
+                     stderr=err)
+        self.assertIn("database is locked", err.getvalue())
+        self.assertEqual(out.getvalue(), "1 records saved.\n")
+        self.assertEqual(Record.objects.count(), 1)
+
+    def test_records_of_deleted_channels_dropped(self):
+        spool = Spool(settings.INGEST_SPOOL_PATH)
+        spool.append(self.ch.id + 1, [(None, {1: "3"})])
+
+        self.assertEqual(drain(spool), 1)
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(Record.objects.count(), 0)
+
+    def test_failing_records_set_aside(self):
+        """Records that can't be saved, or read, are moved out of the way of
+        the ones queued after them.
+        """
+
+        spool = Spool(settings.INGEST_SPOOL_PATH)
+        spool.append(self.ch.id, [(None, {1: "1"})])
+        # Appended without being validated.
+        spool.append(self.ch.id, [(None, {1: "abc"})])
+        spool._conn.execute("INSERT INTO spool (channel_id, insertion_time, "
+                            "fields) VALUES (?, 0, 'garbage')", (self.ch.id,))
+        spool.append(self.ch.id, [(None, {2: "2"})])
+
+        with self.assertLogs("sest.spool", "WARNING") as logs:
+            self.assertEqual(drain(spool), 4)
+        self.assertEqual(len(logs.records), 2)
+
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(spool.failed(), 2)
+        self.assertEqual(sorted(f.val for f in Field.objects.all()), [1, 2])
+        self.assertEqual(drain(spool), 0)
@@ -0,0 +1,60 @@
+from django.test import TestCase, Client
+
+from .models import *
+
+
+class TypedStorage(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.u = User.objects.create(username="test")
+        self.ch = Channel.objects.create(user=self.u,
+                                         number_fields=3
+                                         )
+        self.channel_uuid = str(self.ch.write_key)
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float")
+        self.ch.fieldmetadata_set.create(field_no=2, encoding="int")
+        self.ch.fieldmetadata_set.create(field_no=3, encoding="string")
+
+    def post(self, d):
+        return self.client.post("/{}/".format(self.ch.id), d,
+                                HTTP_X_SEST_WRITE_KEY=self.channel_uuid)
+
+    def test_numbers_stored_in_typed_columns(self):
+        self.post({"field1": "21.5", "field2": "40.7", "field3": "ok"})
+
+        f1, f2, f3 = Field.objects.order_by("field_no")
+        self.assertEqual((f1._value, f1._value_real, f1._value_int),
+                         ("", 21.5, None))
+        self.assertEqual((f2._value, f2._value_real, f2._value_int),
+                         ("", None, 40))
+        self.assertEqual((f3._value, f3._value_real, f3._value_int),
+                         ("ok", None, None))
+        self.assertEqual([f.val for f in (f1, f2, f3)], [21.5, 40, "ok"])
+
+    def test_field_save_stores_typed_columns(self):
+        r = Record.objects.create(channel=self.ch)
+        f = r.field_set.create(field_no=1, val="3.5")
+
+        f = Field.objects.get(pk=f.pk)
+        self.assertEqual((f._value, f._value_real), ("", 3.5))
+
+        f.val = "4"
+        f.save()
+        self.assertEqual(Field.objects.get(pk=f.pk).val, 4.0)
+
+    def test_not_finite_numbers_stored_as_strings(self):
+        self.post({"field1": "nan"})
+
+        f = Field.objects.get()
+        self.assertEqual((f._value, f._value_real), ("nan", None))
+        self.assertNotEqual(f.val, f.val)
+
+    def test_range_filtered_by_the_db(self):
+        for v in (1, 5, 10):
+            self.post({"field1": v, "field2": v * 10})
+
+        self.assertEqual(Field.objects.filter(field_no=1)
+                         .value_between(2, 10).count(), 2)
+        self.assertEqual(Field.objects.filter(field_no=2)
+                         .value_between(10, 50).count(), 2)
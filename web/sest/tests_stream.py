@@ -0,0 +1,102 @@
+from django.test import TestCase, Client, override_settings
+
+from .models import *
+from .views import messages
+from .stream import iter_lines, ingest_stream
+
+import io
+import json
+
+
+class StreamUpload(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.u = User.objects.create(username="test")
+        self.channels = []
+        for _ in range(2):
+            ch = Channel.objects.create(user=self.u, number_fields=1)
+            ch.fieldmetadata_set.create(field_no=1, encoding="float")
+            self.channels.append(ch)
+
+    def line(self, ch, **fields):
+        fields.update({"channel": ch.id, "write_key": str(ch.write_key)})
+        return json.dumps(fields)
+
+    def post_stream(self, lines):
+        return self.client.post("/stream/", "\n".join(lines),
+                                content_type="application/x-ndjson")
+
+    def test_stream_many_channels(self):
+        ch1, ch2 = self.channels
+        lines = [self.line(ch1, field1=1), self.line(ch2, field1=2),
+                 "", self.line(ch1, field1=3, timestamp=1482230083)]
+        response = self.post_stream(lines)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"lines": 3, "saved": 3,
+                                           "queued": 0, "failed": 0,
+                                           "errors": [], "errors_omitted": 0})
+        self.assertEqual(ch1.record_set.count(), 2)
+        self.assertEqual(ch2.record_set.count(), 1)
+
+    def test_stream_errors_reported_per_line(self):
+        ch1, ch2 = self.channels
+        wrong_key = json.dumps({"channel": ch2.id, "write_key": "x",
+                                "field1": 2})
+        lines = [self.line(ch1, field1=1), wrong_key, "not json",
+                 self.line(ch1, field1="asdf"), self.line(ch1, field1=5)]
+        summary = self.post_stream(lines).json()
+
+        self.assertEqual(summary["saved"], 2)
+        self.assertEqual(summary["failed"], 3)
+        self.assertEqual(summary["errors"], [
+            {"line": 2, "error": messages["WRONG_WRITE_KEY"]},
+            {"line": 3, "error": messages["WRONG_BATCH_FORMAT"]},
+            {"line": 4, "error": messages["WRONG_VALUE_FIELD_ENCODING"]},
+        ])
+
+    def test_stream_values_out_of_range(self):
+        """Channels and timestamps out of the range of the DB and of the
+        datetimes are errors of their lines, and don't stop the stream.
+        """
+
+        ch1, _ = self.channels
+        huge_channel = json.dumps({"channel": 10 ** 40, "write_key": "x",
+                                   "field1": 2})
+        lines = [self.line(ch1, field1=1), huge_channel,
+                 self.line(ch1, field1=2, timestamp=1e20),
+                 '{{"channel": {}, "write_key": "{}", "field1": 3, '
+                 '"timestamp": NaN}}'.format(ch1.id, ch1.write_key),
+                 '{"channel": Infinity, "write_key": "x", "field1": 4}',
+                 self.line(ch1, field1=5)]
+        response = self.post_stream(lines)
+
+        self.assertEqual(response.status_code, 200)
+        summary = response.json()
+        self.assertEqual(summary["saved"], 2)
+        self.assertEqual(summary["errors"], [
+            {"line": 2, "error": messages["UNKNOWN_CHANNEL"]},
+            {"line": 3, "error": messages["WRONG_TIMESTAMP"]},
+            {"line": 4, "error": messages["WRONG_TIMESTAMP"]},
+            {"line": 5, "error": messages["UNKNOWN_CHANNEL"]},
+        ])
+
+    @override_settings(STREAM_BATCH_SIZE=2, STREAM_MAX_ERRORS=1)
+    def test_stream_saved_in_batches(self):
+        ch1, _ = self.channels
+        lines = "\n".join([self.line(ch1, field1=i) for i in range(5)] +
+                          ["x", "y"])
+
+        summary = ingest_stream(io.BytesIO(lines.encode()))
+
+        self.assertEqual(summary.saved, 5)
+        self.assertEqual(len(summary.errors), 1)
+        self.assertEqual(summary.errors_omitted, 1)
+        self.assertEqual(ch1.record_set.count(), 5)
+
+    def test_long_lines_skipped(self):
+        stream = io.BytesIO(b"short\n" + b"x" * 50 + b"\nlast")
+
+        self.assertEqual(list(iter_lines(stream, 20)),
+                         [b"short\n", None, b"last"])
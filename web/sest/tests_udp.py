@@ -0,0 +1,193 @@
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db import connection, connections
+
+from .models import *
+from .views import messages
+from .udp import IngestProtocol, process_datagrams
+from .spool import Spool, drain
+from .credentials import get_channel
+from .schema import get_schema
+from .signals import invalidate_channel
+
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Datagrams(TestCase):
+
+    def setUp(self):
+        self.u = User.objects.create(username="test")
+        self.ch = Channel.objects.create(user=self.u,
+                                         number_fields=2
+                                         )
+        self.channel_uuid = str(self.ch.write_key)
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float")
+        self.ch.fieldmetadata_set.create(field_no=2, encoding="int")
+
+    def datagram(self, fields, write_key=None):
+        return "{} {} {}".format(self.ch.id, write_key or self.channel_uuid,
+                                 fields).encode()
+
+    def test_batch_saved(self):
+        replies = process_datagrams([
+            (self.datagram("field1=21.5&field2=43"), "a"),
+            (self.datagram("field1=22&timestamp=1486000000"), "b"),
+        ])
+
+        self.assertEqual(replies, [("a", b"OK"), ("b", b"OK")])
+        self.assertEqual(Record.objects.count(), 2)
+        self.assertEqual(Field.objects.count(), 3)
+        self.assertEqual(Record.objects.filter(
+            insertion_time__year=2017).count(), 1)
+
+    def test_errors_replied(self):
+        replies = process_datagrams([
+            (self.datagram("field2=nope"), "a"),
+            (self.datagram("field1=1&timestamp=yesterday"), "b"),
+            (self.datagram("field1=1"), "c"),
+        ])
+
+        self.assertEqual(replies, [
+            ("a", messages["WRONG_VALUE_FIELD_ENCODING"].encode()),
+            ("b", messages["WRONG_TIMESTAMP"].encode()),
+            ("c", b"OK"),
+        ])
+        self.assertEqual(Record.objects.count(), 1)
+
+    def test_unauthenticated_not_replied(self):
+        """Datagrams that fail the authentication, including the ones out of
+        the range of the DB, get no reply and don't stop the others.
+        """
+
+        replies = process_datagrams([
+            (b"garbage", "a"),
+            (self.datagram("field1=1", write_key="wrong"), "b"),
+            ("{} x field1=1".format("9" * 40).encode(), "c"),
+            (self.datagram("field1=1&timestamp=1e20"), "d"),
+            (self.datagram("field1=1"), "e"),
+        ])
+
+        self.assertEqual(replies, [
+            ("d", messages["WRONG_TIMESTAMP"].encode()),
+            ("e", b"OK"),
+        ])
+        self.assertEqual(Record.objects.count(), 1)
+
+    def test_queued(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        spool_path = os.path.join(tmp_dir, "spool.sqlite3")
+
+        with override_settings(INGEST_MODE="queue",
+                               INGEST_SPOOL_PATH=spool_path):
+            replies = process_datagrams([
+                (self.datagram("field1=21.5"), "a"),
+                (self.datagram("field2=nope"), "b"),
+            ])
+
+        self.assertEqual(replies, [
+            ("b", messages["WRONG_VALUE_FIELD_ENCODING"].encode()),
+            ("a", b"OK"),
+        ])
+        self.assertEqual(Record.objects.count(), 0)
+        self.assertEqual(drain(Spool(spool_path)), 1)
+        self.assertEqual(Field.objects.get().val, 21.5)
+
+    def test_protocol_settings(self):
+        protocol = IngestProtocol(None, flush_interval=0)
+        self.assertEqual(protocol.flush_interval, 0)
+
+
+class FailingRecords(TransactionTestCase):
+    """Batches that can't be saved with a single transaction, which needs
+    the constraints checked at the commit.
+    """
+
+    def setUp(self):
+        self.u = User.objects.create(username="test")
+        self.channels = [Channel.objects.create(user=self.u, number_fields=1)
+                         for _ in range(2)]
+        for ch in self.channels:
+            ch.fieldmetadata_set.create(field_no=1, encoding="int")
+
+    def datagram(self, ch, fields):
+        return "{} {} {}".format(ch.id, ch.write_key, fields).encode()
+
+    def test_records_saved_one_at_a_time(self):
+        ok, deleted = self.channels
+        get_channel(deleted.id)
+        get_schema(deleted.id)
+
+        # Deleted by another process, so that this one still has the
+        # channel in its caches.
+        self.addCleanup(invalidate_channel, Channel, deleted)
+        with connection.cursor() as cursor:
+            for model, column in ((FieldMetadata, "channel_id"),
+                                  (Channel, "id")):
+                cursor.execute("DELETE FROM {} WHERE {} = %s".format(
+                    model._meta.db_table, column), [deleted.id])
+
+        with self.assertLogs("sest.udp", "WARNING"):
+            replies = process_datagrams([
+                (self.datagram(ok, "field1=1"), "b"),
+                (self.datagram(deleted, "field1=2"), "c"),
+                (self.datagram(ok, "field1=3"), "d"),
+            ])
+
+        self.assertEqual(replies, [("b", b"OK"), ("d", b"OK")])
+        self.assertEqual(sorted(f.val for f in Field.objects.all()), [1, 3])
+
+
+class Listener(TransactionTestCase):
+    """Datagrams sent to a listener on localhost. The records are saved by
+    another thread, hence the TransactionTestCase.
+    """
+
+    def setUp(self):
+        self.u = User.objects.create(username="test")
+        self.ch = Channel.objects.create(user=self.u,
+                                         number_fields=1
+                                         )
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="int")
+
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.loop = asyncio.new_event_loop()
+        self.transport, self.protocol = self.loop.run_until_complete(
+            self.loop.create_datagram_endpoint(
+                lambda: IngestProtocol(self.executor, batch_size=3,
+                                       flush_interval=0.05),
+                local_addr=("127.0.0.1", 0)))
+        self.address = self.transport.get_extra_info("sockname")
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(5)
+
+    def tearDown(self):
+        self.sock.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.transport.close()
+        self.executor.submit(lambda: connections.close_all()).result()
+        self.executor.shutdown()
+        self.loop.close()
+
+    def send(self, fields):
+        self.sock.sendto("{} {} {}".format(self.ch.id, self.ch.write_key,
+                                           fields).encode(), self.address)
+
+    def test_datagrams_saved_and_acknowledged(self):
+        for i in range(5):
+            self.send("field1={}".format(i))
+
+        replies = [self.sock.recv(1024) for _ in range(5)]
+
+        self.assertEqual(replies, [b"OK"] * 5)
+        self.assertEqual(
+            sorted(f.val for f in Field.objects.all()), list(range(5)))
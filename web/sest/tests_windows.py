@@ -0,0 +1,155 @@
+from django.test import TestCase
+from django.core import mail
+from django.utils import timezone
+
+from .models import *
+from .windows import RollingWindow, windows
+
+import random
+from datetime import timedelta
+
+
+class Windows(TestCase):
+
+    def test_aggregates(self):
+        """The aggregates kept up to date match the ones of the values in
+        the window.
+        """
+
+        for size, seconds in ((5, None), (None, 10), (20, 10)):
+            window = RollingWindow(size, seconds)
+            pushed = []
+            t = 0
+            for _ in range(3000):
+                t += random.choice((0.5, 1, 2))
+                v = random.uniform(-100, 100)
+                window.push(t, v)
+                pushed.append((t, v))
+
+                expected = [(ti, vi) for ti, vi in pushed[-size if size
+                                                          else 0:]
+                            if seconds is None or t - ti <= seconds]
+                values = [vi for _, vi in expected]
+                self.assertEqual(window.aggregate("count"), len(values))
+                self.assertEqual(window.aggregate("min"), min(values))
+                self.assertEqual(window.aggregate("max"), max(values))
+                self.assertAlmostEqual(window.aggregate("avg"),
+                                       sum(values) / len(values))
+                if len(expected) > 1:
+                    (t0, v0), (t1, v1) = expected[0], expected[-1]
+                    self.assertAlmostEqual(window.aggregate("rate"),
+                                           (v1 - v0) / (t1 - t0))
+
+    def test_out_of_order(self):
+        """Values older than the newest one go in their place, or out of
+        the window.
+        """
+
+        for size, seconds in ((5, None), (None, 10), (20, 10)):
+            window = RollingWindow(size, seconds)
+            pushed = []
+            for i in range(300):
+                t = i + random.choice((0, 0, 0, -3, -8, -15))
+                v = random.uniform(-100, 100)
+                window.push(t, v)
+                pushed.append((t, v))
+
+                newest = max(ti for ti, _ in pushed)
+                expected = sorted(pushed, key=lambda s: s[0])
+                expected = [(ti, vi) for ti, vi in
+                            expected[-size if size else 0:]
+                            if seconds is None or newest - ti <= seconds]
+                values = [vi for _, vi in expected]
+                self.assertEqual(window.aggregate("count"), len(values))
+                self.assertEqual(window.aggregate("min"), min(values))
+                self.assertEqual(window.aggregate("max"), max(values))
+                self.assertAlmostEqual(window.aggregate("avg"),
+                                       sum(values) / len(values))
+
+    def test_empty(self):
+        window = RollingWindow(seconds=10)
+        self.assertEqual(window.aggregate("count"), 0)
+        self.assertIsNone(window.aggregate("avg"))
+        window.push(0, 1)
+        self.assertIsNone(window.aggregate("rate"))
+
+
+class WindowedConditions(TestCase):
+
+    def setUp(self):
+        self.u = User.objects.create(username="test")
+        ne = NotificationEmail.objects.create(user=self.u,
+                                              address="whatever@test.it")
+        self.ch = Channel.objects.create(user=self.u,
+                                         number_fields=1,
+                                         notification_email=ne
+                                         )
+        self.ch.fieldmetadata_set.create(field_no=1, encoding="float")
+        self.start = timezone.now() - timedelta(hours=1)
+
+    def upload(self, values, seconds=1):
+        """Save and check a record for each value, `seconds' apart, and
+        return the number of emails sent.
+        """
+
+        sent = len(mail.outbox)
+        for v in values:
+            r = Record.objects.create(channel=self.ch,
+                                      insertion_time=self.start)
+            f = r.field_set.create(field_no=1, val=str(v))
+            # The states are cached once committed (see debounce.py).
+            with self.captureOnCommitCallbacks(execute=True):
+                self.ch.check_and_react(r, fields=[f])
+            self.start += timedelta(seconds=seconds)
+        return len(mail.outbox) - sent
+
+    def condition(self, **kwargs):
+        return self.ch.conditionandreaction_set.create(field_no=1,
+                                                       action="email",
+                                                       **kwargs)
+
+    def test_moving_average(self):
+        self.condition(condition_op="gt", val=10, aggregate="avg",
+                       window_size=3)
+        # A single spike doesn't move the average enough.
+        self.assertEqual(self.upload([0, 0, 25, 0, 0]), 0)
+        self.assertEqual(self.upload([20, 20, 20]), 2)
+
+    def test_rate(self):
+        self.condition(condition_op="gt", val=1, aggregate="rate",
+                       window_seconds=10)
+        self.assertEqual(self.upload([0, 1, 2, 3], seconds=2), 0)
+        self.assertEqual(self.upload([10], seconds=2), 1)
+
+    def test_count(self):
+        self.condition(condition_op="ge", val=3, aggregate="count",
+                       window_seconds=60)
+        self.assertEqual(self.upload([1, 1], seconds=10), 0)
+        self.assertEqual(self.upload([1], seconds=100), 1)
+        self.assertEqual(self.upload([1], seconds=1), 0)
+
+    def test_filled_from_db(self):
+        self.condition(condition_op="lt", val=5, aggregate="max",
+                       window_size=4)
+        self.upload([10, 1, 1])
+
+        # Another process, or a restart, fills the window with the values
+        # already saved.
+        windows.invalidate()
+        self.assertEqual(self.upload([1]), 0)
+        self.assertEqual(self.upload([1]), 1)
+
+    def test_checked_without_queries(self):
+        self.condition(condition_op="gt", val=10, aggregate="avg",
+                       window_size=3)
+        self.upload([1])
+
+        r = Record.objects.create(channel=self.ch)
+        fields = [Field(record=r, field_no=1, val="2")]
+        with self.assertNumQueries(0):
+            self.ch.check_and_react(r, fields=fields)
+
+    def test_stateful_aggregate(self):
+        self.condition(condition_op="gt", val=10, aggregate="min",
+                       window_size=2, on_transition=True)
+        self.assertEqual(self.upload([20, 20, 20, 20]), 1)
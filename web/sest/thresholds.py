@@ -0,0 +1,179 @@
+"""Indexes of the numeric conditions on a field, to find the ones satisfied
+by a value in O(log n + matches) instead of checking them one by one.
+
+The entries indexed are (position, condition) tuples, where the position is
+the order of the condition among the ones of the channel: lookups can return
+either all the entries matched, or only the one with the lowest position.
+"""
+
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+
+
+def _minima(entries):
+    """Return the list of the running minima of the entries: item i is the
+    lowest entry among entries[:i], or None for i = 0.
+    """
+
+    minima = [None]
+    for e in entries:
+        minima.append(e if minima[-1] is None else min(minima[-1], e))
+    return minima
+
+
+class ThresholdIndex:
+    """Conditions `value <operation> threshold' sharing the operation (one
+    of lt, le, eq, ne, gt, ge), sorted by threshold.
+
+    The conditions satisfied by a value always make up one or two ranges of
+    the sorted thresholds, found by bisection; the lowest position in each
+    range is read from the running minima computed in advance from both
+    ends of the list.
+    """
+
+    def __init__(self, operation, entries):
+        # `entries' are (threshold, position, condition) tuples.
+        entries = sorted(entries, key=itemgetter(0, 1))
+        self.operation = operation
+        self.thresholds = [t for t, _, _ in entries]
+        self.entries = [(position, cond) for _, position, cond in entries]
+
+        # prefix_min[i] is the lowest entry among entries[:i], suffix_min[i]
+        # the lowest among entries[i:].
+        self.prefix_min = _minima(self.entries)
+        self.suffix_min = _minima(reversed(self.entries))[::-1]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _ranges(self, v):
+        n = len(self.thresholds)
+        if self.operation == "lt":
+            return [(bisect_right(self.thresholds, v), n)]
+        elif self.operation == "le":
+            return [(bisect_left(self.thresholds, v), n)]
+        elif self.operation == "gt":
+            return [(0, bisect_left(self.thresholds, v))]
+        elif self.operation == "ge":
+            return [(0, bisect_right(self.thresholds, v))]
+
+        low = bisect_left(self.thresholds, v)
+        high = bisect_right(self.thresholds, v)
+        if self.operation == "eq":
+            return [(low, high)]
+        # ne
+        return [(0, low), (high, n)]
+
+    def matches(self, v):
+        """Return the entries satisfied by the value `v'."""
+
+        found = []
+        for start, end in self._ranges(v):
+            found.extend(self.entries[start:end])
+        return found
+
+    def first(self, v):
+        """Return the entry with the lowest position satisfied by the value
+        `v', or None.
+        """
+
+        best = None
+        n = len(self.entries)
+        for start, end in self._ranges(v):
+            if start >= end:
+                continue
+            elif start == 0:
+                e = self.prefix_min[end]
+            elif end == n:
+                e = self.suffix_min[start]
+            else:
+                # Conditions with the same threshold, for eq.
+                e = min(self.entries[start:end])
+
+            if best is None or e < best:
+                best = e
+        return best
+
+
+class IntervalTree:
+    """Centered interval tree of open intervals (low, high), with
+    low < high, to find the ones containing a value.
+
+    Every node keeps the intervals that contain its center, sorted both by
+    low and by high bound, and its children the ones entirely on either
+    side of it.
+    """
+
+    def __init__(self, intervals):
+        # `intervals' are (low, high, position, condition) tuples.
+        intervals = list(intervals)
+        self.size = len(intervals)
+        self.root = self._build(intervals)
+
+    def __len__(self):
+        return self.size
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+
+        # The median of the midpoints lies inside at least one interval, so
+        # every node takes at least one of them.
+        midpoints = sorted(low / 2 + high / 2
+                           for low, high, _, _ in intervals)
+        center = midpoints[len(midpoints) // 2]
+
+        left, here, right = [], [], []
+        for interval in intervals:
+            low, high = interval[:2]
+            if high <= center:
+                left.append(interval)
+            elif low >= center:
+                right.append(interval)
+            else:
+                here.append(interval)
+
+        if not here:
+            # Bounds so close that no float lies between them: keep them all
+            # in a node without a center, checked one by one.
+            return (None, intervals, None, None, None)
+
+        return (center,
+                sorted(here, key=itemgetter(0)),
+                sorted(here, key=itemgetter(1), reverse=True),
+                self._build(left),
+                self._build(right))
+
+    def stab(self, v):
+        """Return the (position, condition) tuples of the intervals that
+        contain `v'.
+        """
+
+        found = []
+        node = self.root
+        while node is not None:
+            center, by_low, by_high, left, right = node
+            if center is None:
+                found.extend((position, cond)
+                             for low, high, position, cond in by_low
+                             if low < v < high)
+                break
+            elif v < center:
+                # Every interval here ends after the center, hence after v.
+                for low, _, position, cond in by_low:
+                    if low >= v:
+                        break
+                    found.append((position, cond))
+                node = left
+            elif v > center:
+                for _, high, position, cond in by_high:
+                    if high <= v:
+                        break
+                    found.append((position, cond))
+                node = right
+            else:
+                found.extend((position, cond)
+                             for _, _, position, cond in by_low)
+                break
+
+        return found
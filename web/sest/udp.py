@@ -0,0 +1,235 @@
+"""Listener of UDP datagrams carrying records, for sensors that upload too
+often to afford an HTTP request for each sample.
+
+Every datagram holds a single record, sent as the id of the channel, its
+write key and the fields, form-encoded as in the body of a POST to the channel
+view (a timestamp can be added as well), separated by spaces:
+
+    3 e2af5d04-f62b-4fc6-ae50-049c3ecfaa18 field1=21.5&field2=43
+
+The datagrams received are collected by the event loop and saved in batches,
+with a transaction each, by a worker thread: the ORM can't be used from the
+thread running the loop. Once the batch is saved, the listener replies to each
+datagram with "OK" or with the reason why it has been refused, but to the
+ones with a wrong channel or write key, which are dropped silently: anyone
+could forge their source address, and have the replies reflected to it.
+
+If a batch can't be saved, its records are saved one at a time, and the ones
+that still fail get no reply, so that the sensors send them again. When
+INGEST_MODE is "queue", the records are appended to the spool instead (see
+spool.py).
+"""
+
+from django.conf import settings
+from django.db import OperationalError, InterfaceError
+from django.http import QueryDict
+
+from .ingest import (IngestError, messages, authenticate, parse_timestamp,
+                     validate_record, TIMESTAMP_KEY, store_grouped,
+                     react_to_records)
+from .spool import get_spool
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+REPLY_OK = b"OK"
+
+
+def authenticate_datagram(data):
+    """Return the channel a datagram is sent to, if its write key is right,
+    and its fields.
+    """
+
+    try:
+        channel_id, write_key, fields = data.decode("utf-8").split(None, 2)
+    except ValueError:
+        # Not utf-8, or less than three parts.
+        raise IngestError(messages["WRONG_DATAGRAM"])
+
+    return authenticate(channel_id, write_key), fields
+
+
+def validate_datagram(channel, fields):
+    """Return the validated record of the fields of a datagram."""
+
+    fields = QueryDict(fields.strip()).dict()
+    timestamp = fields.pop(TIMESTAMP_KEY, None)
+    if timestamp is not None:
+        timestamp = parse_timestamp(timestamp)
+
+    return timestamp, validate_record(channel, fields)
+
+
+def _group(accepted):
+    by_channel = {}
+    for channel, validated, addr in accepted:
+        by_channel.setdefault(channel, []).append((validated, addr))
+    return by_channel
+
+
+def store_datagrams(accepted):
+    """Save the (channel, validated record, address) tuples of the datagrams
+    accepted with a single transaction, then check their reactions, and
+    return the addresses of the ones saved.
+
+    If the batch can't be saved, its records are saved one at a time, as
+    `spool.drain' does, and the ones that fail are logged.
+    """
+
+    try:
+        stored = store_grouped({
+            channel: [validated for validated, _ in records]
+            for channel, records in _group(accepted).items()})
+        saved = [addr for _, _, addr in accepted]
+    except (OperationalError, InterfaceError):
+        # The DB is unavailable (or locked): the records aren't to blame.
+        raise
+    except Exception:
+        stored, saved = [], []
+        for channel, validated, addr in accepted:
+            try:
+                stored.extend(store_grouped({channel: [validated]}))
+            except (OperationalError, InterfaceError):
+                logger.exception("Datagrams not saved.")
+                break
+            except Exception as e:
+                logger.warning("Datagram from %s not saved: %r", addr, e)
+            else:
+                saved.append(addr)
+
+    for channel, records in stored:
+        react_to_records(channel, records)
+    return saved
+
+
+def queue_datagrams(accepted):
+    """Append the records of the datagrams accepted to the spool, as
+    `store_datagrams' saves them, and return the addresses of the ones
+    queued.
+    """
+
+    spool = get_spool()
+    queued = []
+    for channel, records in _group(accepted).items():
+        try:
+            spool.append(channel.id,
+                         [validated for validated, _ in records])
+        except Exception:
+            logger.exception("Datagrams of channel %d not queued.",
+                             channel.id)
+        else:
+            queued.extend(addr for _, addr in records)
+    return queued
+
+
+def process_datagrams(datagrams):
+    """Validate and save a batch of (data, address) tuples, with a single
+    transaction. Return the list of (address, reply) to send back.
+
+    The datagrams without the right write key get no reply: their source
+    address can be forged, and the replies would be sent to someone else.
+    Neither do the ones that couldn't be saved.
+    """
+
+    accepted = []
+    replies = []
+    for data, addr in datagrams:
+        try:
+            channel, fields = authenticate_datagram(data)
+        except IngestError:
+            continue
+
+        try:
+            validated = validate_datagram(channel, fields)
+        except IngestError as e:
+            replies.append((addr, str(e).encode("utf-8")))
+            continue
+
+        accepted.append((channel, validated, addr))
+
+    if accepted:
+        save = (queue_datagrams if settings.INGEST_MODE == "queue" else
+                store_datagrams)
+        replies.extend((addr, REPLY_OK) for addr in save(accepted))
+
+    return replies
+
+
+class IngestProtocol(asyncio.DatagramProtocol):
+    """Collect the datagrams received, and hand them to `process' (run by
+    `executor') in batches of `batch_size', or after `flush_interval' seconds
+    from the first datagram of the batch.
+
+    When more than `max_pending' datagrams are waiting (because the DB can't
+    keep up), the new ones are dropped.
+    """
+
+    def __init__(self, executor, batch_size=None, flush_interval=None,
+                 max_pending=None, process=process_datagrams):
+        self.executor = executor
+        self.process = process
+        self.batch_size = (settings.UDP_BATCH_SIZE if batch_size is None
+                           else batch_size)
+        self.flush_interval = (settings.UDP_FLUSH_INTERVAL
+                               if flush_interval is None else flush_interval)
+        self.max_pending = (settings.UDP_MAX_PENDING if max_pending is None
+                            else max_pending)
+
+        self.transport = None
+        self.pending = []
+        self.in_flight = 0
+        self.dropped = 0
+        self._timer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_event_loop()
+
+    def datagram_received(self, data, addr):
+        if len(self.pending) + self.in_flight >= self.max_pending:
+            self.dropped += 1
+            return
+
+        self.pending.append((data, addr))
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = self.loop.call_later(self.flush_interval,
+                                               self.flush)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, []
+        self.in_flight += len(batch)
+
+        future = self.loop.run_in_executor(self.executor, self.process,
+                                           batch)
+        future.add_done_callback(
+            lambda f: self._batch_done(f, len(batch)))
+
+    def _batch_done(self, future, n_datagrams):
+        self.in_flight -= n_datagrams
+
+        try:
+            replies = future.result()
+        except Exception:
+            logger.exception("Batch of %d datagrams not saved.", n_datagrams)
+            return
+
+        if self.transport is None or self.transport.is_closing():
+            return
+
+        for addr, reply in replies:
+            self.transport.sendto(reply, addr)
+
+    def connection_lost(self, exc):
+        self.transport = None
@@ -1,33 +1,44 @@
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import (HttpResponse, HttpResponseBadRequest, Http404,
+                         JsonResponse, StreamingHttpResponse)
 from django.shortcuts import render, get_object_or_404
 from django.views import generic
 from django.conf import settings
+from django.db import transaction
 from django.views.decorators.csrf import csrf_exempt
+from django.contrib.admin.views.decorators import staff_member_required
 
 from .models import *
-
-import re
-
-field_pattern = re.compile(r"(field[0-9]+)")
-field_extract_number = re.compile(r"field([0-9]+)")
+from .ingest import (IngestError, parse_batch, validate_record,
+                     validate_batch, validate_numbered_batch,
+                     parse_sequence, pop_sequences, drop_duplicates,
+                     ingest_record, ingest_validated)
+from . import binary
+from .stream import request_stream, ingest_stream
+from .spool import get_spool
+from .credentials import get_channel
+from .dispatch import get_dispatcher
+from .digest import get_digests
+from .series import QueryError, parse_query, read_series, write_csv
+from .export import parse_export, export_chunks, CONTENT_TYPES
+from . import ingest, series, export
 
 # https://docs.djangoproject.com/en/1.10/ref/request-response
 #                                               /#django.http.HttpRequest.META
 HTTP_WRITE_KEY = "X_SEST_Write_Key".upper()
+# Optional sequence number of the record uploaded (see sequence.py).
+HTTP_SEQUENCE = "X_SEST_Sequence".upper()
+
+# Content types of the requests that upload many records at once.
+BATCH_CONTENT_TYPES = ("application/json", "text/plain")
 
 messages = {
-    "NUMBER_FIELDS_EXCEEDED": "Max number of fields exceeded.",
-    "WRONG_WRITE_KEY": ("Incorrect SEST write key associated with the "
-                        "channel you have chosen."),
-    "MISSING_WRITE_KEY": "Missing writing API key.",
     "WRONG_HTTP_METHOD": "Only GET and POST requests are allowed.",
-    "WRONG_FIELDS_PASSED": "One or more fields sent have wrong names.",
-    "WRONG_VALUE_FIELD_ENCODING": ("One of the value sent was not coherent "
-                                   "with the encoding defined for the field "
-                                   "number for the channel, or the channel is"
-                                   "not defined to handle that field number."),
-    "EMPTY_VALUES_NOT_ALLOWED": "Fields with empty values are not allowed."
 }
+# The messages about the authentication and the validation of the records are
+# shared with the ingest module.
+messages.update(ingest.messages)
+messages.update(series.messages)
+messages.update(export.messages)
 
 
 class IndexView(generic.ListView):
@@ -57,6 +68,29 @@ def channel(request, channel_id):
 
         field2=42
 
+    Many records can be uploaded with a single request, by sending a body
+    with a JSON or a text/plain content type (see `ingest.parse_batch'):
+
+        POST /12345678/ HTTP/1.1
+        X-Sest-Write-Key: e2af5d04-f62b-4fc6-ae50-049c3ecfaa18
+        Content-Type: text/plain
+        Content-Length: 68
+
+        field1=21.5&field2=42&timestamp=1482230083
+        field1=21.7&field2=41
+
+    Devices can also send a compact binary frame, with the content type
+    application/x-sest-binary (see binary.py).
+
+    To let the devices retry the uploads whose reply got lost, a record can
+    carry a sequence number, in the X-Sest-Sequence header or in the "seq"
+    key of the records of a batch: the records already received are
+    dropped, and the view replies as if they had been saved (see
+    sequence.py).
+
+    When INGEST_MODE is "queue", the records are only validated and queued
+    (see spool.py), and the view replies with 202 Accepted.
+
 
     Reference for the HTTP status codes
     https://www.w3.org/Protocols/rfc2616/rfc2616-sec10.html
@@ -65,24 +99,26 @@ def channel(request, channel_id):
     http://racksburg.com/choosing-an-http-status-code/
     """
 
-    channel = get_object_or_404(Channel, pk=channel_id)
-
     if request.method == "GET":
+        channel = get_object_or_404(Channel, pk=channel_id)
         n_elements_display = 20
 
-        records_to_display = (Record.objects
-                              .filter(channel=channel_id)
-                              .order_by("-insertion_time")
-                              [:n_elements_display]
-                              )
-
-        records_to_display.field_names = channel.get_field_names()
-        context = {"last_records_uploaded": records_to_display}
+        # The rows come decoded, in the order of the names of the fields,
+        # with a constant number of queries.
+        context = {"last_records_uploaded":
+                   channel.last_rows(n_elements_display),
+                   "field_names": channel.get_field_names()}
         return render(request, "sest/channel.html", context)
 
     elif request.method != "POST":
         return HttpResponseBadRequest(messages["WRONG_HTTP_METHOD"])
 
+    # Read the channel from the cache, so that uploads with a wrong write key
+    # are refused without querying the DB.
+    channel = get_channel(channel_id)
+    if channel is None:
+        raise Http404("No channel with id {}.".format(channel_id))
+
     write_API_key = request.META.get("HTTP_{}".format(HTTP_WRITE_KEY))
 
     if not write_API_key:
@@ -91,52 +127,186 @@ def channel(request, channel_id):
     if str(channel.write_key) != write_API_key:
         return HttpResponseBadRequest(messages["WRONG_WRITE_KEY"])
 
-    # Use a regex to select only the fields like 'field<number>'.
-    fields = {k: v for (k, v) in request.POST.items()
-              if field_pattern.match(k)}
-
-    if len(fields) > settings.MAX_NUMBER_FIELDS:
-        return HttpResponseBadRequest(messages["NUMBER_FIELDS_EXCEEDED"])
-
-    elif len(fields) < len(request.POST.keys()):
-        # This means that the user inserted at least one field with an
-        # incorrect name.
-        return HttpResponseBadRequest(messages["WRONG_FIELDS_PASSED"])
-
-    elif any(fields):
-        # The object has to be created before attaching fields objects to it.
-        r = Record.objects.create(channel=channel)
-
-        for field_name, val in fields.items():
-            # 'field_name' and 'val' are strings like 'field2' and '3.5'.
-
-            # Store in the db only the fields with a value. Clean up in case.
-            if not val:
-                r.delete()
-                return HttpResponseBadRequest(
-                    messages["EMPTY_VALUES_NOT_ALLOWED"]
-                )
-
-            # Extract the field number, to store it to the right position.
-            field_no = field_extract_number.findall(field_name)[0]
-            field_no = int(field_no)
-
-            try:
-                r.field_set.create(field_no=field_no, val=val)
-            except ValueError:
-                # A value with a wrong encoding (according to the associated
-                # encoding in the FieldMetadata object on the field number) was
-                # going to be saved.
-                r.delete()
-                return HttpResponseBadRequest(
-                    messages["WRONG_VALUE_FIELD_ENCODING"]
-                )
-
-        # Save the object again with the new fields added, in order to possibly
-        # trigger an action.
-        r.save()
-        return HttpResponse("Record saved.")
-
-    else:
-        # This means that the user tried to insert an empty record.
-        return HttpResponseBadRequest(messages["WRONG_FIELDS_PASSED"])
+    if (request.content_type in BATCH_CONTENT_TYPES or
+            request.content_type == binary.CONTENT_TYPE):
+        return _upload_batch(request, channel)
+
+    try:
+        sequence = request.META.get("HTTP_{}".format(HTTP_SEQUENCE))
+        if sequence is not None:
+            sequence = parse_sequence(sequence)
+
+        if settings.INGEST_MODE == "queue":
+            validated = [(None, validate_record(channel,
+                                                request.POST.dict()))]
+            if not _queue(channel, validated, [sequence]):
+                return HttpResponse("Record already received.")
+            return HttpResponse("Record queued.", status=202)
+
+        record = ingest_record(channel, request.POST.dict(),
+                               sequence=sequence)
+    except IngestError as e:
+        return HttpResponseBadRequest(str(e))
+
+    if record is None:
+        return HttpResponse("Record already received.")
+    return HttpResponse("Record saved.")
+
+
+def _upload_batch(request, channel):
+    """Save all the records sent in the body of the request, or none of them
+    in case at least one is not valid.
+    """
+
+    sequences = None
+    try:
+        if request.content_type == binary.CONTENT_TYPE:
+            validated = validate_numbered_batch(
+                channel, binary.parse_frame(request.body))
+        else:
+            records = parse_batch(request.body, request.content_type)
+            sequences = pop_sequences(records)
+            validated = validate_batch(channel, records)
+    except IngestError as e:
+        return HttpResponseBadRequest(str(e))
+
+    if settings.INGEST_MODE == "queue":
+        n_queued = _queue(channel, validated, sequences)
+        return HttpResponse(
+            "{} records queued.{}".format(
+                n_queued, _duplicates_note(len(validated) - n_queued)),
+            status=202)
+
+    records = ingest_validated(channel, validated, sequences)
+    return HttpResponse("{} records saved.{}".format(
+        len(records), _duplicates_note(len(validated) - len(records))))
+
+
+def _queue(channel, validated, sequences=None):
+    """Append the records to the spool, dropping the ones already received.
+    Return the number of records queued.
+    """
+
+    if sequences is None or all(s is None for s in sequences):
+        if validated:
+            get_spool().append(channel.id, validated)
+        return len(validated)
+
+    # The records are appended before the sequence numbers are committed: if
+    # the spool fails, they're rolled back, and the retry of the device isn't
+    # dropped as a duplicate.
+    with transaction.atomic():
+        validated = drop_duplicates(channel, validated, sequences)
+        if validated:
+            get_spool().append(channel.id, validated)
+    return len(validated)
+
+
+def _duplicates_note(n_duplicates):
+    if not n_duplicates:
+        return ""
+    return " {} records already received.".format(n_duplicates)
+
+
+def channel_data(request, channel_id):
+    """Return the values of the numeric fields of the channel over a range
+    of time, as JSON or CSV, downsampled to at most `max_points' for each
+    field (see series.py):
+
+        GET /12345678/data/?start=1488326400&fields=1&max_points=500
+
+        {"channel": 12345678, "start": 1488326400.0, "end": 1488931200.0,
+         "downsampling": "lttb",
+         "fields": [{"field_no": 1, "name": "temperature",
+                     "downsampled": true,
+                     "points": [[1488326401.0, 21.5], ...]}]}
+    """
+
+    if request.method != "GET":
+        return HttpResponseBadRequest(messages["WRONG_HTTP_METHOD"])
+
+    channel = get_channel(channel_id)
+    if channel is None:
+        raise Http404("No channel with id {}.".format(channel_id))
+
+    try:
+        query = parse_query(channel.id, request.GET)
+    except QueryError as e:
+        return HttpResponseBadRequest(str(e))
+
+    data = read_series(query)
+    if query.format == "csv":
+        response = HttpResponse(content_type="text/csv")
+        write_csv(data, response)
+        return response
+    return JsonResponse(data)
+
+
+def channel_export(request, channel_id):
+    """Stream the records of the channel, in a range of time or all of them,
+    as CSV or NDJSON (see export.py):
+
+        GET /12345678/export/?start=1488326400&format=csv
+
+        2017-03-01 00:00:01 UTC,1338,22.0,43.0
+        ...
+    """
+
+    if request.method != "GET":
+        return HttpResponseBadRequest(messages["WRONG_HTTP_METHOD"])
+
+    channel = get_channel(channel_id)
+    if channel is None:
+        raise Http404("No channel with id {}.".format(channel_id))
+
+    try:
+        query = parse_export(channel.id, request.GET)
+    except QueryError as e:
+        return HttpResponseBadRequest(str(e))
+
+    response = StreamingHttpResponse(export_chunks(query),
+                                     content_type=CONTENT_TYPES[query.format])
+    filename = "channel-{}.{}".format(channel.id, query.format)
+    response["Content-Disposition"] = 'attachment; filename="{}"'.format(
+        filename)
+    return response
+
+
+@csrf_exempt
+def stream(request):
+    """Save a stream of records, one JSON object per line, possibly for many
+    channels (see stream.py):
+
+        POST /stream/ HTTP/1.1
+        Content-Type: application/x-ndjson
+        Transfer-Encoding: chunked
+
+        {"channel": 3, "write_key": "e2af5d04-...", "field1": 21.5}
+        {"channel": 4, "write_key": "0b8a4c44-...", "field2": 7}
+
+    The records are saved in batches while the body is read, and the reply
+    summarizes the result, with the number of the lines that failed:
+
+        {"lines": 2, "saved": 1, "queued": 0, "failed": 1,
+         "errors": [{"line": 2, "error": "Incorrect SEST write key..."}],
+         "errors_omitted": 0}
+    """
+
+    if request.method != "POST":
+        return HttpResponseBadRequest(messages["WRONG_HTTP_METHOD"])
+
+    summary = ingest_stream(request_stream(request))
+    return JsonResponse(summary.as_dict())
+
+
+@staff_member_required
+def reactions_status(request):
+    """Report the depth and the lag of the queue of the reactions of this
+    process, when REACTIONS_MODE is "pool" (see dispatch.py), and the
+    digests waiting when it's "digest".
+    """
+
+    status = dict(get_dispatcher().stats(), mode=settings.REACTIONS_MODE)
+    if settings.REACTIONS_MODE == "digest":
+        status["digests"] = get_digests().stats()
+    return JsonResponse(status)
@@ -0,0 +1,272 @@
+"""Rolling windows of the values of the fields, for the conditions on an
+aggregate of the last values rather than on the value just uploaded.
+
+A ConditionAndReaction with an `aggregate' compares, instead of the value of
+its field, one of:
+* avg: the average of the values in the window;
+* min, max: the lowest and the highest of them;
+* rate: the change per second between the oldest and the newest;
+* count: their number;
+where the window holds the last `window_size' values, and/or the ones of the
+records collected in the last `window_seconds' seconds.
+
+Every window is updated as the records are checked, in O(1) amortized time:
+the sum of the values is kept along with them, and the minimum and the
+maximum with monotonic deques. The values of records older than the newest
+one in the window (e.g. imported by `import_channel_csv') are the
+exception: they're dropped if they fall out of the window, or else the
+window is computed again with them in their place.
+
+The windows of a channel are filled with the last values of its fields,
+read from the DB, when they're loaded in the process-wide cache (see
+cache.py); they're loaded again after CHANNEL_CACHE_TTL, to include the
+records checked by the other processes.
+"""
+
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import ChannelCache
+from .schema import get_schema
+
+import bisect
+import math
+from collections import deque
+from datetime import timedelta
+
+AGGREGATES = ("avg", "min", "max", "rate", "count")
+
+
+def window_spec(cond):
+    """Return the (field number, size, seconds) of the window of the
+    condition.
+
+    Raise a ValueError in case the aggregate is not defined, or there's no
+    window.
+    """
+
+    if cond.aggregate not in AGGREGATES:
+        raise ValueError("No aggregate is defined for '{}'.".format(
+            cond.aggregate))
+    if not cond.window_size and not cond.window_seconds:
+        raise ValueError("No window is defined for the aggregate.")
+    return (cond.field_no, cond.window_size or None,
+            cond.window_seconds or None)
+
+
+def _numeric(v):
+    return (isinstance(v, (int, float)) and not isinstance(v, bool) and
+            math.isfinite(v))
+
+
+class RollingWindow:
+    """The last `size' values pushed, and/or the ones pushed with a time
+    within `seconds' from the last one.
+    """
+
+    # Sum the values again every so often, so that the rounding errors of
+    # the updates don't add up.
+    RESUM = 1024
+
+    def __init__(self, size=None, seconds=None):
+        self.size = size
+        self.seconds = seconds
+        # (number, time, value) of the values in the window; the number
+        # counts the values pushed.
+        self.samples = deque()
+        self.pushed = 0
+        self.total = 0.0
+        # (number, value) of the values that can still become the minimum,
+        # with increasing values, and of the ones that can become the
+        # maximum, with decreasing values.
+        self._min = deque()
+        self._max = deque()
+
+    def __len__(self):
+        return len(self.samples)
+
+    def _append(self, t, v):
+        n = self.pushed
+        self.pushed += 1
+        self.samples.append((n, t, v))
+        self.total += v
+
+        while self._min and self._min[-1][1] >= v:
+            self._min.pop()
+        self._min.append((n, v))
+        while self._max and self._max[-1][1] <= v:
+            self._max.pop()
+        self._max.append((n, v))
+
+    def push(self, t, v):
+        """Add a value to the window, in order of time.
+
+        Values older than the newest one (e.g. of records imported later)
+        are put in their place, computing the window again, unless they're
+        already out of it.
+        """
+
+        if self.samples and t < self.samples[-1][1]:
+            self._insert(t, v)
+            return
+
+        self._append(t, v)
+        self._evict(t)
+        if self.pushed % self.RESUM == 0:
+            self.total = math.fsum(v for _, _, v in self.samples)
+
+    def _insert(self, t, v):
+        newest = self.samples[-1][1]
+        if self.seconds is not None and newest - t > self.seconds:
+            return
+        if (self.size and len(self.samples) >= self.size and
+                t < self.samples[0][1]):
+            return
+
+        times = [ti for _, ti, _ in self.samples]
+        values = [(ti, vi) for _, ti, vi in self.samples]
+        values.insert(bisect.bisect_right(times, t), (t, v))
+
+        self.samples.clear()
+        self._min.clear()
+        self._max.clear()
+        self.total = 0.0
+        for ti, vi in values:
+            self._append(ti, vi)
+        self._evict(newest)
+        self.total = math.fsum(v for _, _, v in self.samples)
+
+    def _expired(self, now):
+        if self.size and len(self.samples) > self.size:
+            return True
+        return (self.seconds is not None and
+                now - self.samples[0][1] > self.seconds)
+
+    def _evict(self, now):
+        while self.samples and self._expired(now):
+            n, _, v = self.samples.popleft()
+            self.total -= v
+            if self._min[0][0] == n:
+                self._min.popleft()
+            if self._max[0][0] == n:
+                self._max.popleft()
+
+    def aggregate(self, name):
+        """Return the aggregate of the values in the window, or None if it
+        isn't defined for them (e.g. the average of no values).
+        """
+
+        if name == "count":
+            return len(self.samples)
+        if not self.samples:
+            return None
+
+        if name == "avg":
+            return self.total / len(self.samples)
+        elif name == "min":
+            return self._min[0][1]
+        elif name == "max":
+            return self._max[0][1]
+
+        # rate
+        _, t0, v0 = self.samples[0]
+        _, t1, v1 = self.samples[-1]
+        if t1 <= t0:
+            return None
+        return (v1 - v0) / (t1 - t0)
+
+
+class ChannelWindows:
+    """The windows of the conditions of a channel, keyed by (field number,
+    size, seconds).
+    """
+
+    def __init__(self, specs):
+        self.windows = {}
+        self.by_field = {}
+        for spec in specs:
+            field_no, size, seconds = spec
+            self.windows[spec] = RollingWindow(size, seconds)
+            self.by_field.setdefault(field_no, []).append(self.windows[spec])
+        # Highest primary key of the records already in the windows.
+        self.last_record = 0
+
+    def push(self, record_id, t, field_no, v):
+        if _numeric(v):
+            for window in self.by_field.get(field_no, ()):
+                window.push(t, float(v))
+        self.last_record = max(self.last_record, record_id or 0)
+
+    def update(self, record, fields):
+        """Push the values of the fields of the record to their windows,
+        unless it's already there.
+        """
+
+        if record.pk is not None and record.pk <= self.last_record:
+            return
+        t = record.insertion_time.timestamp()
+        for f in fields:
+            if f.field_no in self.by_field:
+                self.push(record.pk, t, f.field_no, f.val)
+
+    def aggregate(self, cond):
+        """Return the aggregate of the condition, or None if it has no
+        window, as the conditions not in the cache.
+        """
+
+        window = self.windows.get(window_spec(cond))
+        return None if window is None else window.aggregate(cond.aggregate)
+
+
+def _history(channel_id, field_no, specs):
+    """Return the last values of the field that can be in the windows, as
+    (record id, time, value) tuples, oldest first.
+    """
+
+    # Imported here since the models use this module.
+    from .models import Field, decode_value, stored_value
+
+    limit = max(size or settings.WINDOW_MAX_SAMPLES for _, size, _ in specs)
+    rows = Field.objects.filter(record__channel=channel_id,
+                                field_no=field_no)
+    if all(seconds for _, _, seconds in specs):
+        since = timezone.now() - timedelta(
+            seconds=max(seconds for _, _, seconds in specs))
+        rows = rows.filter(record__insertion_time__gte=since)
+    rows = (rows.order_by("-record__insertion_time", "-record_id")
+            .values_list("record_id", "record__insertion_time", "_value",
+                         "_value_real", "_value_int")[:limit])
+
+    encoding = get_schema(channel_id).encodings.get(field_no)
+    history = []
+    for record_id, t, value, real, integer in reversed(list(rows)):
+        try:
+            v = decode_value(encoding, stored_value(value, real, integer))
+        except (KeyError, ValueError):
+            continue
+        history.append((record_id, t.timestamp(), v))
+    return history
+
+
+def load_windows(channel_id):
+    from .conditions import get_conditions
+
+    specs = set()
+    for entries in get_conditions(channel_id).windowed.values():
+        for _, cond, _, _ in entries:
+            try:
+                specs.add(window_spec(cond))
+            except ValueError:
+                pass
+
+    windows = ChannelWindows(specs)
+    by_field = {}
+    for spec in specs:
+        by_field.setdefault(spec[0], []).append(spec)
+    for field_no, field_specs in by_field.items():
+        for record_id, t, v in _history(channel_id, field_no, field_specs):
+            windows.push(record_id, t, field_no, v)
+    return windows
+
+
+windows = ChannelCache(load_windows)
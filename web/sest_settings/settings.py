@@ -29,7 +29,102 @@ ALLOWED_HOSTS = ['testserver', '127.0.0.1', "sest.gq", "www.sest.gq", "*"]
 
 
 EMAIL_BACKEND = 'postmarker.django.EmailBackend'
+# Email backends the alerts are sent with, each one with its quota; when empty,
+# EMAIL_BACKEND is used (see sest/email_collection.py). The emails sent
+# together go in batches of EMAIL_BATCH_SIZE over a single connection, and a
+# provider that fails is skipped for EMAIL_PROVIDER_COOLDOWN seconds. The
+# quotas are counted by each process on its own.
+EMAIL_PROVIDERS = []
+EMAIL_BATCH_SIZE = 50
+EMAIL_PROVIDER_COOLDOWN = 300
 MAX_NUMBER_FIELDS = 3
+# Max number of records that can be uploaded with a single batch request.
+MAX_BATCH_RECORDS = 1000
+
+# Max number of channels whose data (e.g. the encodings of the fields) is kept
+# in the memory of each process, and number of seconds after which it has to be
+# read again from the DB.
+CHANNEL_CACHE_SIZE = 10000
+CHANNEL_CACHE_TTL = 60
+# Max number of values read from the DB to fill a window of the last seconds
+# of a field (see sest/windows.py).
+WINDOW_MAX_SAMPLES = 10000
+
+# With "sync", the records uploaded are saved to the DB during the request;
+# with "queue", they're appended to a local spool and saved in batches by the
+# `drain_ingest_spool' management command.
+INGEST_MODE = "sync"
+INGEST_SPOOL_PATH = os.path.join(BASE_DIR, "ingest_spool.sqlite3")
+# Max number of records moved from the spool to the DB with a transaction.
+INGEST_SPOOL_BATCH = 1000
+
+# Streams of records sent to /stream/ are saved every STREAM_BATCH_SIZE lines;
+# lines longer than STREAM_MAX_LINE bytes are refused, and only the first
+# STREAM_MAX_ERRORS errors are reported in the reply.
+STREAM_BATCH_SIZE = 500
+STREAM_MAX_LINE = 65536
+STREAM_MAX_ERRORS = 100
+
+# With "first", a record triggers only the action of the first condition of
+# the channel (in order of creation) it satisfies; with "all", the actions of
+# all of them.
+CONDITIONS_MATCH = "first"
+
+# With "sync", the actions of the conditions satisfied (e.g. the emails) run
+# within the upload request; with "pool", they're queued and run by
+# REACTIONS_WORKERS threads; with "outbox", they're written to the DB and
+# delivered by another process; with "digest", they're collected for each
+# recipient and sent in a single email (see sest/dispatch.py). When more than
+# REACTIONS_QUEUE_SIZE are waiting they run within the request again; a
+# warning is logged when they wait for more than REACTIONS_MAX_LAG seconds.
+REACTIONS_MODE = "sync"
+REACTIONS_WORKERS = 4
+REACTIONS_QUEUE_SIZE = 10000
+REACTIONS_MAX_LAG = 30
+# With REACTIONS_MODE = "outbox", the reactions are written to the DB with the
+# records, and sent in batches of OUTBOX_BATCH by `./manage.py
+# deliver_outbox'. Failed ones are retried after OUTBOX_BACKOFF seconds, then
+# twice as much every time up to OUTBOX_MAX_BACKOFF, for at most
+# OUTBOX_MAX_ATTEMPTS attempts. The ones being sent are skipped by the other
+# instances of the command for OUTBOX_CLAIM_TIMEOUT seconds, after which
+# they're sent again if the command sending them stopped.
+OUTBOX_BATCH = 100
+OUTBOX_BACKOFF = 30
+OUTBOX_MAX_BACKOFF = 3600
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_CLAIM_TIMEOUT = 600
+# With REACTIONS_MODE = "digest", every recipient gets an email DIGEST_WINDOW
+# seconds after the first reaction, listing up to DIGEST_MAX_RECORDS records.
+DIGEST_WINDOW = 600
+DIGEST_MAX_RECORDS = 100
+# Resolutions of the aggregates of the numeric fields updated as the records
+# are stored (see sest/rollups.py); an empty tuple disables them.
+ROLLUP_RESOLUTIONS = ("minute", "hour", "day")
+# The read API (see sest/series.py) returns the last READ_DEFAULT_RANGE
+# seconds unless asked otherwise, downsampled to READ_MAX_POINTS points for
+# each field, or to the number asked, up to READ_MAX_POINTS_LIMIT.
+READ_DEFAULT_RANGE = 86400
+READ_MAX_POINTS = 1000
+READ_MAX_POINTS_LIMIT = 10000
+# Rows fetched at a time by the exports of the history of a channel (see
+# sest/export.py), which bounds the memory they use.
+EXPORT_CHUNK_SIZE = 5000
+# Records saved by each transaction of `./manage.py import_channel_csv' (see
+# sest/importer.py).
+IMPORT_BATCH_SIZE = 10000
+# `./manage.py watch_inactivity' reads the records uploaded every
+# INACTIVITY_POLL seconds, to postpone the alerts of the channels with an
+# update interval (see sest/inactivity.py).
+INACTIVITY_POLL = 10
+
+# The UDP listener (./manage.py ingest_udp) saves the datagrams received in
+# batches of UDP_BATCH_SIZE, or every UDP_FLUSH_INTERVAL seconds, and drops the
+# new ones while more than UDP_MAX_PENDING are waiting to be saved.
+UDP_INGEST_HOST = "127.0.0.1"
+UDP_INGEST_PORT = 8789
+UDP_BATCH_SIZE = 500
+UDP_FLUSH_INTERVAL = 0.2
+UDP_MAX_PENDING = 20000
 
 
 # Application definition